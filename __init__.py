@@ -14,14 +14,17 @@ in the next position. Delete states connect only to the match and delete states
 in the next position. There is no insert state in the final model position, so
 the final match and delete states connect only to the general random state.
 
-   This package defines one function and one class.
-   The function:
+   This package defines two functions and one class.
+   The functions:
 -- generate_model_file(modelSize, outfile='new_pattern_model.py') This generates
 the options file for a profile HMM of the desired size, saving it to the
 specified location. The parameters in this generated model file should be filled
 out, specifying the desired pattern to search for. The model file then defines
 an object called 'model', which is an instance of the class defined below. This
 object should be imported by your run file, and any methods run from there.
+-- convert_model_file(infile, outfile=None) -- Converts a model file made by
+generate_model_file into the binary format described below, saving it with the
+same name ending in '.phmm' unless outfile is given.
 
    The class:
 -- Hmm(matchEmissions, transitionProbabilities) -- Both of these arguments are
@@ -50,6 +53,113 @@ of states that would generate the given sequence, returning a string.
 -- find_matches(sequence, minimumMatches=None, cleanSequence=True) -- Runs the
 current model on the given sequence, returning the information used to describe
 each match within the sequence.
+-- find_match_spans(sequence, minimumMatches=None, cleanSequence=True,
+scores=False) -- Finds the same matches as find_matches, but returns them
+compactly as an array holding the start, end and number of match states of each
+match in turn, without building lists of their states and symbols. This is much
+lighter when a long sequence holds many matches. If scores is True, an array of
+the natural log-odds score of each match is returned with the spans, as
+(spans, scores).
+-- find_paths_many(sequences, cleanSequence=True, workers=None) and
+find_matches_many(sequences, minimumMatches=None, cleanSequence=True,
+workers=None) -- Run find_path or find_matches on each of a list of sequences,
+returning a list of results in the same order. The work is shared between a
+pool of threads, one per CPU by default; the C extension releases the GIL while
+it runs, so these scale across cores.
+-- save(filename) and Hmm.load(filename) -- save() writes the model to a
+compact binary file holding its log transition probabilities and its emission
+probabilities. load() reads it back without executing any Python, memory-mapping
+the file so that the C extension reads the transitions straight from it, and a
+loaded model finds exactly the paths the original did. This is much faster than
+importing a model file when many models are loaded at once.
+-- fit(sequences, iterations=10, viterbiIterations=3, pseudocount=1.0,
+cleanSequence=True, workers=None, outfile=None) -- Re-estimates the match
+emission and transition probabilities from a list of example sequences. The
+first viterbiIterations rounds count the transitions and emissions along the
+most likely path through each sequence (Viterbi training), and the next
+iterations rounds count their expected use over every path (Baum-Welch
+training). Each round's counts are made in a pool of threads, one per CPU by
+default, and added up in arrays. Transitions with a probability of 0 stay
+impossible. The model is updated in place and, if outfile is given, written as
+a model file (if it ends in .py) or with save(). Returns the total score of the
+sequences before each round.
+-- compile(alphabet) -- Builds the tables used to search sequences made up of
+the given symbols. The tables for recently seen alphabets are kept in a cache
+(of size Hmm.maxCachedAlphabets), so repeated searches over the same alphabet
+skip this setup; this happens automatically, so calling compile() just does the
+work in advance. cache_info() returns the cache's hit and miss counts, and
+clear_cache() must be called if the model's probabilities are changed.
+-- iter_matches(source, alphabet=None, minimumMatches=None, cleanSequence=True,
+chunkSize=2**20) -- Finds the same matches as find_matches, but reads the
+sequence a chunk at a time from a file object, mmap or iterator of chunks. Each
+(index, states, symbols) match is yielded as soon as it is certain, so memory
+stays bounded on sequences of any length. The alphabet should be the set of all
+symbols in the sequence; it may be omitted if the source can be read twice.
+-- find_matches_indexed(index, minimumMatches=None) -- Finds the matches in the
+corpus held by a CorpusIndex, described below, returning them as find_matches
+does. Only the windows around places where at least minimumMatches of the match
+states could emit the symbols found there are searched, unless those windows
+would cover most of the corpus, when it is all searched in one pass.
+-- prefilterThreshold -- If this attribute is set to a number, find_matches and
+find_matches_many first score every ungapped alignment of the sequence to the
+model, and run the full algorithm only on the regions around alignments scoring
+at least this much (in natural log-odds). Sequences with no hit are skipped.
+This is much faster when most sequences hold no match, but may miss matches
+that only score well with gaps. prefilter_info() returns how many sequences and
+symbols passed each stage, and reset_prefilter_info() resets those counts.
+-- scorePrecision -- The C extension fills the Viterbi matrix with 'double'
+numbers by default. Setting this attribute to 'single' (32-bit floats) or
+'int16' (16-bit fixed point, in steps of 1/128) makes that faster, at the cost
+of rounding: where two paths score almost the same, a different one may be
+found. In 'int16' mode, scores more than about 192 below the best in their
+column are treated as impossible. The Python implementation ignores this attribute.
+-- collectStats -- If this attribute is set to True, every find_path and
+find_matches call records where its time went: cleaning the sequence, compiling
+the model's tables, encoding the sequence, prefiltering, loading it into the C
+extension, filling the Viterbi matrix, tracing the path back and finding the
+matches. The number of matrix cells filled, the bytes they took, and the cells
+filled per second are recorded too. stats_info() returns the totals over every
+call and reset_stats() resets them; if the statsCallback attribute is set to a
+function, it is also called with the dict recorded for each call. When this is
+off, nothing is timed.
+-- resultCacheSize, resultCacheBytes and resultCacheDir -- If resultCacheSize is
+set above 0, the path found by find_path (and so by find_matches,
+find_match_spans and the *_many methods) for each sequence is cached, keyed by
+a hash of the cleaned and encoded sequence and of the model's probabilities. A
+repeated sequence then skips the Viterbi algorithm entirely. At most
+resultCacheSize paths, holding at most resultCacheBytes states (256 MB by
+default), are kept in memory, and the least recently used are dropped first. If
+resultCacheDir is set to a directory, every path is also written there as a
+file, so the cache is shared by any processes using the same directory. Nothing
+is ever removed from the directory, so it grows without limit until it is
+cleared by hand. A path that can't be written there is simply not stored.
+result_cache_info() returns the hit, miss and eviction counts, and
+clear_result_cache() empties the in-memory cache. The model's probabilities are
+hashed the first time a result is cached, and the hash is kept: fit() and
+clear_cache() reset it, but if the probabilities are changed in any other way,
+clear_cache() must be called, or the old model's results will still be found.
+
+   When many models are to be searched against the same large sequence, it can
+be held in a CorpusIndex(sequence, cleanSequence=True). This stores the sequence
+encoded as 1 byte per symbol, with the positions of every symbol in it, so that
+find_matches_indexed only has to run the Viterbi algorithm near the rare symbols
+each model requires. index.save(filename) writes it to a file, and
+CorpusIndex.load(filename) memory-maps that file, so the corpus is never read
+into memory all at once. The sequence must be made up of single characters.
+index.positions(symbol) returns the sorted positions of a symbol; if numpy is
+installed, the index is built with it, and this is a read-only view of the
+index rather than a copy.
+
+   To search each sequence with a whole library of models, they can be held in
+a ModelLibrary(models), where models is a dict mapping each model's name to its
+Hmm, or a list of (name, Hmm) pairs. ModelLibrary.from_files(filenames) loads
+the model from each file written by generate_model_file, named after the file.
+library.scan(sequence, minimumMatches=None, cleanSequence=True, bestOnly=False,
+workers=None) cleans and encodes the sequence once, runs every model on it in a
+pool of threads (one per CPU by default), and returns a list of (name, index,
+states, symbols, score) for each match, sorted by index. The score is the
+natural log-odds score of the best path through that model emitting the match.
+With bestOnly=True, only the best scoring of any overlapping matches are kept.
 """
 
 __author__ = 'Dave Curran'
@@ -57,6 +167,8 @@ __version__ = '0.4'
 
 __packageName = 'patternHmm'
 
+import os
+
 try:
     import Viterbi
     from profileHmm import *
@@ -64,6 +176,9 @@ except ImportError:
     print "\nError importing Viterbi.so; will use a Python implementation instead."
     print "Note that this implementation requires numpy."
     from pyProfileHmm import *
+from src.corpusIndex import CorpusIndex
+from src.modelLibrary import ModelLibrary
+from src.profileHmm_base import _loadModelFile
     
 __all__ = []
 
@@ -81,6 +196,15 @@ def generate_model_file(modelSize, outfile='new_pattern_model.py', extra_attribs
     __generateOptions(modelSize, outfile, extra_attribs)
     print "\nWrote an options file to %s\n" %outfile
 
+def convert_model_file(infile, outfile=None):
+    """Loads the model defined in a file made by generate_model_file, and
+    saves it with Hmm.save(), so that Hmm.load() can read it back quickly. The
+    output file has the same name ending in .phmm unless outfile is given."""
+    model = _loadModelFile(infile)
+    if outfile is None: outfile = os.path.splitext(infile)[0] + '.phmm'
+    model.save(outfile)
+    print "\nWrote a binary model file to %s\n" % outfile
+
 def __generateOptions(modelSize, outfile, extra_attribs):
     alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
     buff = ["from %s import Hmm" % __packageName]
@@ -0,0 +1,278 @@
+"""Benchmarks the C and NumPy implementations of the Hmm object. Run it with:
+
+    python -m patternHmm.benchmark [options]
+
+   Each model is written by generate_model_file, with the match emissions then
+replaced by a random pattern over the benchmark's alphabet. Each sequence is
+random, with mutated copies of the pattern planted in it. For every combination
+of engine, model size, sequence length and alphabet size, the timings are taken
+in a separate process, so that its peak memory use can be measured. The best of
+several repeats is kept for each timing:
+-- setup -- Creating the Hmm object and compiling its tables for the alphabet.
+-- encode -- Converting the sequence into the symbol indices the engine uses.
+-- find_path -- find_path with cleanSequence=False; this includes encoding, the
+Viterbi matrix and the traceback. cellsPerSecond is based on this time.
+-- find_path_clean -- find_path with cleanSequence=True.
+-- find_matches -- find_matches with cleanSequence=False.
+
+   The results are printed, and saved as JSON if an output file is given. If a
+previous results file is given with --compare, the cells per second of every
+run found in both are compared, so that regressions between versions show up.
+"""
+import argparse
+import imp
+import json
+import multiprocessing
+import os
+import platform
+import Queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import patternHmm
+
+_symbols = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+_engines = ('c', 'numpy')
+# How often a child process is checked on while its result is awaited.
+_pollSeconds = 1.0
+
+
+def run_benchmarks(modelSizes, seqLengths, alphabetSizes, engines=_engines,
+                   repeats=3, seed=0, timeout=None):
+    """Times every combination of the given engines, model sizes, sequence
+    lengths and alphabet sizes, returning a list of the result dicts. A run
+    that takes more than timeout seconds is stopped, and recorded as an
+    error like one that fails or whose process dies."""
+    results = []
+    tempDir = tempfile.mkdtemp()
+    try:
+        for modelSize in modelSizes:
+            modelFile = os.path.join(tempDir, 'model%i.py' % modelSize)
+            _quietly(patternHmm.generate_model_file, modelSize, modelFile)
+            options = imp.load_source('benchmark_model%i' % modelSize, modelFile)
+            for alphabetSize in alphabetSizes:
+                alphabet = _symbols[:alphabetSize]
+                rand = random.Random('%s %i %i' % (seed, modelSize, alphabetSize))
+                pattern = [rand.choice(alphabet) for i in range(modelSize)]
+                emissions = dict(('M%i' % (i+1), {symb:1.0})
+                                 for i, symb in enumerate(pattern))
+                for seqLen in seqLengths:
+                    sequence = make_sequence(seqLen, alphabet, pattern, rand)
+                    for engine in engines:
+                        result = _runIsolated(engine, emissions,
+                                              options.transitionProbabilities,
+                                              sequence, alphabet, repeats,
+                                              timeout=timeout)
+                        result.update(engine=engine, modelSize=modelSize,
+                                      seqLength=seqLen, alphabetSize=alphabetSize)
+                        results.append(result)
+                        _printResult(result)
+    finally:
+        shutil.rmtree(tempDir)
+    return results
+
+def make_sequence(length, alphabet, pattern, rand, spacing=None):
+    """Returns a random string of the given length, with a mutated copy of
+    pattern planted every spacing symbols (10 times its length by default).
+    Each symbol of a copy is substituted, deleted or followed by an insert
+    with probability 0.05."""
+    seq = [rand.choice(alphabet) for i in xrange(length)]
+    spacing = spacing or 10 * len(pattern)
+    for start in xrange(rand.randrange(spacing), length - 2*len(pattern), spacing):
+        copy = []
+        for symb in pattern:
+            r = rand.random()
+            if r < 0.05: copy.append(rand.choice(alphabet))
+            elif r < 0.10: continue
+            elif r < 0.15: copy.extend((symb, rand.choice(alphabet)))
+            else: copy.append(symb)
+        seq[start:start+len(copy)] = copy
+    return ''.join(seq[:length])
+
+def compare_results(results, baseline):
+    """Returns a list of (key, baseline cells/s, cells/s, ratio) for every run
+    found in both lists of results."""
+    old = dict((_resultKey(result), result) for result in baseline)
+    comparison = []
+    for result in results:
+        prev = old.get(_resultKey(result))
+        if prev is None or not prev.get('cellsPerSecond'): continue
+        comparison.append((_resultKey(result), prev['cellsPerSecond'],
+                           result['cellsPerSecond'],
+                           result['cellsPerSecond'] / prev['cellsPerSecond']))
+    return comparison
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the C and NumPy Hmm engines.')
+    intList = lambda text: [int(num) for num in text.split(',')]
+    parser.add_argument('--model-sizes', type=intList, default=[10, 50, 200],
+                        help='comma-separated model sizes (default 10,50,200)')
+    parser.add_argument('--lengths', type=intList, default=[1000, 10000, 100000],
+                        help='comma-separated sequence lengths (default 1000,10000,100000)')
+    parser.add_argument('--alphabets', type=intList, default=[4, 20],
+                        help='comma-separated alphabet sizes, at most %i (default 4,20)'
+                        % len(_symbols))
+    parser.add_argument('--engines', type=lambda text: text.split(','),
+                        default=list(_engines), help='c, numpy or c,numpy (the default)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='the best of this many runs is kept (default 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float,
+                        help='seconds after which a run is stopped (default none)')
+    parser.add_argument('-o', '--output', help='file to save the results to as JSON')
+    parser.add_argument('--compare', help='a previous results file to compare against')
+    args = parser.parse_args(args)
+    if max(args.alphabets) > len(_symbols) or min(args.alphabets) < 1:
+        parser.error('alphabet sizes must be from 1 to %i' % len(_symbols))
+    if set(args.engines) - set(_engines):
+        parser.error('the engines must be c or numpy')
+
+    print '%-6s %6s %8s %4s %12s %9s %9s %10s %10s %10s' % (
+        'engine', 'model', 'length', 'abc', 'cells/s', 'setup(s)', 'encode(s)',
+        'path(s)', 'matches(s)', 'peakRSS(kB)')
+    results = run_benchmarks(args.model_sizes, args.lengths, args.alphabets,
+                             args.engines, args.repeats, args.seed, args.timeout)
+    _printSpeedups(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'version':patternHmm.__version__, 'python':sys.version,
+                       'platform':platform.platform(), 'time':time.time(),
+                       'seed':args.seed, 'results':results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print '\nCompared to %s (version %s):' % (args.compare, baseline.get('version'))
+        for key, old, new, ratio in compare_results(results, baseline['results']):
+            print '%-6s %6i %8i %4i %12.4g -> %12.4g  x%.2f' % (key + (old, new, ratio))
+
+
+# # # # #  Private Functions  # # # # #
+def _loadEngine(engine):
+    """Returns the Hmm class of the engine, or None if it can't be imported."""
+    try:
+        if engine == 'c':
+            from patternHmm.profileHmm import Hmm
+        else:
+            from patternHmm.pyProfileHmm import Hmm
+    except ImportError:
+        return None
+    return Hmm
+
+def _timeRuns(func, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _maxRssKb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss  # Bytes on OS X.
+
+def _benchmark(engine, emissions, transitions, sequence, alphabet, repeats):
+    """Takes the timings of one run. Called in a separate process."""
+    Hmm = _loadEngine(engine)
+    if Hmm is None:
+        return {'error':'the %s engine could not be imported' % engine}
+    result = {'startRssKb':_maxRssKb()}
+    def setup():
+        model = Hmm(emissions, transitions)
+        model.compile(alphabet)
+        return model
+    result['setup'] = _timeRuns(setup, repeats)
+    model = setup()
+    encoder = model._compiled(sorted(set(alphabet)))[0]
+    result['encode'] = _timeRuns(lambda: model._sequenceToInts(encoder, sequence), repeats)
+    result['find_path'] = _timeRuns(lambda: model.find_path(sequence, False), repeats)
+    result['find_path_clean'] = _timeRuns(lambda: model.find_path(sequence), repeats)
+    result['find_matches'] = _timeRuns(lambda: model.find_matches(sequence, None, False),
+                                       repeats)
+    result['matches'] = len(model.find_matches(sequence, None, False)[0])
+    result['cellsPerSecond'] = len(sequence) * model.modelSize / result['find_path']
+    result['peakRssKb'] = _maxRssKb()
+    return result
+
+def _benchmarkChild(queue, *args):
+    try:
+        queue.put(_benchmark(*args))
+    except Exception as e:
+        queue.put({'error':'%s: %s' % (type(e).__name__, e)})
+
+def _runIsolated(*args, **kwargs):
+    """Runs _benchmark in a child process and returns its result. If the child
+    exits without sending one, as when it is killed for running out of memory,
+    or is still running after kwargs['timeout'] seconds, an error result is
+    returned instead of waiting on it forever."""
+    timeout = kwargs.get('timeout')
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_benchmarkChild, args=(queue,) + args)
+    start = time.time()
+    proc.start()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=_pollSeconds)
+        except Queue.Empty:
+            if not proc.is_alive():
+                # The child may have sent its result just before it exited.
+                try:
+                    result = queue.get(timeout=_pollSeconds)
+                except Queue.Empty:
+                    result = {'error':'the benchmark process exited with code %s'
+                              % proc.exitcode}
+            elif timeout is not None and time.time() - start > timeout:
+                proc.terminate()
+                result = {'error':'the run took more than %g seconds' % timeout}
+    proc.join()
+    return result
+
+def _resultKey(result):
+    return (result['engine'], result['modelSize'], result['seqLength'],
+            result['alphabetSize'])
+
+def _printResult(result):
+    if 'error' in result:
+        print '%-6s %6i %8i %4i  %s' % (_resultKey(result) + (result['error'],))
+        return
+    print '%-6s %6i %8i %4i %12.4g %9.4f %9.4f %10.4f %10.4f %10i' % (
+        _resultKey(result) + (result['cellsPerSecond'], result['setup'],
+                              result['encode'], result['find_path'],
+                              result['find_matches'], result['peakRssKb']))
+    sys.stdout.flush()
+
+def _printSpeedups(results):
+    """Prints how much faster the C engine is, and how much cleaning the
+    sequence adds to find_path, averaged over every run."""
+    byKey = dict((_resultKey(result), result) for result in results
+                 if 'error' not in result)
+    speedups = [byKey[('numpy',) + key[1:]]['find_path'] / result['find_path']
+                for key, result in byKey.items()
+                if key[0] == 'c' and ('numpy',) + key[1:] in byKey]
+    if speedups:
+        print '\nThe C engine ran find_path %.1f x faster on average (%.1f to %.1f).' % (
+            sum(speedups) / len(speedups), min(speedups), max(speedups))
+    for engine in _engines:
+        costs = [result['find_path_clean'] / result['find_path'] - 1
+                 for key, result in byKey.items() if key[0] == engine]
+        if costs:
+            print 'Cleaning the sequence added %.0f%% to find_path in the %s engine.' % (
+                100 * sum(costs) / len(costs), engine)
+
+def _quietly(func, *args):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return func(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,61 @@
 """ Implementation of the Viterbi algorithm using the C extension. See the
 patternHmm/__init__.py file for more details.
 """
-import Viterbi, math
-from src.profileHmm_base import Hmm_base
+import Viterbi, array, collections, itertools, math, sys
+from src.profileHmm_base import Hmm_base, _mapThreads, _readDoubles
 
 class Hmm(Hmm_base):
+    # Above this many bytes of back-pointers (1 byte per model position per
+    # residue), the C extension keeps only checkpoint columns of the Viterbi
+    # matrix and recomputes the back-pointers during the traceback.
+    maxPathsBytes = 2**30
+    # The C extension can score with 'double', 'single' (float32) or 'int16'
+    # (saturating fixed point) numbers. The smaller types fill the Viterbi
+    # matrix faster, but rounding may change the path where scores are close.
+    scorePrecision = 'double'
+    _precisions = {'double':0, 'single':1, 'int16':2}
+    # find_paths_many hands the C extension up to this many sequences at a
+    # time, which it runs without taking the GIL back in between.
+    batchSize = 256
+
     def __init__(self, matchEmissions, transitionProbabilities):
         self.modelSize = 0
         self.transProbs = {}
         self.rawMatchEmissions = {}
         self.columnProbs = []
         super(Hmm, self).__init__(matchEmissions, transitionProbabilities)
-        
+
+    def find_paths_many(self, sequences, cleanSequence=True, workers=None):
+        """Runs find_path on each of the given sequences, returning a list of
+        the paths in the same order. The sequences are all cleaned and encoded
+        up front, and grouped by their alphabets. The groups are split into
+        batches of up to batchSize, which are shared between a pool of worker
+        threads, one per CPU if workers is None; the C extension runs each
+        batch with the GIL released throughout. When stats are collected or
+        results cached, each sequence goes through find_path instead."""
+        if self.collectStats or self._cachingResults():
+            return super(Hmm, self).find_paths_many(sequences, cleanSequence, workers)
+        sequences = self._cleanMany(sequences) if cleanSequence else list(sequences)
+        groups = collections.defaultdict(list)
+        for i, seq in enumerate(sequences):
+            if len(seq): groups[tuple(sorted(set(seq)))].append(i)
+        batches = []
+        for symbols, inds in groups.iteritems():
+            encoder, model = self._compiled(symbols)
+            for k in xrange(0, len(inds), self.batchSize):
+                batch = inds[k:k+self.batchSize]
+                batches.append((batch, model, [self._sequenceToInts(encoder, sequences[i])
+                                               for i in batch]))
+        precision = self._precisionCode()
+        batchPaths = _mapThreads(
+            lambda batch: Viterbi.findPaths(batch[2], batch[1], self.maxPathsBytes, precision),
+            batches, workers, 1)
+        paths = [[]] * len(sequences)
+        for (inds, model, seqs), bPaths in itertools.izip(batches, batchPaths):
+            for i, path in itertools.izip(inds, bPaths):
+                paths[i] = path
+        return paths
+
 
     # # #  Object setup methods for the C algorithm
     def _setupColumnProbs(self, transProbs):
@@ -38,6 +82,8 @@ class Hmm(Hmm_base):
         return probs
     def _setupEmissions(self, symbols):
         """Formats the emission probabilities."""
+        scores = self._loadedEmissions(symbols)
+        if scores is not None: return scores
         neg_inf = -float('inf')
         num_symbols = len(symbols)
         randProb = 1.0 / num_symbols
@@ -47,15 +93,79 @@ class Hmm(Hmm_base):
             matchDict = self.rawMatchEmissions[match]
             l.extend([matchDict.get(symb, 0.0)/randProb for symb in symbols])
         return [math.log(num) if num else neg_inf for num in l]
-    def _sequenceToInts(self, symbols, sequence):
-        num = dict((c,i) for i, c in enumerate(symbols))
-        return [num[c] for c in sequence]
+    def _loadColumnProbs(self, data):
+        """The C extension reads the transition probabilities of a loaded
+        model straight from the file's buffer of little-endian doubles."""
+        if sys.byteorder == 'little': return data
+        return list(_readDoubles(data[:]))
+    def _compile(self, symbols):
+        """Returns the symbol encoder and the C extension's compiled tables
+        for sequences made up of the given symbols."""
+        ems = self._setupEmissions(symbols)
+        return self._setupEncoder(symbols), Viterbi.compileModel(ems, self.columnProbs)
+    def _sequenceToInts(self, encoder, sequence):
+        """The string made by translating a byte string is read by the C
+        extension without being copied."""
+        table, num = encoder
+        if table is not None and isinstance(sequence, str):
+            return sequence.translate(table)
+        try:
+            return [num[c] for c in sequence]
+        except KeyError:
+            raise ValueError('the sequence contains a symbol outside of the alphabet')
     # # #  Creates and traverses the Viterbi matrices in C extension
-    def _findPath(self, sequence):
+    def _findPath(self, sequence, symbols=None):
         """Calls the C extension to calculate the most likely sequence of
-        states that would generate the given sequence."""
-        symbols = sorted(set(sequence))
-        seq = self._sequenceToInts(symbols, sequence)
-        ems = self._setupEmissions(symbols)
-        del(sequence); del(symbols)
-        return Viterbi.findPath(list(seq), ems, self.columnProbs)
+        states that would generate the given sequence. The emission scores
+        are set up for the given symbols, or those in the sequence."""
+        symbols = symbols or sorted(set(sequence))
+        seq = self._timed('encode', self._sequenceToInts, self._compiled(symbols)[0],
+                          sequence)
+        del(sequence)
+        return self._findPathEncoded(seq, symbols)
+    def _findPathEncoded(self, seq, symbols):
+        """As _findPath, for a sequence already encoded by _sequenceToInts.
+        The C extension adds its own phase timings to the stats record."""
+        model = self._compiled(symbols)[1]
+        stats = {} if self._statsRecord() is not None else None
+        path = Viterbi.findPath(seq, model, self._checkpointLength(len(seq)),
+                                self._precisionCode(), stats)
+        if stats: self._addStats(stats)
+        return path
+    def _findPathChunk(self, sequence, symbols, state, final):
+        """Continues the C extension's Viterbi matrix over the next chunk of a
+        sequence. The state carries the last column of scores and the
+        back-pointers that haven't settled yet between calls."""
+        column, ptrs = state if state else (None, '')
+        encoder, model = self._compiled(symbols)
+        seq = self._sequenceToInts(encoder, sequence)
+        path, column, ptrs = Viterbi.findPathChunk(seq, model, column, ptrs, final,
+                                                   self._precisionCode())
+        return path, (column, ptrs)
+    def _ungappedHits(self, sequence, symbols, threshold):
+        encoder, model = self._compiled(symbols)
+        seq = self._sequenceToInts(encoder, sequence)
+        return Viterbi.findUngappedHits(seq, model, threshold)
+    def _addCounts(self, seq, symbols, forwardBackward, transCounts, emCounts):
+        """The C extension adds the counts of one encoded sequence into the
+        arrays in place, with the GIL released, and returns its score."""
+        model = self._compiled(symbols)[1]
+        return Viterbi.expectedCounts(seq, model, int(forwardBackward),
+                                      transCounts, emCounts)
+    def _precisionCode(self):
+        try:
+            return self._precisions[self.scorePrecision]
+        except KeyError:
+            raise ValueError("scorePrecision must be one of 'double', 'single' or 'int16'.")
+    def _matchSpans(self, path, minimumMatches):
+        """The C extension scans the path without creating any Python objects."""
+        spans = array.array('i')
+        spans.fromstring(Viterbi.findMatchSpans(path, minimumMatches))
+        return spans
+    def _checkpointLength(self, seqLen):
+        """Returns the block length the C extension should use between
+        checkpoint columns, or 0 if the full back-pointer matrix fits under
+        maxPathsBytes. Using sqrt(seqLen) minimizes the total memory."""
+        if seqLen * self.modelSize <= self.maxPathsBytes:
+            return 0
+        return int(math.sqrt(seqLen)) + 1
@@ -1,10 +1,20 @@
 """Python implementation of the Viterbi algorithm. Requires numpy. See the
-patternHmm/__init__.py file for more details."""
+patternHmm/__init__.py file for more details.
+
+   The matrices are filled one column (sequence position) at a time, with all
+model positions of the column calculated together as numpy arrays. The columns
+of several sequences can be filled together along a batch axis, which is how
+find_paths_many() and find_matches_many() run. The scores and back-pointers are
+calculated exactly as in Viterbi.c, so both versions find the same paths."""
+import itertools
+import math
 import numpy as np
-import warnings
 from src.profileHmm_base import Hmm_base
 
 class Hmm(Hmm_base):
+    # The largest number of sequences filled in together by find_paths_many().
+    batchSize = 256
+
     def __init__(self, matchEmissions, transitionProbabilities):
         self.modelSize = 0
         self.transProbs = {}
@@ -12,115 +22,457 @@ class Hmm(Hmm_base):
         self.columnProbs = []
         super(Hmm, self).__init__(matchEmissions, transitionProbabilities)
 
+    def find_paths_many(self, sequences, cleanSequence=True, workers=None):
+        """Runs find_path on each of the given sequences, returning a list of
+        the paths in the same order. Sequences of similar lengths are filled
+        in together as batches of up to batchSize, and the batches are shared
+        between a pool of worker threads. When results are cached each
+        sequence is looked up on its own instead."""
+        if self._cachingResults():
+            return super(Hmm, self).find_paths_many(sequences, cleanSequence, workers)
+        if cleanSequence: sequences = self._cleanMany(sequences)
+        order = sorted((i for i, seq in enumerate(sequences) if seq),
+                       key=lambda i: len(sequences[i]))
+        batches = [order[i:i+self.batchSize]
+                   for i in xrange(0, len(order), self.batchSize)]
+        batchPaths = self._mapMany(
+            lambda inds: self._findPaths([sequences[i] for i in inds]),
+            batches, workers)
+        paths = [[]] * len(sequences)
+        for inds, bPaths in itertools.izip(batches, batchPaths):
+            for i, path in itertools.izip(inds, bPaths):
+                paths[i] = path
+        return paths
+
     # # #  Object setup methods for the Python algorithm
     def _setupEmissions(self, symbols):
-        d = {}
+        """Returns a (modelSize, len(symbols)) array of the log-odds match
+        emission scores."""
+        scores = self._loadedEmissions(symbols, upperCase=True)
+        if scores is not None:
+            return np.array(scores).reshape(self.modelSize, len(symbols))
         randProb = 1.0 / len(symbols)
-        for match, ems in self.rawMatchEmissions.items():
-            for symb in symbols: d[match,symb] = -np.inf
-            for symb, prob in ems.items(): d[match,symb.upper()] = np.log(prob/randProb)
-        return d
-    def _setupColumnProbs(self, tp):
-        """Creates a list that represents the transmission probabilities that
-        would be accessed when filling out 1 column of the Viterbi matrix, so
-        it doesn't have to be calculated each time. For each tuple the order
-        is ('M','I','D') for match, insert, and delete states, and ('M','R','D')
-        for the random state."""
+        ems = np.empty((self.modelSize, len(symbols)))
+        for j in range(self.modelSize):
+            matchDict = dict((symb.upper(), prob) for symb, prob in
+                             self.rawMatchEmissions['M%i' % (j+1)].items())
+            for k, symb in enumerate(symbols):
+                num = matchDict.get(symb, 0.0) / randProb
+                ems[j,k] = math.log(num) if num else -np.inf
+        return ems
+    def _setupColumnProbs(self, transProbs):
+        """Creates a (modelSize, 3, 3) array of the log transition
+        probabilities that are accessed when filling out 1 column of the
+        Viterbi matrix. For position j, [j,s] holds the probabilities into
+        state s from the ('M','I','D') states they can come from, where the
+        first two states are the match and insert (or random) states of the
+        previous position for a match, and the match and insert states of the
+        same position for an insert. The random state is the insert state of
+        the final position, and the insert state before the first."""
         def get(*args):
-            return np.log([tp.get(a1, {}).get(a2, 0.0) for a1, a2 in args])
-        with warnings.catch_warnings():
-            warnings.simplefilter('ignore')
-            l = [()]
-            for i in range(2, self.modelSize+1):
-                M, prevM, I, prevI, D, prevD = 'M%i'%i, 'M%i'%(i-1), 'I%i'%i, \
-                                               'I%i'%(i-1), 'D%i'%i, 'D%i'%(i-1)
-                if i == self.modelSize: I = 'R'
-                t = (i-1, M, np.array([ get((prevM,M), (prevI,M), (prevD,M)),
-                                        get((M,I), (I,I), (D,I)),
-                                        get((prevM,D), (prevI,D), (prevD,D)) ]))
-                l.append(t)
-            prevM, prevI, prevD = M, 'R', D
-            M, I, D = 'M1', 'I1', 'D1'
-            l[0] = (0, M, np.array([ get((prevM,M), (prevI,M), (prevD,M)),
-                                     get((M,I), (I,I), (D,I)),
-                                     get((prevM,D), (prevI,D), (prevD,D)) ]))
-        return l
+            nums = (transProbs.get(a1, {}).get(a2, 0.0) for a1, a2 in args)
+            return [math.log(num) if num else -np.inf for num in nums]
+        probs = []
+        prevM = 'M%i'%(self.modelSize)
+        prevI = 'R'
+        prevD = 'D%i'%(self.modelSize)
+        for i in range(1, self.modelSize+1):
+            M, I, D, = 'M%i'%i, 'I%i'%i, 'D%i'%i
+            if i == self.modelSize: I = 'R'
+            probs.append([get((prevM,M), (prevI,M), (prevD,M)),
+                          get((M,I), (I,I), (D,I)),
+                          get((prevM,D), (prevI,D), (prevD,D))])
+            prevM, prevI, prevD = 'M%i'%i, 'I%i'%i, 'D%i'%i
+        return np.array(probs)
+    def _loadColumnProbs(self, data):
+        """Views the transition probabilities of a loaded model in place."""
+        return np.frombuffer(data, '<f8').reshape(self.modelSize, 3, 3)
+    def _compile(self, symbols):
+        return self._setupEncoder(symbols), self._setupEmissions(symbols)
+    def _sequenceToInts(self, encoder, sequence):
+        table, num = encoder
+        if table is not None and isinstance(sequence, str):
+            seq = np.frombuffer(sequence.translate(table), np.uint8)
+            if len(seq) and seq.max() >= len(num):
+                raise ValueError('the sequence contains a symbol outside of the alphabet')
+            return seq
+        try:
+            return np.array([num[c] for c in sequence], np.intp)
+        except KeyError:
+            raise ValueError('the sequence contains a symbol outside of the alphabet')
+    def _initColumn(self):
+        """The scores of the first column, before any symbol."""
+        m = self.modelSize - 1
+        column = np.empty((self.modelSize, 3))
+        column[:] = -np.inf
+        column[m,1] = self.columnProbs[m,1,1]  # These are the
+        column[0,0] = self.columnProbs[0,0,1]  # starting probabilities
+        column[0,2] = self.columnProbs[0,2,1]  # for this type of model.
+        return column
+
     # # #  Creating and traversing the Viterbi matrices in Python
-    def _findPath(self, sequence):
-        paths, finalProbs = self._calculateMatrices(sequence)
-        return self._tracePaths(paths, finalProbs)
-    def _calculateMatrices(self, sequence):
-        """i iterates through the sequence, j through the model. In paths
-        0 means the value came from a match state, 1 is from an insert state,
-        and 2 is from a delete state. For the random state 1 indicates it
-        came from itself. A -1 indicates the end of the path."""
-        symbols = set(sequence)
-        ems = self._setupEmissions(symbols)
-        cps = self._setupColumnProbs(self.transProbs)
-        argmax = np.argmax
-        nmax = np.max
-        m, n = self.modelSize, len(sequence)+1
-        vs = np.zeros((3,3))
-        Vs = np.zeros((m, n, 3))
-        paths = np.zeros((m, n, 3))
-        paths[:,0,:] = -1  # First column of paths, indicates end.
-        Vs[:] = -np.inf  # Fills matrix with all -inf.
-        Vs[-1,0,1] = np.log(self.transProbs['R']['R'])
-        Vs[0,0,0] = np.log(self.transProbs['R']['M1'])
-        Vs[0,0,2] = np.log(self.transProbs['R']['D1'])
-        for i, symb in enumerate(sequence):
-            i += 1
-            Vs[m-1,i] = nmax(cps[-1][2] + Vs[m-1,i-1])
-            for j, matchSymb, probs in cps:
-                vs = probs + [Vs[j-1,i-1], Vs[j,i-1], Vs[j-1,i]]
-                paths[j,i] = argmax(vs,1)
-                nmax(vs,1,Vs[j,i])
-                Vs[j,i,0] += ems[matchSymb, symb]
-        return paths, Vs[:,n-1]
-    def _tracePaths(self, paths, finalProbs):
-        seqLen = paths.shape[1] - 1
-        modelLen = paths.shape[0]
-        states = []
-        m = modelLen - 1
-        n = int(np.argmax(finalProbs))
-        j = n / 3  # Because there are 3 states.
-        s = n % 3  # 0,1,2 for match, insert, deletion.
-        i = seqLen
-        ptr = int(paths[j,i,s])
-        while ptr != -1:
-            if s == 0:
-                i -= 1
-                j = j - 1 if j else m
-                states.append('M')
-            elif s == 1:
-                i -= 1
-                states.append('R' if j == m else 'I')
-            elif s == 2:
-                j = j - 1 if j else m
-            s, ptr = ptr, int(paths[j,i,ptr])
-        return ''.join(states[::-1])
-    def _tracePaths2(self, paths, finalProbs):
-        seqLen = paths.shape[1] - 1
-        modelLen = paths.shape[0]
-        states = []
+    def _findPath(self, sequence, symbols=None):
+        return self._findPaths([sequence], symbols)[0]
+    def _findPaths(self, sequences, symbols=None):
+        """Fills in the matrices of a batch of sequences together, padding
+        them to the longest one, and traces each of their paths. The emission
+        scores are set up for the given symbols, or those in each sequence."""
+        encoded, emissions = [], []
+        for sequence in sequences:
+            encoder, ems = self._compiled(symbols or sorted(set(sequence)))
+            encoded.append(self._timed('encode', self._sequenceToInts, encoder, sequence))
+            emissions.append(ems)
+        lengths = np.array([len(seq) for seq in encoded])
+        seqs = np.zeros((len(encoded), lengths.max()), np.intp)
+        ems = np.empty((len(encoded), self.modelSize,
+                        max(e.shape[1] for e in emissions)))
+        ems[:] = -np.inf
+        for b, (seq, e) in enumerate(itertools.izip(encoded, emissions)):
+            seqs[b,:len(seq)] = seq
+            ems[b,:,:e.shape[1]] = e
+        paths, finalProbs = self._timed('fill', self._calculateMatrices,
+                                        seqs, lengths, ems)
+        self._addStats({'cells':int(lengths.sum()) * self.modelSize,
+                        'matrixBytes':paths.nbytes})
+        return self._timed('traceback', lambda: [
+            self._tracePaths(paths[:n,b], finalProbs[b]) for b, n in enumerate(lengths)])
+    def _findPathEncoded(self, seq, symbols):
+        """As _findPath, for a sequence already encoded by _sequenceToInts."""
+        ems = self._compiled(symbols)[1]
+        paths, finalProbs = self._timed('fill', self._calculateMatrices,
+            seq[np.newaxis], np.array([len(seq)]), ems[np.newaxis])
+        self._addStats({'cells':len(seq) * self.modelSize, 'matrixBytes':paths.nbytes})
+        return self._timed('traceback', self._tracePaths, paths[:,0], finalProbs[0])
+    def _findPathChunk(self, sequence, symbols, state, final):
+        """Continues the Viterbi matrices over the next chunk of a sequence.
+        The state carries the last column of scores and the back-pointers of
+        the part of the sequence that hasn't settled yet between calls."""
+        column, paths = state if state else (self._initColumn(), None)
+        encoder, ems = self._compiled(symbols)
+        seq = self._sequenceToInts(encoder, sequence)
+        newPaths, column = self._calculateMatrices(
+            seq[np.newaxis], np.array([len(seq)]), ems[np.newaxis], column)
+        newPaths, column = newPaths[:,0], column[0]
+        paths = newPaths if paths is None else np.concatenate((paths, newPaths))
+        if final:
+            settled, coords = len(paths), None
+        else:
+            settled, coords = self._findConvergence(paths, column)
+        path = self._tracePaths(paths[:settled], column, coords)
+        return path, (column, paths[settled:])
+    def _calculateMatrices(self, seqs, lengths, ems, column=None):
+        """Fills in the Viterbi matrices of a batch of sequences. seqs is a
+        (batch, n) array of symbol indices padded to the longest of lengths,
+        and ems a (batch, modelSize, symbols) array of emission scores. Each
+        column is calculated for all model positions at once, into arrays
+        allocated once per call; within a column only the delete states depend
+        on each other, and those are found by _DeleteScan. Returns the (n,
+        batch, modelSize) int8 paths matrix, with the pointers of the 3 states
+        packed 2 bits each as in Viterbi.c, and the (batch, modelSize, 3)
+        scores of each sequence's final column. The matrices continue on from
+        column if it is given."""
+        batch, n = seqs.shape
+        L = self.modelSize
+        pM, pI, pD = [[self.columnProbs[:,s,t].copy() for t in range(3)]
+                      for s in range(3)]
+        pD[0][0] = -np.inf  # The first delete state may not come from a match.
+        emsT = ems.transpose(0, 2, 1).copy()
+        inds = np.arange(batch)
+        ends = set(lengths.tolist())
+        if column is None: column = self._initColumn()
+        finalProbs = np.empty((batch, L, 3))
+        finalProbs[:] = column
+        # Each state's scores are held from index 1, after a copy of the last
+        # position's score, so that [:,:-1] views the scores of the previous
+        # position of each.
+        cur = [np.empty((batch, L+1)) for s in range(3)]
+        nxt = [np.empty((batch, L+1)) for s in range(3)]
+        for s in range(3):
+            cur[s][:,1:] = column[:,s]
+            cur[s][:,0] = column[-1,s]
+        scan = _DeleteScan(pD[2], batch)
+        v0, v1, v2, base = [np.empty((batch, L)) for k in range(4)]
+        bits, cmp = np.empty((batch, L), np.int8), np.empty((batch, L), bool)
+        paths = np.empty((n, batch, L), np.int8)
+        for i in xrange(n):
+            ptrs = paths[i]
+            newM, newI, newD = [state[:,1:] for state in nxt]
+            # Match states come from the previous position of the last column.
+            for state, p, v in zip(cur, pM, (v0, v1, v2)):
+                np.add(state[:,:-1], p, out=v)
+            _bestOf(v0, v1, v2, newM, ptrs, cmp)
+            newM += emsT[inds, seqs[:,i]]
+            nxt[0][:,0] = newM[:,-1]
+            # Insert states come from the same position of the last column.
+            for state, p, v in zip(cur, pI, (v0, v1, v2)):
+                np.add(state[:,1:], p, out=v)
+            _bestOf(v0, v1, v2, newI, bits, cmp)
+            ptrs |= np.left_shift(bits, 2, out=bits)
+            nxt[1][:,0] = newI[:,-1]
+            # Delete states come from the previous position of this column,
+            # and the first only from the random state.
+            np.add(nxt[0][:,:-1], pD[0], out=v0)
+            np.add(nxt[1][:,:-1], pD[1], out=v1)
+            np.maximum(v0, v1, out=base)
+            scan(base, newD, v2)
+            _bestOf(v0, v1, v2, newD, bits, cmp)
+            ptrs |= np.left_shift(bits, 4, out=bits)
+            nxt[2][:,0] = newD[:,-1]
+            cur, nxt = nxt, cur
+            if i + 1 in ends:
+                done = lengths == i + 1
+                for s in range(3):
+                    finalProbs[done,:,s] = cur[s][done,1:]
+        return paths, finalProbs
+    def _addCounts(self, seq, symbols, forwardBackward, transCounts, emCounts):
+        """Adds the counts of every transition and match emission along the
+        most likely path through one encoded sequence to the arrays, as the
+        path is traced back, and returns its score. If forwardBackward is
+        True, their expected counts are added instead by _addExpectedCounts."""
+        if forwardBackward:
+            return self._addExpectedCounts(seq, symbols, transCounts, emCounts)
+        ems = self._compiled(symbols)[1]
+        paths, finalProbs = self._calculateMatrices(
+            seq[np.newaxis], np.array([len(seq)]), ems[np.newaxis])
+        paths, finalProbs = paths[:,0], finalProbs[0]
+        j, s = self._findMaxCoords(finalProbs)
+        score = float(finalProbs[j,s])
+        if score == -np.inf: return score
+        L, m = self.modelSize, self.modelSize - 1
+        ptrs = bytearray(paths.tobytes())
+        i = len(seq)
+        while i > 0:
+            ptr = (ptrs[(i-1)*L + j] >> (2*s)) & 3
+            transCounts[9*j + 3*s + ptr] += 1
+            if s == 0: emCounts[j*len(symbols) + seq[i-1]] += 1
+            if s != 1: j = j - 1 if j else m
+            if s != 2: i -= 1
+            s = ptr
+        # The path began with one of the starting probabilities of _initColumn.
+        transCounts[9*m + 4 if s == 1 else 3*s + 1] += 1
+        return score
+    def _addExpectedCounts(self, seq, symbols, transCounts, emCounts):
+        """Adds the expected number of times each transition and match
+        emission is used to generate one encoded sequence to the arrays, and
+        returns the log of its total probability. This follows
+        forwardBackward() in Viterbi.c, with each column calculated for all
+        model positions at once; the chains of delete states within a column
+        are summed by _logChain."""
+        ems = self._compiled(symbols)[1]
+        L, m, n = self.modelSize, self.modelSize - 1, len(seq)
+        # pX[s,j] is the probability into state X of position j from state s.
+        pM, pI, pD = [self.columnProbs[:,t].T.copy() for t in range(3)]
+        pMNext = np.roll(pM, -1, axis=1)
+        fwdSteps = _chainSteps(pD[2])
+        bwdSteps = _chainSteps(np.concatenate(([-np.inf], pD[2,:0:-1])))
+        # The forward matrix. The first delete state may only come from the
+        # random state.
+        fwd = np.empty((n+1, 3, L))
+        fwd[0] = self._initColumn().T
+        base = np.empty(L)
+        for i in xrange(1, n+1):
+            prev, cur = fwd[i-1], fwd[i]
+            cur[0] = np.logaddexp.reduce(pM + np.roll(prev, 1, axis=1), axis=0)
+            cur[0] += ems[:,seq[i-1]]
+            cur[1] = np.logaddexp.reduce(pI + prev, axis=0)
+            base[0] = pD[1,0] + cur[1,m]
+            np.logaddexp(pD[0,1:] + cur[0,:-1], pD[1,1:] + cur[1,:-1], out=base[1:])
+            cur[2] = _logChain(base, fwdSteps)
+        total = float(np.logaddexp.reduce(fwd[n].ravel()))
+        if total == -np.inf: return total
+        # The backward matrix, from the last column to the first. Each
+        # transition is counted from the forward score of its source, the
+        # transition and the backward score of its target.
+        trans = np.zeros((L, 3, 3))
+        emSums = np.zeros((L, len(symbols)))
+        cur = np.zeros((3, L))
+        for i in xrange(n, -1, -1):
+            f = fwd[i]
+            if i < n:
+                # Every state leads to the match state of the next position in
+                # the following column, or to the insert state of its own.
+                nxt, symbol = cur, seq[i]
+                emSums[:,symbol] += np.exp(fwd[i+1,0] + nxt[0] - total)
+                viaM = pMNext + np.roll(ems[:,symbol] + nxt[0], -1)
+                viaI = pI + nxt[1]
+                cur = np.logaddexp(viaM, viaI)
+                trans[:,0] += np.roll(np.exp(f + viaM - total), 1, axis=1).T
+                trans[:,1] += np.exp(f + viaI - total).T
+            if i > 0:
+                # Within the column, the delete states are reached from the
+                # previous position, and the first only from the random state.
+                cur[2] = _logChain(cur[2,::-1], bwdSteps)[::-1]
+                viaD = pD[:,1:] + cur[2,1:]
+                np.logaddexp(cur[:2,:-1], viaD[:2], out=cur[:2,:-1])
+                trans[1:,2] += np.exp(f[:,:-1] + viaD - total).T
+                viaD = pD[1,0] + cur[2,0]
+                cur[1,m] = np.logaddexp(cur[1,m], viaD)
+                trans[0,2,1] += math.exp(f[1,m] + viaD - total)
+            else:
+                # The starting probabilities of _initColumn.
+                trans[m,1,1] += math.exp(f[1,m] + cur[1,m] - total)
+                trans[0,0,1] += math.exp(f[0,0] + cur[0,0] - total)
+                trans[0,2,1] += math.exp(f[2,0] + cur[2,0] - total)
+        for k, count in enumerate(trans.ravel().tolist()): transCounts[k] += count
+        for k, count in enumerate(emSums.ravel().tolist()): emCounts[k] += count
+        return total
+    def _ungappedHits(self, sequence, symbols, threshold):
+        """Scores the ungapped diagonals of the Viterbi matrix as in
+        Viterbi.c, one model position at a time. cur holds the best score of a
+        segment ending at the current model position on each diagonal, where
+        residue i at position j is on diagonal i - j + modelSize - 1."""
+        encoder, ems = self._compiled(symbols)
+        seq = self._sequenceToInts(encoder, sequence)
+        n, m = len(seq), self.modelSize
+        cur = np.empty(n + m - 1)
+        cur[:] = -np.inf
+        hits = np.zeros(n, bool)
+        for j in range(m):
+            diags = slice(m - 1 - j, m - 1 - j + n)
+            if j == 0:
+                cur[diags] = ems[0, seq]
+            else:
+                extend = cur[diags] + self.columnProbs[j,0,0]
+                cur[diags] = ems[j, seq] + np.maximum(extend, 0.0)
+            hits |= cur[diags] >= threshold
+        return np.nonzero(hits)[0].tolist()
+    def _findMaxCoords(self, finalProbs):
+        """Returns the (j, s) coordinates of the largest score, taking the
+        last one if there are ties as Viterbi.c does."""
+        flat = finalProbs.ravel()
+        return divmod(flat.size - 1 - int(np.argmax(flat[::-1])), 3)
+    def _findConvergence(self, paths, finalProbs):
+        """Finds the latest column through which the paths traced back from
+        every reachable state in the final column pass in a single state.
+        Returns the number of columns up to it and its (j, s) state, or
+        (0, None) if the paths never meet."""
+        m = self.modelSize - 1
+        ptrs = bytearray(paths.tobytes())
+        live = set(zip(*np.nonzero(finalProbs != -np.inf)))
+        for i in xrange(len(paths), 0, -1):
+            if len(live) == 1:
+                return i, live.pop()
+            nextLive = set()
+            row = (i - 1) * self.modelSize
+            for j, s in live:
+                steps = 0
+                while s == 2 and steps <= m:  # Delete states stay in column i.
+                    j, s = (j - 1 if j else m), (ptrs[row+j] >> 4) & 3
+                    steps += 1
+                if s == 2: continue
+                ptr = (ptrs[row+j] >> (2*s)) & 3
+                if s == 0: j = j - 1 if j else m
+                nextLive.add((j, ptr))
+            live = nextLive
+        return 0, None
+    def _tracePaths(self, paths, finalProbs, coords=None):
+        """Traces back through a (columns, modelSize) paths matrix from the
+        (j, s) state given by coords, or else from the most likely state in
+        the final column. Returns the states as a string."""
+        return ''.join(name[0] if name[0] in 'MR' else 'I' for name in
+                       self._tracePaths2(paths, finalProbs, coords)
+                       if name[0] != 'D')
+    def _tracePaths2(self, paths, finalProbs, coords=None):
+        """As _tracePaths, but returns the list of every state visited by name,
+        including the delete states."""
         names = []
         for n in range(1, self.modelSize+1):
             names.append(['M%i'%n, 'I%i'%n, 'D%i'%n])
         names[-1][1] = 'R'
-        m = modelLen - 1
-        n = int(np.argmax(finalProbs))
-        j = n / 3  # Because there are 3 states.
-        s = n % 3  # 0,1,2 for match, insert, deletion.
-        i = seqLen
-        ptr = int(paths[j,i,s])
-        while ptr != -1:           
+        m = self.modelSize - 1
+        ptrs = bytearray(paths.tobytes())
+        states = []
+        j, s = coords if coords is not None else self._findMaxCoords(finalProbs)
+        i = len(paths)
+        while i > 0:
+            ptr = (ptrs[(i-1)*self.modelSize + j] >> (2*s)) & 3
             states.append(names[j][s])
-            if s != 1:
-                j -= 1
-                if j == -1: j = modelLen - 1
+            if s != 1: j = j - 1 if j else m
             if s != 2: i -= 1
-            s, ptr = ptr, int(paths[j,i,ptr])
+            s = ptr
         return states[::-1]
 
-    
-        
+def _chainSteps(t):
+    """Returns the steps of _logChain along transitions t, where t[j] leads
+    into position j. The step of stride k holds the log of the product of each
+    k consecutive transitions."""
+    steps = []
+    sums = np.array(t, float)
+    sums[0] = -np.inf
+    k = 1
+    while k < len(t):
+        steps.append((k, sums.copy()))
+        sums[2*k:] = sums[2*k:] + sums[k:-k]
+        sums[:2*k] = -np.inf
+        k *= 2
+    return steps
+def _logChain(base, steps):
+    """Returns the log of D, where D[j] is base[j] plus D[j-1] times the
+    transition into j, in probability space. That is a sum over every start
+    of the chain, found in log2(len(base)) doubling steps."""
+    D = base.copy()
+    for k, sums in steps:
+        D[k:] = np.logaddexp(D[k:], D[:-k] + sums[k:])
+    return D
+
+def _bestOf(v0, v1, v2, out, ptrs, cmp):
+    """Writes the largest of the 3 score arrays into out, and its index into
+    ptrs, breaking ties the same way as max() in Viterbi.c."""
+    np.maximum(v0, v1, out=out)
+    np.greater(v1, v0, out=ptrs)
+    np.greater_equal(v2, out, out=cmp)
+    np.copyto(ptrs, 2, where=cmp)
+    np.maximum(out, v2, out=out)
+
+class _DeleteScan(object):
+    """Finds the delete scores of one column, where each is the larger of its
+    score from the other states and the score of the delete state before it
+    plus the transition t between them. As in Viterbi.c, the chains are
+    followed one position at a time, so the scores come out exactly as if
+    calculated serially. For a batch of sequences, the model positions are
+    split into blocks of about sqrt(modelSize), and the chains are first
+    followed within every block side by side; each pass then carries the last
+    score of each block into the next, following the chains on only for as
+    long as they raise a score. A single sequence uses blocks of 1 position,
+    as the arrays are too small for their length to matter."""
+    def __init__(self, t, batch):
+        L = len(t)
+        size = int(math.ceil(math.sqrt(L))) if batch > 1 else 1
+        num = -(-L // size)
+        self.t, self.L, self.size = t, L, size
+        trans = np.empty(num * size)
+        trans[:] = -np.inf
+        trans[1:L] = t[1:]
+        self.trans = trans.reshape(num, size)
+        self.scores = np.empty((batch, num * size))
+        self.scores[:,L:] = -np.inf
+        self.blocks = self.scores.reshape(batch, num, size)
+        self.tmp = np.empty((batch, num))
+        self.raised = np.empty((batch, num - 1), bool)
+    def __call__(self, base, D, v2):
+        """Writes the delete scores of the (batch, modelSize) base scores into
+        D, and the score of each from the delete state before it into v2."""
+        size, trans, X = self.size, self.trans, self.blocks
+        tmp, raised = self.tmp, self.raised
+        self.scores[:,:self.L] = base
+        for r in range(1, size):
+            np.add(X[:,:,r-1], trans[:,r], out=tmp)
+            np.maximum(X[:,:,r], tmp, out=X[:,:,r])
+        tmp = tmp[:,1:]
+        r = 0
+        while True:
+            if r == 0:
+                np.add(X[:,:-1,-1], trans[1:,0], out=tmp)
+            else:
+                np.add(X[:,1:,r-1], trans[1:,r], out=tmp)
+            np.greater(tmp, X[:,1:,r], out=raised)
+            if raised.any():
+                np.maximum(X[:,1:,r], tmp, out=X[:,1:,r])
+                r = (r + 1) % size
+            elif r == 0:
+                break
+            else:
+                r = 0
+        D[:] = self.scores[:,:self.L]
+        v2[:,0] = -np.inf
+        np.add(D[:,:-1], self.t[1:], out=v2[:,1:])
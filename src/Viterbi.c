@@ -1,132 +1,707 @@
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 
+#include <limits.h>
+#include <math.h>
+#include <stdint.h>
+#include <string.h>
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
+
 #define PROB_DIM  3  // Dimension specific to this kind of profile HMM.
 
-static char module_docstring[] = "This module is meant to be called by the profileHmm.py script. It describes one method, findPath(). This method uses the Viterbi algorithm to find the most likely path through the given hidden Markov model that would generate the given sequence. That path is returned as a string, where M indicates a match state, I an insert state, and R the random state.\n";
-static char method_docstring[] = "This method takes 3 arguments, all Python lists. The first is the sequence, a list of ints. The second is a flattened 2D list of doubles describing the emission probabilities, and the third is a flattened 3D list of doubles describing the transition probabilities. This method is meant to be called only by profileHmm.py, which is able to build and format the 3 arguments correctly.\n";
+/* The back-pointers of all 3 states in one cell are packed 2 bits each into a
+single byte.*/
+typedef unsigned char ptr_t;
+#define PACK_PTRS(p0, p1, p2)  ((ptr_t)((p0) | ((p1) << 2) | ((p2) << 4)))
+#define GET_PTR(cell, s)  (((cell) >> (2 * (s))) & 3)
 
-static void pyArraysToCArrays(PyObject *seq_obj, PyObject *ems_obj, PyObject *probs_obj, 
-			     int seq_len, int num_symbols, int model_len, int seq[seq_len], 
-			     double ems[][num_symbols], double probs[][PROB_DIM][PROB_DIM]) {
-  // Copies the Python objects into C arrays.
-  Py_ssize_t t;
+static char module_docstring[] = "This module is meant to be called by the profileHmm.py script. It describes seven methods, compileModel(), findPath(), findPaths(), findPathChunk(), findUngappedHits(), findMatchSpans() and expectedCounts(). findPath() and findPathChunk() use the Viterbi algorithm to find the most likely path through the given hidden Markov model that would generate the given sequence. That path is returned as a string, where M indicates a match state, I an insert state, and R the random state.\n";
+static char compile_docstring[] = "This method takes 2 arguments, each either a Python list of floats or an object holding C doubles through the buffer protocol (such as a slice of a memory-mapped model file), which is read in place. The first is a flattened 2D array describing the emission probabilities, and the second is a flattened 3D array describing the transition probabilities. They are copied into C arrays once, and returned inside an opaque object that is passed to findPath() and findPathChunk(). These objects may be shared freely between threads.\n";
+static char method_docstring[] = "This method takes 2 arguments. The first is the sequence of symbol indices, either a list of ints or any object holding a 1D array of integers through the buffer protocol (such as a str, bytearray, array.array or numpy array), which is read in place without being copied. The second is the model object returned by compileModel() for the sequence's alphabet. An optional third argument, an int, is the checkpoint block length; if given and smaller than the sequence, only every block length'th column of the Viterbi matrix is kept, and the back-pointers are recomputed block by block during the traceback. This returns the same path using far less memory, at the cost of filling the matrix twice. An optional fourth argument, an int, sets the precision the scores are kept in: 0 for doubles, 1 for floats, or 2 for int16s scaled to fixed point, which saturate to -inf about 192 below the best score in their column. The reduced precisions fill the matrix faster, but ties between paths may be broken differently. If an optional fifth argument, a dict, is given, the seconds spent loading the sequence ('load'), filling the matrix ('fill') and tracing the path ('traceback') are stored in it, along with the number of matrix cells filled ('cells') and the bytes of back-pointers and checkpoints allocated ('matrixBytes'). The GIL is released while the matrix is filled and traced, so calls from several threads run in parallel. This method is meant to be called only by profileHmm.py, which is able to build and format the arguments correctly.\n";
+static char paths_docstring[] = "This method runs findPath() on every sequence in a list, all with the same model, releasing the GIL once for the whole list rather than once per sequence. It takes 3 arguments, and an optional fourth. The first is the list of sequences, each as for findPath(), and the second the model object. The third is the most bytes of back-pointers to keep for any one sequence; above it, the sequence is traced back from checkpoints every sqrt(length) columns, as when findPath() is given a block length. The fourth is the precision, as for findPath(). Returns a list of the path strings in the same order.\n";
+static char chunk_docstring[] = "This method runs the Viterbi algorithm over one chunk of a longer sequence, returning the part of the path that can no longer change no matter how the sequence continues. It takes 4 arguments, and an optional fifth. The first 2 are as for findPath(), except that the sequence is only the next chunk. The third is the list of scores returned by the previous call, or None for the first chunk, and the fourth is the string of back-pointers returned by the previous call, or an empty string. If the fifth is true the chunk is the last one, and the rest of the path is returned. An optional sixth argument is the precision, as for findPath(). Returns a tuple of the newly settled path string, the list of scores, and the string of back-pointers still pending.\n";
+
+static char ungapped_docstring[] = "This method is a fast prefilter for findPath(). It takes 3 arguments; the first 2 are as for findPath(), and the third is a float threshold. Every ungapped alignment of the sequence to the model is scored using only the match emissions and the match to match transitions, and the method returns a list of the sequence positions at which some alignment scoring at least the threshold ends. The GIL is released while the sequence is scanned.\n";
+static char spans_docstring[] = "This method finds the matches in a path returned by findPath() or findPathChunk(), without building any Python objects for them. It takes 2 arguments, the path string and an int, the fewest match states a match may hold. Each match is a run of states other than the random state. Returns a string holding 3 native 32-bit ints for each match: its start, its end (one past its last state) and its number of match states. The GIL is released while the path is scanned.\n";
+static char counts_docstring[] = "This method does the E-step of fitting the model to a sequence. It takes 5 arguments; the first 2 are as for findPath(). The third is 0 to count the transitions and match emissions along the most probable path (Viterbi training), or 1 to count the expected number of times each is used over every path, weighted by its probability (the forward-backward algorithm of Baum-Welch training). The last 2 are writable buffers of doubles, such as array.array('d'), that the counts are added to in place: one holding 9 per model position, laid out as the transition probabilities given to compileModel(), and one holding a count for each match state and symbol, laid out as the emissions. Returns the score of the most probable path, or the log of the summed probability of every path, in the same log-odds units as the model. The GIL is released while the counts are made, so calls from several threads with their own buffers run in parallel.\n";
+
+/* The sequence of symbol indices. Any object supporting the new buffer protocol
+is read in place, with no copy made, through a view that stops it from being
+resized while the GIL is released. Lists, and objects with only the old-style
+buffer interface, which gives no such guarantee, are first copied into
+'owned'.*/
+typedef struct {
+  const char *data;
+  Py_ssize_t len;
+  Py_ssize_t itemsize;
+  int32_t *owned;
+  int has_view;
+  Py_buffer view;
+} seq_t;
 
-  // Fills out the 1D 'seq' array from the 'seq_obj' object.
-  for (int i=0; i<seq_len; ++i) {
-    t = (Py_ssize_t) i;
-    seq[i] = (int)PyInt_AsSsize_t(PyList_GetItem(seq_obj, t));
+static void releaseSequence(seq_t *seq);
+
+/* When findPath() is given a stats dict, the time spent in each phase is
+recorded here along with the work done. A NULL pointer turns this off.*/
+typedef struct {
+  double load, fill, traceback;  // Seconds.
+  long long cells;  // Viterbi matrix cells filled, including any recomputed.
+  long long matrix_bytes;  // Back-pointers and checkpoints allocated.
+} timings_t;
+
+static double now(void) {
+#ifdef _WIN32
+  LARGE_INTEGER count, freq;
+  QueryPerformanceCounter(&count);
+  QueryPerformanceFrequency(&freq);
+  return (double)count.QuadPart / freq.QuadPart;
+#else
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + t.tv_nsec * 1e-9;
+#endif
+}
+
+static long long symbolAt(const seq_t *seq, Py_ssize_t i) {
+  switch (seq->itemsize) {
+  case 1: return ((const unsigned char *)seq->data)[i];
+  case 2: return ((const unsigned short *)seq->data)[i];
+  case 4: return ((const int32_t *)seq->data)[i];
+  default: return ((const int64_t *)seq->data)[i];
   }
+}
+
+static int validItemsize(Py_ssize_t itemsize) {
+  return itemsize == 1 || itemsize == 2 || itemsize == 4 || itemsize == 8;
+}
+
+static int loadSequence(PyObject *seq_obj, int num_symbols, seq_t *seq) {
+  /* Sets up 'seq' to read from the given list or buffer, and checks that
+  every symbol is a valid index into the emissions. Returns 0 with an
+  exception set on failure; otherwise releaseSequence() must be called.*/
+  seq->owned = NULL;
+  seq->has_view = 0;
+  if (PyList_Check(seq_obj)) {
+    seq->len = PyList_GET_SIZE(seq_obj);
+    seq->itemsize = sizeof(int32_t);
+    seq->owned = malloc((seq->len + 1) * sizeof(int32_t));
+    if (seq->owned == NULL) {
+      PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+      return 0;
+    }
+    for (Py_ssize_t i=0; i<seq->len; ++i) {
+      /* Checked before narrowing, so that large values aren't wrapped into
+      the alphabet; those too large for a Py_ssize_t are clipped. Floats are
+      refused rather than truncated.*/
+      Py_ssize_t symbol = PyNumber_AsSsize_t(PyList_GET_ITEM(seq_obj, i), NULL);
+      if (symbol == -1 && PyErr_Occurred()) {
+	releaseSequence(seq);
+	PyErr_SetString(PyExc_TypeError, "the sequence list must hold only ints.");
+	return 0;
+      }
+      if (symbol < 0 || symbol >= num_symbols) {
+	releaseSequence(seq);
+	PyErr_SetString(PyExc_ValueError, "the sequence contains a symbol outside of the alphabet.");
+	return 0;
+      }
+      seq->owned[i] = (int32_t)symbol;
+    }
+    seq->data = (const char *)seq->owned;
+  } else if (PyObject_CheckBuffer(seq_obj)) {
+    if (PyObject_GetBuffer(seq_obj, &seq->view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) < 0)
+      return 0;
+    seq->has_view = 1;
+    const char *fmt = seq->view.format;
+    char code = (fmt == NULL || *fmt == '\0') ? 'B' : fmt[strlen(fmt) - 1];
+    seq->itemsize = seq->view.itemsize;
+    if (seq->view.ndim > 1 || strchr("cbBhHiIlLqQnN", code) == NULL ||
+	!validItemsize(seq->itemsize)) {
+      releaseSequence(seq);
+      PyErr_SetString(PyExc_TypeError, "the sequence buffer must be a 1D array of integers.");
+      return 0;
+    }
+    seq->data = seq->view.buf;
+    seq->len = seq->view.len / seq->itemsize;
+  } else {
+    /* Objects with only the old-style buffer interface, such as array.array,
+    give no format; their itemsize and typecode attributes are used if they
+    have them. Nothing stops them being resized once the GIL is released, so
+    their bytes are copied.*/
+    const void *data;
+    PyObject *attr_obj;
+    int is_float = 0;
+    if (PyObject_AsReadBuffer(seq_obj, &data, &seq->len) < 0) {
+      PyErr_SetString(PyExc_TypeError, "the sequence must be a list or support the buffer protocol.");
+      return 0;
+    }
+    seq->itemsize = 1;
+    attr_obj = PyObject_GetAttrString(seq_obj, "itemsize");
+    if (attr_obj == NULL) {
+      PyErr_Clear();
+    } else {
+      seq->itemsize = PyInt_AsSsize_t(attr_obj);
+      Py_DECREF(attr_obj);
+    }
+    attr_obj = PyObject_GetAttrString(seq_obj, "typecode");
+    if (attr_obj == NULL) {
+      PyErr_Clear();
+    } else {
+      is_float = (PyString_Check(attr_obj) && PyString_Size(attr_obj) == 1 &&
+		  strchr("fd", PyString_AsString(attr_obj)[0]) != NULL);
+      Py_DECREF(attr_obj);
+    }
+    if (is_float || !validItemsize(seq->itemsize)) {
+      PyErr_SetString(PyExc_TypeError, "the sequence buffer must be a 1D array of integers.");
+      return 0;
+    }
+    seq->len /= seq->itemsize;
+    seq->owned = malloc(seq->len * seq->itemsize + sizeof(int32_t));
+    if (seq->owned == NULL) {
+      PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+      return 0;
+    }
+    memcpy(seq->owned, data, seq->len * seq->itemsize);
+    seq->data = (const char *)seq->owned;
+  }
+  if (seq->len > INT_MAX - 1) {
+    releaseSequence(seq);
+    PyErr_SetString(PyExc_OverflowError, "the sequence is too long.");
+    return 0;
+  }
+  for (Py_ssize_t i=0; i<seq->len; ++i) {
+    long long symbol = symbolAt(seq, i);
+    if (symbol < 0 || symbol >= num_symbols) {
+      releaseSequence(seq);
+      PyErr_SetString(PyExc_ValueError, "the sequence contains a symbol outside of the alphabet.");
+      return 0;
+    }
+  }
+  return 1;
+}
+static void releaseSequence(seq_t *seq) {
+  free(seq->owned);
+  seq->owned = NULL;
+  if (seq->has_view)
+    PyBuffer_Release(&seq->view);
+  seq->has_view = 0;
+}
+
+/* The matrix is filled in a striped layout, as in Farrar (2007): the model
+positions are split among STRIPES lanes, lane l holding positions l*S to
+l*S + S-1 where S is 'num_segs', and a column is stored as S segments of
+STRIPES cells, one per lane. Position j is then found at STRIPED(j, S). The
+positions of one segment never depend on each other, so each is filled by one
+vector operation, and position j-1 is in the previous segment of the same
+lane. The lanes are padded with unreachable positions to S * STRIPES.*/
+#define STRIPES  8
+#define STRIPED(j, num_segs)  (((j) % (num_segs)) * STRIPES + (j) / (num_segs))
+/* Each state of a column is preceded by one extra segment, holding for each
+lane the score of the position before its first, which is at the end of the
+previous lane. For lane 0 that is the last position, 'last'.*/
+#define LEAD_SOURCE(l, stripe_len, last)  (((l) != 0) ? (stripe_len) - STRIPES + (l) - 1 : (last))
+
+/* The emission and transition tables of one model for one alphabet. 'ems' and
+'probs' are laid out as the arrays given to compileModel(), while 'emsT' and
+'probsT' hold the same scores transposed and striped for fillColumn(), as
+emsT[symbol][t] and probsT[to][from][t]. 'emsSingle' and 'probsSingle' are
+float copies of those, and 'emsInt' and 'probsInt' the same scores as fixed
+point int16s, with the amount taken from the emission scores of each symbol in
+'emsIntBest'; see INT_ADD(). They are built once by compileModel() and handed back to Python
+inside a capsule.*/
+typedef struct {
+  int model_len;
+  int num_symbols;
+  int num_segs;
+  double *ems;
+  double *probs;
+  double *emsT;
+  double *probsT;
+  float *emsSingle;
+  float *probsSingle;
+  int16_t *emsInt;
+  int16_t *probsInt;
+  int *emsIntBest;
+} model_t;
+
+/* The precisions in which the scores of the matrix may be kept.*/
+enum { PRECISION_DOUBLE, PRECISION_SINGLE, PRECISION_INT16 };
+
+/* In the int16 precision a score is stored as round(score * INT_SCALE), and
+-inf as INT_NEG_INF, the smallest int16. Every transition score is at most 0,
+and the largest emission score of each symbol, if above 0, is taken from its
+emission scores and from the 0 scored by the insert states, and added to a
+separate offset instead. INT_ADD() then only ever adds scores of at most 0, so
+it saturates at INT_NEG_INF without a branch, and leaves -inf as it is. The best score of a column can then only fall, and once it falls below
+INT_RESCALE it is subtracted from the whole column and added to the offset.
+Scores more than (INT_RESCALE - INT_NEG_INF) / INT_SCALE below the best in
+their column, less however far the best score fell in that column, are lost.*/
+#define INT_SCALE  128.0
+#define INT_NEG_INF  INT16_MIN
+#define INT_RESCALE  (-8192)
+#define INT_ADD(a, b)  intAdd((a), (b))
+static inline int16_t intAdd(int16_t a, int16_t b) {
+  /* Returns a + b, or INT_NEG_INF if that is smaller, for b at most 0. Every
+  step stays within an int16, so that the vectorized loops don't widen.*/
+  int16_t least = (int16_t)(INT_NEG_INF - b);
+  return (int16_t)(((a > least) ? a : least) + b);
+}
+
+static const char model_capsule_name[] = "Viterbi.model";
 
-  // Fills out the 2D 'ems' array from the 'ems_obj' object.
+static void freeModelTables(model_t *model) {
+  if (model == NULL)
+    return;
+  free(model->ems);
+  free(model->probs);
+  free(model->emsT);
+  free(model->probsT);
+  free(model->emsSingle);
+  free(model->probsSingle);
+  free(model->emsInt);
+  free(model->probsInt);
+  free(model->emsIntBest);
+  free(model);
+}
+static void freeModel(PyObject *capsule) {
+  freeModelTables(PyCapsule_GetPointer(capsule, model_capsule_name));
+}
+static int allocModel(model_t *model, int model_len, int num_symbols) {
+  /* Allocates every table of the model. Returns 0 if any could not be.*/
+  int num_segs = (model_len + STRIPES - 1) / STRIPES;
+  int num_ems = model_len * num_symbols + 1;
+  int num_probs = PROB_DIM * PROB_DIM * model_len;
+  int num_striped_ems = num_segs * STRIPES * num_symbols + 1;
+  int num_striped_probs = PROB_DIM * PROB_DIM * num_segs * STRIPES;
+  model->model_len = model_len;
+  model->num_symbols = num_symbols;
+  model->num_segs = num_segs;
+  model->ems = malloc(num_ems * sizeof(double));
+  model->probs = malloc(num_probs * sizeof(double));
+  model->emsT = malloc(num_striped_ems * sizeof(double));
+  model->probsT = malloc(num_striped_probs * sizeof(double));
+  model->emsSingle = malloc(num_striped_ems * sizeof(float));
+  model->probsSingle = malloc(num_striped_probs * sizeof(float));
+  model->emsInt = malloc(num_striped_ems * sizeof(int16_t));
+  model->probsInt = malloc(num_striped_probs * sizeof(int16_t));
+  model->emsIntBest = malloc(num_symbols * sizeof(int));
+  return (model->ems != NULL && model->probs != NULL && model->emsT != NULL &&
+	  model->probsT != NULL && model->emsSingle != NULL && model->probsSingle != NULL &&
+	  model->emsInt != NULL && model->probsInt != NULL &&
+	  model->emsIntBest != NULL);
+}
+static int16_t toInt16(double score, double offset, int cap) {
+  /* Returns score - offset in the fixed point int16 precision, at most cap.*/
+  if (isinf(score) || isnan(score))
+    return INT_NEG_INF;
+  double scaled = (score - offset) * INT_SCALE;
+  if (scaled > cap)
+    return cap;
+  return (scaled <= INT_NEG_INF) ? INT_NEG_INF : (int16_t)lrint(scaled);
+}
+static double fromInt16(int16_t score, double offset) {
+  return (score == INT_NEG_INF) ? -1.0/0.0 : score / INT_SCALE + offset;
+}
+static void transposeModel(model_t *model) {
+  /* Fills out the striped tables from 'ems' and 'probs'. The padding positions
+  can't be entered from any state.*/
+  int model_len = model->model_len;
+  int num_symbols = model->num_symbols;
+  int num_segs = model->num_segs;
+  int stripe_len = num_segs * STRIPES;
+  int num_ems = stripe_len * num_symbols;
+  int num_probs = PROB_DIM * PROB_DIM * stripe_len;
+  int t;
+  double nInf = -1.0/0.0;
+  double (*ems)[num_symbols] = (double (*)[num_symbols])model->ems;
+  double (*probs)[PROB_DIM][PROB_DIM] = (double (*)[PROB_DIM][PROB_DIM])model->probs;
+  double (*emsT)[stripe_len] = (double (*)[stripe_len])model->emsT;
+  double (*probsT)[PROB_DIM][stripe_len] = (double (*)[PROB_DIM][stripe_len])model->probsT;
+  for (t=0; t<num_ems; ++t)
+    model->emsT[t] = nInf;
+  for (t=0; t<num_probs; ++t)
+    model->probsT[t] = nInf;
+  for (int j=0; j<model_len; ++j) {
+    t = STRIPED(j, num_segs);
+    for (int n=0; n<num_symbols; ++n)
+      emsT[n][t] = ems[j][n];
+    for (int to=0; to<PROB_DIM; ++to) {
+      for (int from=0; from<PROB_DIM; ++from)
+	probsT[to][from][t] = probs[j][to][from];
+    } }
+  /* The delete state of the first position may only come from the random
+  state, unless it is also the last; see fillColumn().*/
+  if (model_len > 1)
+    probsT[2][0][0] = nInf;
+  probsT[2][2][0] = nInf;
+  for (t=0; t<num_ems; ++t)
+    model->emsSingle[t] = (float)model->emsT[t];
+  for (t=0; t<num_probs; ++t)
+    model->probsSingle[t] = (float)model->probsT[t];
+  for (int n=0; n<num_symbols; ++n) {
+    int16_t *row = model->emsInt + n * stripe_len;
+    int best = INT_NEG_INF;
+    for (t=0; t<stripe_len; ++t) {
+      row[t] = toInt16(emsT[n][t], 0.0, INT16_MAX);
+      best = (row[t] > best) ? row[t] : best;
+    }
+    best = (best > 0) ? best : 0;
+    for (t=0; t<stripe_len; ++t) {
+      if (row[t] != INT_NEG_INF)
+	row[t] = (row[t] - best <= INT_NEG_INF) ? INT_NEG_INF : row[t] - best;
+    }
+    model->emsIntBest[n] = best;
+  }
+  for (t=0; t<num_probs; ++t)
+    model->probsInt[t] = toInt16(model->probsT[t], 0.0, 0);
+}
+static model_t *loadModel(PyObject *model_obj) {
+  /* Returns the tables held by a capsule from compileModel(), or NULL with an
+  exception set if it is anything else.*/
+  if (!PyCapsule_IsValid(model_obj, model_capsule_name)) {
+    PyErr_SetString(PyExc_TypeError, "the model must be created by compileModel().");
+    return NULL;
+  }
+  return PyCapsule_GetPointer(model_obj, model_capsule_name);
+}
+
+/* An array of doubles given to compileModel(), either a list of floats or any
+object holding C doubles through the buffer protocol, such as a memory-mapped
+model file. Buffers are read in place.*/
+typedef struct {
+  PyObject *list;
+  const char *data;
+  Py_ssize_t len;
+} doubles_t;
+
+static int loadDoubles(PyObject *obj, doubles_t *arr) {
+  /* Returns 0 with an exception set if obj is neither kind of array.*/
+  const void *data;
+  Py_ssize_t num_bytes;
+  if (PyList_Check(obj)) {
+    arr->list = obj;
+    arr->data = NULL;
+    arr->len = PyList_GET_SIZE(obj);
+    return 1;
+  }
+  if (PyObject_AsReadBuffer(obj, &data, &num_bytes) < 0 ||
+      num_bytes % sizeof(double) != 0) {
+    PyErr_SetString(PyExc_TypeError, "the probabilities must be lists of floats or buffers of doubles.");
+    return 0;
+  }
+  arr->list = NULL;
+  arr->data = data;
+  arr->len = num_bytes / sizeof(double);
+  return 1;
+}
+static double doubleAt(const doubles_t *arr, Py_ssize_t i) {
+  double value;
+  if (arr->list != NULL)
+    return PyFloat_AsDouble(PyList_GET_ITEM(arr->list, i));
+  memcpy(&value, arr->data + i * sizeof(double), sizeof(double));  // May be unaligned.
+  return value;
+}
+
+static void pyArraysToCArrays(const doubles_t *ems_arr, const doubles_t *probs_arr,
+			      int num_symbols, int model_len,
+			      double ems[][num_symbols], double probs[][PROB_DIM][PROB_DIM]) {
+  // Copies the Python objects into C arrays.
+  Py_ssize_t t;
+
+  // Fills out the 2D 'ems' array from the 'ems_arr' array.
   for (int m=0; m<model_len; ++m) {
     for (int n=0; n<num_symbols; ++n) {
       t = (m * num_symbols) + n;
-      ems[m][n] = PyFloat_AsDouble(PyList_GetItem(ems_obj, t));
+      ems[m][n] = doubleAt(ems_arr, t);
     } }
 
-  // Fills out the 3D 'probs' array from the 'probs_obj' object.
+  // Fills out the 3D 'probs' array from the 'probs_arr' array.
   for (int m=0; m<model_len; ++m) {
     for (int i=0; i<PROB_DIM; ++i) {
       for (int j=0; j<PROB_DIM; ++j) {
 	t = (m * PROB_DIM * PROB_DIM) + (i * PROB_DIM) + j;
-	probs[m][i][j] = PyFloat_AsDouble(PyList_GetItem(probs_obj, t));
+	probs[m][i][j] = doubleAt(probs_arr, t);
       } } }
 }
 
-/* Utility functions used in calculateStep and fillMatrices.*/
-static int max(double vec[3]) {
-  if (vec[2] >= vec[1] && vec[2] >= vec[0]) {
-    return 2;
-  } else if (vec[0] >= vec[1] && vec[0] >= vec[2]) {
+/* The Viterbi matrix is filled one column at a time, with every model position
+of a column calculated together. The scores of a column are laid out state by
+state in the striped layout described above, and the tables are striped to
+match. The loops are branch free so that the compiler can vectorize them; with
+GCC on x86-64, versions for AVX2 and for the baseline SSE2 are both built and
+the right one is chosen when the module is loaded. Scores may be kept as
+doubles or, if asked for, as floats or int16s, which fit 2 or 4 times as many
+model positions into each vector.*/
+#if defined(__GNUC__) && !defined(__clang__) && defined(__x86_64__) && defined(__linux__)
+#define VECTOR_KERNEL __attribute__((target_clones("avx2", "default"), optimize("tree-vectorize", "no-trapping-math")))
+#else
+#define VECTOR_KERNEL
+#endif
+#define PLAIN_ADD(a, b)  ((a) + (b))
+#define NO_ADD(a, b)  (a)
+
+/* Defines a function filling out one column of the matrix with scores of the
+given type, adding scores with ADD. 'prev' holds the scores of the previous
+residue, 'emsRow' the emission scores of this residue at each position, and
+'probs' the striped transition table, probs[to][from][t]. The insert states
+have 'insertEm' added with INSERT_ADD, which may ignore it. The best of the 3
+ways into each state is chosen, ties going to the third way and then the
+first, and the back-pointers of the 3 states are packed into 'ptrs' in the
+order of the model positions. The states are filled in the order insert,
+match, delete; the insert state of the last position is the random state,
+which is needed before the first delete state. The delete states of a column
+depend on each other, so they start from the best of their match and insert
+scores, and are then raised by the delete state before them. As in the
+'lazy-F' loop of Farrar, that is done for every lane side by side, and only
+then is each lane's last score carried into the next, following the chain
+serially only for as long as it raises a score. Delete chains are short, so
+that is seldom more than a position or two. The scores come out exactly as if
+calculated serially.*/
+#define DEFINE_FILL_COLUMN(name, score_t, ADD, INSERT_ADD)		\
+static VECTOR_KERNEL void name(int model_len, int num_segs,		\
+			       const score_t *emsRow, score_t insertEm,	\
+			       const score_t *probs,			\
+			       const score_t *restrict prev,		\
+			       score_t *restrict cur, ptr_t *restrict ptrs) { \
+  const int P = num_segs * STRIPES;					\
+  const int W = P + STRIPES;						\
+  const int last = STRIPED(model_len - 1, num_segs);			\
+  const score_t *pM = prev + STRIPES, *pI = pM + W, *pD = pI + W;	\
+  score_t *restrict cM = cur + STRIPES;					\
+  score_t *restrict cI = cM + W;					\
+  score_t *restrict cD = cI + W;					\
+  const score_t *tM = probs, *tI = probs + 3*P, *tD = probs + 6*P;	\
+  score_t v0, v1, v2, v01;					\
+  unsigned char p0[P], p1[P], p2[P];					\
+  int two;								\
+									\
+  for (int t=0; t<P; ++t) {  /* Insert states.*/			\
+    v0 = ADD(pM[t], tI[t]);						\
+    v1 = ADD(pI[t], tI[P + t]);					\
+    v2 = ADD(pD[t], tI[2*P + t]);					\
+    v01 = (v0 >= v1) ? v0 : v1;						\
+    two = (v2 >= v01);							\
+    cI[t] = INSERT_ADD(two ? v2 : v01, insertEm);			\
+    p1[t] = two ? 2 : ((v0 >= v1) ? 0 : 1);				\
+  }									\
+  for (int t=0; t<P; ++t) {  /* Match states.*/				\
+    v0 = ADD(pM[t - STRIPES], tM[t]);				\
+    v1 = ADD(pI[t - STRIPES], tM[P + t]);				\
+    v2 = ADD(pD[t - STRIPES], tM[2*P + t]);				\
+    v01 = (v0 >= v1) ? v0 : v1;						\
+    two = (v2 >= v01);							\
+    p0[t] = two ? 2 : ((v0 >= v1) ? 0 : 1);				\
+    v01 = two ? v2 : v01;						\
+    cM[t] = ADD(v01, emsRow[t]);					\
+  }									\
+  for (int l=0; l<STRIPES; ++l) {					\
+    cM[l - STRIPES] = cM[LEAD_SOURCE(l, P, last)];			\
+    cI[l - STRIPES] = cI[LEAD_SOURCE(l, P, last)];			\
+  }									\
+  /* Delete states, starting from the match and insert scores. The table	\
+  stops the first position coming from the last one's match state.*/	\
+  for (int t=0; t<P; ++t) {						\
+    v0 = ADD(cM[t - STRIPES], tD[t]);				\
+    v1 = ADD(cI[t - STRIPES], tD[P + t]);				\
+    cD[t] = (v0 >= v1) ? v0 : v1;					\
+    p2[t] = (v0 >= v1) ? 0 : 1;						\
+  }									\
+  /* Each lane's chain is first followed within the lane, all lanes side by	\
+  side. Chains crossing from the end of one lane into the next are then	\
+  followed serially, for as long as they raise any score.*/		\
+  for (int k=1; k<num_segs; ++k) {					\
+    for (int t=k*STRIPES; t<(k+1)*STRIPES; ++t) {			\
+      v2 = ADD(cD[t - STRIPES], tD[2*P + t]);				\
+      cD[t] = (v2 > cD[t]) ? v2 : cD[t];				\
+    } }									\
+  for (int l=1; l<STRIPES; ++l) {					\
+    cD[l - STRIPES] = cD[P - STRIPES + l - 1];				\
+    for (int t=l; t<P; t+=STRIPES) {					\
+      v2 = ADD(cD[t - STRIPES], tD[2*P + t]);				\
+      if (v2 <= cD[t])							\
+	break;								\
+      cD[t] = v2;							\
+    } }									\
+  /* A delete state came from the previous one if that gives its score,	\
+  which also breaks ties in its favour.*/				\
+  for (int t=0; t<P; ++t) {						\
+    v2 = ADD(cD[t - STRIPES], tD[2*P + t]);				\
+    p2[t] = (v2 == cD[t]) ? 2 : p2[t];					\
+  }									\
+  cD[-STRIPES] = cD[last];  /* The table stops this being used above.*/	\
+  for (int l=0; l<STRIPES; ++l) {					\
+    for (int k=0; k<num_segs && l*num_segs + k < model_len; ++k) {	\
+      int t = k*STRIPES + l;						\
+      ptrs[l*num_segs + k] = PACK_PTRS(p0[t], p1[t], p2[t]);		\
+    } }									\
+}
+
+DEFINE_FILL_COLUMN(fillColumn, double, PLAIN_ADD, NO_ADD)
+DEFINE_FILL_COLUMN(fillColumnSingle, float, PLAIN_ADD, NO_ADD)
+DEFINE_FILL_COLUMN(fillColumnInt, int16_t, INT_ADD, INT_ADD)
+
+static VECTOR_KERNEL int rescaleColumn(int num_cells, int16_t *col) {
+  /* If the best score of an int16 column is below INT_RESCALE, subtracts it
+  from all of the column's scores and returns it. Otherwise returns 0.*/
+  int16_t best = INT_NEG_INF;
+  for (int t=0; t<num_cells; ++t)
+    best = (col[t] > best) ? col[t] : best;
+  if (best >= INT_RESCALE || best == INT_NEG_INF)
     return 0;
-  } else {
-    return 1; 
-  }
-}
-static void vecAdd(double a[3], double b[3], double out[3]) {
-  out[0] = a[0] + b[0];
-  out[1] = a[1] + b[1];
-  out[2] = a[2] + b[2];
-}
-
-/* This function fills out a single entry in the vs and paths matrices.*/
-static void calculateStep(int i, int j, int prevJ, double emsScore,
-			  int seq_len, double vs[][seq_len + 1][PROB_DIM],
-			  double probs[][PROB_DIM][PROB_DIM],
-			  int paths[][seq_len + 1][PROB_DIM]) {
-  int ind;
-  double tempVs[3];
-  vecAdd(probs[j][0], vs[prevJ][i-1], tempVs); // First state.
-  ind = max(tempVs);
-  paths[j][i][0] = ind;
-  vs[j][i][0] = tempVs[ind] + emsScore;
-  vecAdd(probs[j][1], vs[j][i-1], tempVs); // Second state.
-  ind = max(tempVs);
-  paths[j][i][1] = ind;
-  vs[j][i][1] = tempVs[ind];
-  vecAdd(probs[j][2], vs[prevJ][i], tempVs); // Third state
-  ind = max(tempVs);
-  paths[j][i][2] = ind;
-  vs[j][i][2] = tempVs[ind];
-}
-
-static void fillMatrices(int *seq, int model_len, int num_symbols, int seq_len,
-			 double ems[model_len][num_symbols], 
-			 double probs[][PROB_DIM][PROB_DIM],
-			 double vs[model_len][seq_len + 1][PROB_DIM],
-			 int paths[model_len][seq_len + 1][PROB_DIM]) {
-  /* Variables and initialization.*/
+  for (int t=0; t<num_cells; ++t)
+    col[t] = (col[t] == INT_NEG_INF) ? INT_NEG_INF : (int16_t)(col[t] - best);
+  return best;
+}
+
+static void initColumn(const model_t *model, double col[][model->model_len]) {
+  /* Sets 'col' to the scores of the first column, before any residue.*/
+  int model_len = model->model_len;
   int m = model_len - 1;
-  int n = seq_len + 1;
-  int symbol;
-  double tempVs[3];
+  double (*probs)[PROB_DIM][PROB_DIM] = (double (*)[PROB_DIM][PROB_DIM])model->probs;
   double nInf = -1.0/0.0;
+  for (int s=0; s<PROB_DIM; ++s) {
+    for (int j=0; j<model_len; ++j)
+      col[s][j] = nInf;
+  }
+  col[1][m] = probs[m][1][1];  // These are the 
+  col[0][0] = probs[0][0][1];  // starting probabilities
+  col[2][0] = probs[0][2][1];  // for this type of model.
+}
 
-  for (int i=0; i<seq_len+1; ++i) {
+static void stripeColumn(const model_t *model, int precision, double col[][model->model_len],
+			 void *striped, double *offset) {
+  /* Copies 'col' into the striped layout, lead segments included, in the
+  given precision. For PRECISION_INT16 the best score is taken as the
+  offset.*/
+  int model_len = model->model_len;
+  int stripe_len = model->num_segs * STRIPES;
+  int width = stripe_len + STRIPES;
+  int last = STRIPED(model_len - 1, model->num_segs);
+  double cells[PROB_DIM][width];
+  *offset = -1.0/0.0;
+  for (int s=0; s<PROB_DIM; ++s) {
+    for (int t=0; t<width; ++t)
+      cells[s][t] = -1.0/0.0;
     for (int j=0; j<model_len; ++j) {
-      for (int s=0; s<PROB_DIM; ++s) {
-	paths[j][i][s] = 1;
-	vs[j][i][s] = nInf;
-      } } }
+      cells[s][STRIPES + STRIPED(j, model->num_segs)] = col[s][j];
+      *offset = (col[s][j] > *offset) ? col[s][j] : *offset;
+    }
+    for (int l=0; l<STRIPES; ++l)
+      cells[s][l] = cells[s][STRIPES + LEAD_SOURCE(l, stripe_len, last)];
+  }
+  if (isinf(*offset) || precision != PRECISION_INT16)
+    *offset = 0.0;
+  for (int t=0; t<PROB_DIM * width; ++t) {
+    switch (precision) {
+    case PRECISION_SINGLE: ((float *)striped)[t] = (float)cells[0][t]; break;
+    case PRECISION_INT16: ((int16_t *)striped)[t] = toInt16(cells[0][t], *offset, 0); break;
+    default: ((double *)striped)[t] = cells[0][t];
+    }
+  }
+}
+static void unstripeColumn(const model_t *model, int precision, const void *striped,
+			   double offset, double col[][model->model_len]) {
+  /* Copies a column from the striped layout in the given precision into
+  'col', as doubles.*/
+  int width = (model->num_segs + 1) * STRIPES;
+  int t;
+  for (int s=0; s<PROB_DIM; ++s) {
+    for (int j=0; j<model->model_len; ++j) {
+      t = s * width + STRIPES + STRIPED(j, model->num_segs);
+      switch (precision) {
+      case PRECISION_SINGLE: col[s][j] = ((const float *)striped)[t]; break;
+      case PRECISION_INT16: col[s][j] = fromInt16(((const int16_t *)striped)[t], offset); break;
+      default: col[s][j] = ((const double *)striped)[t];
+      }
+    } }
+}
 
-  vs[m][0][1] = probs[m][1][1];  // These are the 
-  vs[0][0][0] = probs[0][0][1];  // starting probabilities
-  vs[0][0][2] = probs[0][2][1];  // for this type of model.
+static void fillMatrices(const seq_t *seq, int start, int end, const model_t *model,
+			 int precision, double col[][model->model_len],
+			 ptr_t paths[][model->model_len], int block_len,
+			 double checkpoints[][PROB_DIM][model->model_len]) {
+  /* Fills out columns start+1 to end of the Viterbi matrix. On entry 'col'
+  holds the scores of column start, and on exit those of column end; only
+  one other column is ever needed. If 'paths' is not NULL, row 0 receives
+  the back-pointers of column start+1 and so on. If 'checkpoints' is not
+  NULL, every column before end that is a multiple of block_len is copied
+  into it. If 'precision' is PRECISION_SINGLE or PRECISION_INT16 the scores
+  are kept as floats or int16s in between; they are stored as doubles, which
+  hold either exactly.*/
+  int model_len = model->model_len;
+  int num_segs = model->num_segs;
+  int stripe_len = num_segs * STRIPES;
+  int num_cells = PROB_DIM * (stripe_len + STRIPES);
+  ptr_t scratch[model_len];
+  /* Only the columns of the chosen precision are given their full size.*/
+  double doubles[2][(precision == PRECISION_DOUBLE) ? num_cells : 1];
+  float singles[2][(precision == PRECISION_SINGLE) ? num_cells : 1];
+  int16_t ints[2][(precision == PRECISION_INT16) ? num_cells : 1];
+  void *cols[2];
+  int last = 0;  // Which of 'cols' holds the previous column.
+  double offset;  // The score of 0 in 'ints'.
 
-  /* Fill out vs and paths matrices.*/
-  for (int i=1; i<n; ++i) {
-    vecAdd(vs[m][i-1], probs[m][1], tempVs); // The final state for all model
-    vs[m][i][1] = tempVs[max(tempVs)];       // positions must be partially calculated
-    symbol = seq[i-1];                       // before the rest can be.
-    calculateStep(i, 0, m, ems[0][symbol], seq_len, vs, probs, paths);
-    for (int j=1; j<model_len; ++j)
-      calculateStep(i, j, j-1, ems[j][symbol], seq_len, vs, probs, paths);
+  switch (precision) {
+  case PRECISION_SINGLE: cols[0] = singles[0]; cols[1] = singles[1]; break;
+  case PRECISION_INT16: cols[0] = ints[0]; cols[1] = ints[1]; break;
+  default: cols[0] = doubles[0]; cols[1] = doubles[1];
   }
+  stripeColumn(model, precision, col, cols[0], &offset);
+  for (int i=start+1; i<=end; ++i) {
+    int symbol = (int)symbolAt(seq, i-1);
+    ptr_t *ptrs = (paths != NULL) ? paths[i - start - 1] : scratch;
+    switch (precision) {
+    case PRECISION_SINGLE:
+      fillColumnSingle(model_len, num_segs, model->emsSingle + symbol * stripe_len, 0.0f,
+		       model->probsSingle, cols[last], cols[!last], ptrs);
+      break;
+    case PRECISION_INT16:
+      fillColumnInt(model_len, num_segs, model->emsInt + symbol * stripe_len,
+		    (int16_t)-model->emsIntBest[symbol],
+		    model->probsInt, cols[last], cols[!last], ptrs);
+      offset += (model->emsIntBest[symbol] + rescaleColumn(num_cells, cols[!last])) / INT_SCALE;
+      break;
+    default:
+      fillColumn(model_len, num_segs, model->emsT + symbol * stripe_len, 0.0,
+		 model->probsT, cols[last], cols[!last], ptrs);
+    }
+    last = !last;
+    if (checkpoints != NULL && i % block_len == 0 && i < end)
+      unstripeColumn(model, precision, cols[last], offset, checkpoints[i / block_len]);
+  }
+  unstripeColumn(model, precision, cols[last], offset, col);
 }
 
-static void findMaxCoords(int *maxJ, int *maxS, int seq_len,
-			  int model_len, double vs[][seq_len+1][PROB_DIM]) {
-  double largest = vs[0][seq_len][0];
+static void findMaxCoords(int *maxJ, int *maxS, int model_len,
+			  double col[][model_len]) {
+  double largest = col[0][0];
   for (int j=0; j<model_len; ++j) {
     for (int s=0; s<PROB_DIM; ++s) {
-      if (vs[j][seq_len][s] >= largest) {
-	largest = vs[j][seq_len][s];
+      if (col[s][j] >= largest) {
+	largest = col[s][j];
 	*maxJ = j;
 	*maxS = s;
       }
     } }
 }
-static void backTrack(int j, int i, int s, int m,
-		      int paths[][i + 1][PROB_DIM], char path[]) {
-  /* This function traces backwards through the 'paths' matrix to find the most
+static int backTrack(int *jPtr, int *sPtr, int i, int start, int m,
+		     ptr_t paths[][m + 1], char path[]) {
+  /* This function traces backwards through the 'paths' block to find the most
   probable calculated path. This is indicated by filling out the 'path' string.
-  The j, i, and s ints are used for indexing the paths array, and
-  represent the coordinates of the largest value in the final
-  column. This means i is the sequence length. The m is model_len-1,
-  used to index the final j position.*/
-  int ptr = paths[j][i][s];
-  path[i] = '\0';
-  while (i > 0) {
+  The block holds the back-pointers of columns start+1 to i, so the whole
+  matrix is traced when start is 0. jPtr and sPtr point to the coordinates
+  of the state to begin from in column i, and are updated to the state
+  reached in column start so that the trace can be continued through an
+  earlier block. The m is model_len-1, used to index the final j position.
+  Returns the column reached, which is always start.*/
+  int j = *jPtr;
+  int s = *sPtr;
+  int ptr;
+  while (i > start) {
+    ptr = GET_PTR(paths[i - start - 1][j], s);
     switch (s) {
     case 0:
       i -= 1;
@@ -142,73 +717,829 @@ static void backTrack(int j, int i, int s, int m,
       break;
     }
     s = ptr;
-    ptr = paths[j][i][s];
   }
+  *jPtr = j;
+  *sPtr = s;
+  return i;
 }
 
-/*******  THE PUBLIC FUNCTION IMPLEMENTED BY THIS EXTENSION.  *******/
-static PyObject* vit_findPath(PyObject* self, PyObject* args) {
-  PyObject *seq_obj;
+static int findPathFull(const seq_t *seq, int seq_len, const model_t *model,
+			int precision, char path[], timings_t *timings) {
+  /* Keeps the back-pointers for every column, 1 byte per model position per
+  residue. Returns 0 if the memory could not be allocated.*/
+  int model_len = model->model_len;
+  double col[PROB_DIM][model_len];
+  ptr_t (*paths)[model_len] = malloc((seq_len + 1) * sizeof *paths);
+  if (paths == NULL)
+    return 0;
+  int maxJ = 0;
+  int maxS = 0;
+  double t0 = (timings != NULL) ? now() : 0.0;
+  initColumn(model, col);
+  fillMatrices(seq, 0, seq_len, model, precision, col, paths, 0, NULL);
+  double t1 = (timings != NULL) ? now() : 0.0;
+  findMaxCoords(&maxJ, &maxS, model_len, col);
+  backTrack(&maxJ, &maxS, seq_len, 0, model_len-1, paths, path);
+  free(paths);
+  if (timings != NULL) {
+    timings->fill += t1 - t0;
+    timings->traceback += now() - t1;
+    timings->cells += (long long)seq_len * model_len;
+    timings->matrix_bytes += (long long)(seq_len + 1) * sizeof *paths;
+  }
+  return 1;
+}
+
+static int findPathCheckpointed(const seq_t *seq, int seq_len, const model_t *model,
+				int precision, int block_len, char path[],
+				timings_t *timings) {
+  /* Keeps only every block_len'th column of scores while filling the matrix.
+  The traceback then recomputes the back-pointers one block at a time from
+  those checkpoints, starting with the last block. This does the work of
+  filling the matrix twice, but the memory used grows with
+  seq_len / block_len + block_len instead of seq_len. Returns 0 if the memory
+  could not be allocated.*/
+  int model_len = model->model_len;
+  int num_checkpoints = (seq_len - 1) / block_len + 1;
+  double col[PROB_DIM][model_len];
+  double (*checkpoints)[PROB_DIM][model_len] = malloc(num_checkpoints * sizeof *checkpoints);
+  ptr_t (*paths)[model_len] = malloc(block_len * sizeof *paths);
+  if (checkpoints == NULL || paths == NULL) {
+    free(checkpoints);
+    free(paths);
+    return 0;
+  }
+  int maxJ = 0;
+  int maxS = 0;
+  int i = seq_len;
+  int start;
+  double t0 = (timings != NULL) ? now() : 0.0;
+  double t1 = 0.0;
+  double refill = 0.0;  // Time spent recomputing blocks in the traceback.
+  initColumn(model, checkpoints[0]);
+  memcpy(col, checkpoints[0], sizeof col);
+  fillMatrices(seq, 0, seq_len, model, precision, col, NULL, block_len, checkpoints);
+  if (timings != NULL)
+    t1 = now();
+  findMaxCoords(&maxJ, &maxS, model_len, col);
+  while (i > 0) {
+    start = ((i - 1) / block_len) * block_len;
+    memcpy(col, checkpoints[start / block_len], sizeof col);
+    double t2 = (timings != NULL) ? now() : 0.0;
+    fillMatrices(seq, start, i, model, precision, col, paths, 0, NULL);
+    if (timings != NULL)
+      refill += now() - t2;
+    i = backTrack(&maxJ, &maxS, i, start, model_len-1, paths, path);
+  }
+  free(checkpoints);
+  free(paths);
+  if (timings != NULL) {
+    timings->fill += t1 - t0 + refill;
+    timings->traceback += now() - t1 - refill;
+    timings->cells += 2LL * seq_len * model_len;
+    timings->matrix_bytes += (long long)num_checkpoints * sizeof *checkpoints +
+      (long long)block_len * sizeof *paths;
+  }
+  return 1;
+}
+
+static int findPathAny(const seq_t *seq, int seq_len, const model_t *model,
+		       int precision, int block_len, char path[], timings_t *timings) {
+  /* Runs findPathCheckpointed() if block_len is set and shorter than the
+  sequence, otherwise findPathFull().*/
+  if (block_len <= 0 || block_len >= seq_len)
+    return findPathFull(seq, seq_len, model, precision, path, timings);
+  return findPathCheckpointed(seq, seq_len, model, precision, block_len, path, timings);
+}
+
+static int findConvergence(int *jPtr, int *sPtr, int num_cols, int model_len,
+			   ptr_t paths[][model_len], double col[][model_len]) {
+  /* Finds the latest column through which the tracebacks from every reachable
+  state in the last column pass in one single state. The path up to that
+  column can then never change, however the sequence continues. Returns the
+  column and sets jPtr and sPtr to that state, or returns 0 if the tracebacks
+  do not meet. States with a score of -inf are never on the final path, so
+  they are not traced.*/
+  int m = model_len - 1;
+  int count = 0;
+  int j, s, ptr, steps;
+  double nInf = -1.0/0.0;
+  unsigned char live[model_len][PROB_DIM];
+  unsigned char next[model_len][PROB_DIM];
+
+  for (j=0; j<model_len; ++j) {
+    for (s=0; s<PROB_DIM; ++s) {
+      live[j][s] = (col[s][j] != nInf);
+      count += live[j][s];
+    } }
+  for (int i=num_cols; i>0 && count>0; --i) {
+    if (count == 1) {
+      for (j=0; j<model_len; ++j) {
+	for (s=0; s<PROB_DIM; ++s) {
+	  if (live[j][s]) {
+	    *jPtr = j;
+	    *sPtr = s;
+	  }
+	} }
+      return i;
+    }
+    /* Moves each live state back into column i-1, following any chain of
+    delete states within column i first.*/
+    memset(next, 0, sizeof next);
+    count = 0;
+    for (int j0=0; j0<model_len; ++j0) {
+      for (int s0=0; s0<PROB_DIM; ++s0) {
+	if (!live[j0][s0])
+	  continue;
+	j = j0;
+	s = s0;
+	for (steps=0; s == 2 && steps <= model_len; ++steps) {
+	  ptr = GET_PTR(paths[i-1][j], 2);
+	  j = (j != 0) ? j - 1 : m;
+	  s = ptr;
+	}
+	if (s == 2)
+	  continue;
+	ptr = GET_PTR(paths[i-1][j], s);
+	if (s == 0)
+	  j = (j != 0) ? j - 1 : m;
+	if (!next[j][ptr]) {
+	  next[j][ptr] = 1;
+	  ++count;
+	}
+      } }
+    memcpy(live, next, sizeof live);
+  }
+  return 0;
+}
+
+static Py_ssize_t ungappedScan(const seq_t *seq, int model_len, int num_symbols,
+			       double ems[][num_symbols],
+			       double probs[][PROB_DIM][PROB_DIM], double threshold,
+			       Py_ssize_t hits[]) {
+  /* Scores every ungapped diagonal of the Viterbi matrix, using only the match
+  emissions and the match to match transitions. The score of a segment ending
+  at model position j is the best of starting fresh at j or extending the
+  segment that ended at j-1, so after each residue 'cur' holds the best score
+  of any segment ending there. Fills 'hits' with each sequence position at
+  which some segment scores at least threshold, and returns how many there
+  are.*/
+  double cur[model_len];
+  double nInf = -1.0/0.0;
+  double extend;
+  Py_ssize_t num_hits = 0;
+  int hit;
+  for (int j=0; j<model_len; ++j)
+    cur[j] = nInf;
+  for (Py_ssize_t i=0; i<seq->len; ++i) {
+    int symbol = (int)symbolAt(seq, i);
+    hit = 0;
+    for (int j=model_len-1; j>0; --j) {  // Backwards, so cur[j-1] is still the last residue's.
+      extend = cur[j-1] + probs[j][0][0];
+      cur[j] = ems[j][symbol] + ((extend > 0.0) ? extend : 0.0);
+      hit |= (cur[j] >= threshold);
+    }
+    cur[0] = ems[0][symbol];
+    hit |= (cur[0] >= threshold);
+    if (hit)
+      hits[num_hits++] = i;
+  }
+  return num_hits;
+}
+
+static Py_ssize_t matchSpans(const char *path, Py_ssize_t len, int min_matches,
+			     int32_t spans[]) {
+  /* Finds each run of non-random states in the path holding at least
+  min_matches match states. If 'spans' is not NULL, the start, end and number
+  of match states of each are written to it in turn. Returns how many there
+  are.*/
+  Py_ssize_t num_spans = 0;
+  Py_ssize_t i = 0;
+  while (i < len) {
+    if (path[i] == 'R') {
+      ++i;
+      continue;
+    }
+    Py_ssize_t start = i;
+    int num_matches = 0;
+    for (; i < len && path[i] != 'R'; ++i)
+      num_matches += (path[i] == 'M');
+    if (num_matches >= min_matches) {
+      if (spans != NULL) {
+	spans[3*num_spans] = (int32_t)start;
+	spans[3*num_spans + 1] = (int32_t)i;
+	spans[3*num_spans + 2] = num_matches;
+      }
+      ++num_spans;
+    }
+  }
+  return num_spans;
+}
+static double logAdd(double a, double b) {
+  /* Returns log(exp(a) + exp(b)), without leaving log space.*/
+  if (a < b) {
+    double t = a;
+    a = b;
+    b = t;
+  }
+  if (isinf(b))
+    return a;
+  return a + log1p(exp(b - a));
+}
+static int viterbiCounts(const seq_t *seq, int seq_len, const model_t *model,
+			 double *score, double trans[][PROB_DIM][PROB_DIM],
+			 double counts[][model->num_symbols]) {
+  /* Finds the most probable path as findPathFull() does, in double precision,
+  and adds 1 to the count of every transition and match emission along it,
+  including the delete states that backTrack() passes over. Sets 'score' to
+  its score. Returns 0 if the memory could not be allocated.*/
+  int model_len = model->model_len;
+  int m = model_len - 1;
+  double col[PROB_DIM][model_len];
+  ptr_t (*paths)[model_len] = malloc((seq_len + 1) * sizeof *paths);
+  if (paths == NULL)
+    return 0;
+  int j = 0;
+  int s = 0;
+  int ptr;
+  initColumn(model, col);
+  fillMatrices(seq, 0, seq_len, model, PRECISION_DOUBLE, col, paths, 0, NULL);
+  findMaxCoords(&j, &s, model_len, col);
+  *score = col[s][j];
+  if (isinf(*score)) {  // The model can't generate the sequence.
+    free(paths);
+    return 1;
+  }
+  for (int i=seq_len; i>0; ) {
+    ptr = GET_PTR(paths[i-1][j], s);
+    trans[j][s][ptr] += 1.0;
+    switch (s) {
+    case 0:
+      i -= 1;
+      counts[j][symbolAt(seq, i)] += 1.0;
+      j = (j != 0) ? j - 1 : m;
+      break;
+    case 1:
+      i -= 1;
+      break;
+    case 2:
+      j = (j != 0) ? j - 1: m;
+      break;
+    }
+    s = ptr;
+  }
+  /* The path began with one of the starting probabilities of initColumn().*/
+  if (s == 1)
+    trans[m][1][1] += 1.0;
+  else
+    trans[0][s][1] += 1.0;
+  free(paths);
+  return 1;
+}
+static int forwardBackward(const seq_t *seq, int seq_len, const model_t *model,
+			   double *score, double trans[][PROB_DIM][PROB_DIM],
+			   double counts[][model->num_symbols]) {
+  /* Adds the expected number of times each transition and match emission is
+  used to generate the sequence to their counts. The forward matrix follows
+  the same recurrence as fillColumn(), with each max replaced by a sum of
+  probabilities, and is kept whole; the backward matrix is then filled one
+  column at a time, and each transition into one of its cells is counted as
+  the forward score of its source, the transition and the backward score of
+  its target, less the total. Everything is kept in log space. Sets 'score' to
+  the log of the total probability. Returns 0 if the memory could not be
+  allocated.*/
+  int model_len = model->model_len;
+  int num_symbols = model->num_symbols;
+  int m = model_len - 1;
+  double (*ems)[num_symbols] = (double (*)[num_symbols])model->ems;
+  double (*probs)[PROB_DIM][PROB_DIM] = (double (*)[PROB_DIM][PROB_DIM])model->probs;
+  double (*fwd)[PROB_DIM][model_len] = malloc((seq_len + 1) * sizeof *fwd);
+  if (fwd == NULL)
+    return 0;
+  double bwd[2][PROB_DIM][model_len];
+  double nInf = -1.0/0.0;
+  double total = nInf;
+  int i, j, s, symbol;
+
+  /* The forward matrix. The delete state of the first position may only come
+  from the random state; see fillColumn().*/
+  initColumn(model, fwd[0]);
+  for (i=1; i<=seq_len; ++i) {
+    double (*prev)[model_len] = fwd[i-1];
+    double (*cur)[model_len] = fwd[i];
+    symbol = (int)symbolAt(seq, i-1);
+    for (j=0; j<model_len; ++j) {
+      int p = (j != 0) ? j - 1 : m;
+      double toM = nInf;
+      double toI = nInf;
+      for (s=0; s<PROB_DIM; ++s) {
+	toM = logAdd(toM, probs[j][0][s] + prev[s][p]);
+	toI = logAdd(toI, probs[j][1][s] + prev[s][j]);
+      }
+      cur[0][j] = toM + ems[j][symbol];
+      cur[1][j] = toI;
+    }
+    cur[2][0] = probs[0][2][1] + cur[1][m];
+    for (j=1; j<model_len; ++j) {
+      cur[2][j] = nInf;
+      for (s=0; s<PROB_DIM; ++s)
+	cur[2][j] = logAdd(cur[2][j], probs[j][2][s] + cur[s][j-1]);
+    } }
+  for (j=0; j<model_len; ++j) {
+    for (s=0; s<PROB_DIM; ++s)
+      total = logAdd(total, fwd[seq_len][s][j]);
+  }
+  *score = total;
+  if (isinf(total)) {  // The model can't generate the sequence.
+    free(fwd);
+    return 1;
+  }
+
+  /* The backward matrix, from the last column to the first.*/
+  int last = 0;  // Which of 'bwd' holds the following column.
+  for (i=seq_len; i>=0; --i) {
+    double (*f)[model_len] = fwd[i];
+    double (*next)[model_len] = bwd[last];
+    double (*cur)[model_len] = bwd[!last];
+    if (i == seq_len) {
+      for (s=0; s<PROB_DIM; ++s) {
+	for (j=0; j<model_len; ++j)
+	  cur[s][j] = 0.0;
+      }
+    } else {
+      /* Every state leads to the following column's match state of the next
+      position, which emits the symbol, or insert state of its own.*/
+      symbol = (int)symbolAt(seq, i);
+      for (j=0; j<model_len; ++j)
+	counts[j][symbol] += exp(fwd[i+1][0][j] + next[0][j] - total);
+      for (j=0; j<model_len; ++j) {
+	int n = (j != m) ? j + 1 : 0;
+	double toM = ems[n][symbol] + next[0][n];
+	double toI = next[1][j];
+	for (s=0; s<PROB_DIM; ++s) {
+	  double viaM = probs[n][0][s] + toM;
+	  double viaI = probs[j][1][s] + toI;
+	  cur[s][j] = logAdd(viaM, viaI);
+	  trans[n][0][s] += exp(f[s][j] + viaM - total);
+	  trans[j][1][s] += exp(f[s][j] + viaI - total);
+	} } }
+    if (i > 0) {
+      /* Within the column, the delete states are reached from the previous
+      position, and the first only from the random state. Each delete score
+      is complete before the states leading to it are updated.*/
+      for (j=m; j>0; --j) {
+	for (s=0; s<PROB_DIM; ++s) {
+	  double viaD = probs[j][2][s] + cur[2][j];
+	  cur[s][j-1] = logAdd(cur[s][j-1], viaD);
+	  trans[j][2][s] += exp(f[s][j-1] + viaD - total);
+	} }
+      double viaD = probs[0][2][1] + cur[2][0];
+      cur[1][m] = logAdd(cur[1][m], viaD);
+      trans[0][2][1] += exp(f[1][m] + viaD - total);
+    } else {
+      /* The starting probabilities of initColumn().*/
+      trans[m][1][1] += exp(f[1][m] + cur[1][m] - total);
+      trans[0][0][1] += exp(f[0][0] + cur[0][0] - total);
+      trans[0][2][1] += exp(f[2][0] + cur[2][0] - total);
+    }
+    last = !last;
+  }
+  free(fwd);
+  return 1;
+}
+static int loadCounts(PyObject *obj, Py_ssize_t len, double **counts) {
+  /* Points 'counts' at the writable buffer of 'len' doubles held by obj.
+  Returns 0 with an exception set if it isn't one.*/
+  void *data;
+  Py_ssize_t num_bytes;
+  if (PyObject_AsWriteBuffer(obj, &data, &num_bytes) < 0 ||
+      num_bytes != len * (Py_ssize_t)sizeof(double)) {
+    PyErr_SetString(PyExc_TypeError, "the counts must be writable buffers of doubles of the model's dimensions.");
+    return 0;
+  }
+  *counts = data;
+  return 1;
+}
+
+static int loadDimensions(const doubles_t *ems_arr, const doubles_t *probs_arr,
+			  int *model_len, int *num_symbols) {
+  /* Works out the model length and number of symbols from the sizes of the
+  given arrays. Returns 0 with an exception set if they don't agree.*/
+  *model_len = (int)probs_arr->len / (PROB_DIM * PROB_DIM);
+  if (*model_len < 1 || PROB_DIM * PROB_DIM * *model_len != (int)probs_arr->len) {
+    PyErr_SetString(PyExc_TypeError, "the given probabilities array had the wrong dimensions.");
+    return 0;
+  }
+  *num_symbols = (int)ems_arr->len / *model_len;
+  if (*num_symbols * *model_len != (int)ems_arr->len) {
+    PyErr_SetString(PyExc_TypeError, "the given emmissions array had the wrong dimensions.");
+    return 0;
+  }
+  return 1;
+}
+
+static int storeTimings(PyObject *stats, const timings_t *timings) {
+  /* Adds the timings to the stats dict. Returns 0 with an exception set on
+  failure.*/
+  PyObject *values[5] = {
+    PyFloat_FromDouble(timings->load), PyFloat_FromDouble(timings->fill),
+    PyFloat_FromDouble(timings->traceback), PyLong_FromLongLong(timings->cells),
+    PyLong_FromLongLong(timings->matrix_bytes)};
+  const char *keys[5] = {"load", "fill", "traceback", "cells", "matrixBytes"};
+  int ok = 1;
+  for (int k=0; k<5; ++k) {
+    if (ok && (values[k] == NULL || PyDict_SetItemString(stats, keys[k], values[k]) < 0))
+      ok = 0;
+    Py_XDECREF(values[k]);
+  }
+  return ok;
+}
+static int checkPrecision(int precision) {
+  /* Returns 0 with an exception set if precision is not a known one.*/
+  if (precision < PRECISION_DOUBLE || precision > PRECISION_INT16) {
+    PyErr_SetString(PyExc_ValueError, "the precision must be 0, 1 or 2.");
+    return 0;
+  }
+  return 1;
+}
+
+/*******  THE PUBLIC FUNCTIONS IMPLEMENTED BY THIS EXTENSION.  *******/
+static PyObject* vit_compileModel(PyObject* self, PyObject* args) {
   PyObject *ems_obj;
   PyObject *probs_obj;
-  if (!PyArg_ParseTuple(args, "OOO", &seq_obj, &ems_obj, &probs_obj)) {
+  if (!PyArg_ParseTuple(args, "OO", &ems_obj, &probs_obj)) {
     PyErr_SetString(PyExc_TypeError, "error loading the arguments.");
     return NULL;
   }
+  doubles_t ems_arr, probs_arr;
+  int model_len, num_symbols;
+  if (!loadDoubles(ems_obj, &ems_arr) || !loadDoubles(probs_obj, &probs_arr) ||
+      !loadDimensions(&ems_arr, &probs_arr, &model_len, &num_symbols))
+    return NULL;
+
+  model_t *model = calloc(1, sizeof(model_t));
+  if (model == NULL || !allocModel(model, model_len, num_symbols)) {
+    freeModelTables(model);
+    PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+    return NULL;
+  }
+  pyArraysToCArrays(&ems_arr, &probs_arr, num_symbols, model_len,
+		    (double (*)[num_symbols])model->ems,
+		    (double (*)[PROB_DIM][PROB_DIM])model->probs);
+  transposeModel(model);
+  PyObject *capsule = PyCapsule_New(model, model_capsule_name, freeModel);
+  if (capsule == NULL)
+    freeModelTables(model);
+  return capsule;
+}
+
+static PyObject* vit_findPath(PyObject* self, PyObject* args) {
+  PyObject *seq_obj;
+  PyObject *model_obj;
+  int block_len = 0;
+  int precision = PRECISION_DOUBLE;
+  PyObject *stats = Py_None;
+  if (!PyArg_ParseTuple(args, "OO|iiO", &seq_obj, &model_obj, &block_len, &precision,
+			&stats)) {
+    PyErr_SetString(PyExc_TypeError, "error loading the arguments.");
+    return NULL;
+  }
+  if (stats != Py_None && !PyDict_Check(stats)) {
+    PyErr_SetString(PyExc_TypeError, "stats must be a dict or None.");
+    return NULL;
+  }
 
   /* Minor variables.*/
-  int seq_len = (int)PyList_Size(seq_obj);
-  int model_len = (int)PyList_Size(probs_obj) / (PROB_DIM * PROB_DIM);
-  int num_symbols = (int)PyList_Size(ems_obj) / model_len;
-  if (PROB_DIM * PROB_DIM * model_len != (int)PyList_Size(probs_obj)) {
-    PyErr_SetString(PyExc_TypeError, "the given probabilities array had the wrong dimensions.");
+  timings_t timings_buf = {0.0, 0.0, 0.0, 0, 0};
+  timings_t *timings = (stats != Py_None) ? &timings_buf : NULL;
+  double t0 = (timings != NULL) ? now() : 0.0;
+  model_t *model = loadModel(model_obj);
+  seq_t seq;
+  if (model == NULL || !checkPrecision(precision) ||
+      !loadSequence(seq_obj, model->num_symbols, &seq))
+    return NULL;
+  int seq_len = (int)seq.len;
+  if (timings != NULL)
+    timings->load = now() - t0;
+
+  /* Main objects.*/
+  char *path = malloc((seq_len + 1) * sizeof(char));
+  if (path == NULL) {
+    releaseSequence(&seq);
+    PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
     return NULL;
   }
-  if (num_symbols * model_len != (int)PyList_Size(ems_obj)) {
-    PyErr_SetString(PyExc_TypeError, "the given emmissions array had the wrong dimensions.");
+  path[seq_len] = '\0';
+
+  /* Fill out the Viterbi matrix and trace the most probable path backwards.*/
+  int success;
+  Py_BEGIN_ALLOW_THREADS  // No Python objects are touched until the path is done.
+  success = findPathAny(&seq, seq_len, model, precision, block_len, path, timings);
+  Py_END_ALLOW_THREADS
+  releaseSequence(&seq);
+  if (!success) {
+    free(path);
+    PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
     return NULL;
   }
+  if (timings != NULL && !storeTimings(stats, timings)) {
+    free(path);
+    return NULL;
+  }
+
+  /* Create return value, free memory and return. */
+  PyObject *ret = Py_BuildValue("s", path);
+  free(path);
+  return ret;
+}
+
+static PyObject* vit_findPaths(PyObject* self, PyObject* args) {
+  PyObject *seqs_obj;
+  PyObject *model_obj;
+  long long max_bytes;
+  int precision = PRECISION_DOUBLE;
+  if (!PyArg_ParseTuple(args, "OOL|i", &seqs_obj, &model_obj, &max_bytes, &precision)) {
+    PyErr_SetString(PyExc_TypeError, "error loading the arguments.");
+    return NULL;
+  }
+  model_t *model = loadModel(model_obj);
+  if (model == NULL || !checkPrecision(precision))
+    return NULL;
+  PyObject *list = PySequence_Fast(seqs_obj, "the sequences must be given as a list.");
+  if (list == NULL)
+    return NULL;
+  Py_ssize_t num_seqs = PySequence_Fast_GET_SIZE(list);
 
-  /* Main objects. Also 3 of the 4 'malloc' calls made.*/
-  double ems[model_len][num_symbols];
-  double probs[model_len][PROB_DIM][PROB_DIM];
-  int *seq = malloc(seq_len * sizeof(int));
-  double (*vs)[seq_len + 1][PROB_DIM] = malloc(model_len * sizeof *vs);
-  int (*paths)[seq_len + 1][PROB_DIM] = malloc(model_len * sizeof *paths);
-  if (vs == NULL || paths == NULL || seq == NULL) {
+  /* Every sequence is loaded, and its path allocated, before the GIL is
+  released.*/
+  seq_t *seqs = calloc(num_seqs + 1, sizeof(seq_t));
+  char **paths = calloc(num_seqs + 1, sizeof(char *));
+  Py_ssize_t loaded = 0;
+  int success = (seqs != NULL && paths != NULL);
+  if (!success)
     PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+  for (; success && loaded<num_seqs; ++loaded) {
+    if (!loadSequence(PySequence_Fast_GET_ITEM(list, loaded), model->num_symbols,
+		      &seqs[loaded])) {
+      success = 0;
+      break;
+    }
+    paths[loaded] = malloc(seqs[loaded].len + 1);
+    if (paths[loaded] == NULL) {
+      releaseSequence(&seqs[loaded]);
+      PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+      success = 0;
+      break;
+    }
+    paths[loaded][seqs[loaded].len] = '\0';
+  }
+  if (success) {
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t k=0; success && k<num_seqs; ++k) {
+      int seq_len = (int)seqs[k].len;
+      int block_len = 0;
+      if ((long long)seq_len * model->model_len > max_bytes)
+	block_len = (int)sqrt((double)seq_len) + 1;
+      success = findPathAny(&seqs[k], seq_len, model, precision, block_len, paths[k], NULL);
+    }
+    Py_END_ALLOW_THREADS
+    if (!success)
+      PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+  }
+
+  PyObject *ret = success ? PyList_New(num_seqs) : NULL;
+  for (Py_ssize_t k=0; k<loaded; ++k) {
+    if (ret != NULL) {
+      PyObject *item = PyString_FromStringAndSize(paths[k], seqs[k].len);
+      if (item == NULL)
+	Py_CLEAR(ret);
+      else
+	PyList_SET_ITEM(ret, k, item);
+    }
+    releaseSequence(&seqs[k]);
+    free(paths[k]);
+  }
+  free(seqs);
+  free(paths);
+  Py_DECREF(list);
+  return ret;
+}
+
+static PyObject* vit_findPathChunk(PyObject* self, PyObject* args) {
+  PyObject *seq_obj;
+  PyObject *model_obj;
+  PyObject *col_obj;
+  const char *old_ptrs;
+  Py_ssize_t old_len;
+  int final = 0;
+  int precision = PRECISION_DOUBLE;
+  if (!PyArg_ParseTuple(args, "OOOs#|ii", &seq_obj, &model_obj, &col_obj,
+			&old_ptrs, &old_len, &final, &precision)) {
+    PyErr_SetString(PyExc_TypeError, "error loading the arguments.");
     return NULL;
   }
 
-  /* Load the given PyObject lists into the above C arrays, then fill out
-   the Viterbi and paths matrices.*/
-  pyArraysToCArrays(seq_obj, ems_obj, probs_obj, seq_len, num_symbols, 
-		    model_len, seq, ems, probs);
-  fillMatrices(seq, model_len, num_symbols, seq_len, ems, probs, vs, paths);
-  free(seq);
+  /* Minor variables.*/
+  model_t *model = loadModel(model_obj);
+  seq_t seq;
+  if (model == NULL || !checkPrecision(precision))
+    return NULL;
+  int model_len = model->model_len;
+  int num_symbols = model->num_symbols;
+  int old_cols = (int)(old_len / model_len);
+  if ((Py_ssize_t)old_cols * model_len != old_len) {
+    PyErr_SetString(PyExc_TypeError, "the given back-pointers had the wrong dimensions.");
+    return NULL;
+  }
+  if (col_obj != Py_None && (int)PyList_Size(col_obj) != model_len * PROB_DIM) {
+    PyErr_SetString(PyExc_TypeError, "the given scores had the wrong dimensions.");
+    return NULL;
+  }
+  if (!loadSequence(seq_obj, num_symbols, &seq))
+    return NULL;
+  int seq_len = (int)seq.len;
+  int total = old_cols + seq_len;
 
-  /* Find most probable path and trace backwards. Final 'malloc' call.*/
-  char *path = malloc((seq_len+1) * sizeof(char *));
-  if (path == NULL) {
-    PyErr_SetString(PyExc_MemoryError, "unable to malloc C array.");
+  /* Main objects.*/
+  double col[PROB_DIM][model_len];
+  char *path = malloc((total + 1) * sizeof(char));
+  ptr_t (*paths)[model_len] = malloc((total + 1) * sizeof *paths);
+  if (path == NULL || paths == NULL) {
+    releaseSequence(&seq);
+    free(path);
+    free(paths);
+    PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
     return NULL;
   }
+
+  /* Continue the matrix from the previous chunk, then trace back whatever
+  part of the path has settled.*/
+  if (col_obj == Py_None) {
+    initColumn(model, col);
+  } else {
+    for (int j=0; j<model_len; ++j) {
+      for (int s=0; s<PROB_DIM; ++s)
+	col[s][j] = PyFloat_AsDouble(PyList_GetItem(col_obj, j * PROB_DIM + s));
+    } }
+  memcpy(paths, old_ptrs, old_len);
+  int settled;
   int maxJ = 0;
   int maxS = 0;
-  findMaxCoords(&maxJ, &maxS, seq_len, model_len, vs);
-  backTrack(maxJ, seq_len, maxS, model_len-1, paths, path);
+  Py_BEGIN_ALLOW_THREADS
+  fillMatrices(&seq, 0, seq_len, model, precision, col, paths + old_cols, 0, NULL);
+  if (final) {
+    findMaxCoords(&maxJ, &maxS, model_len, col);
+    settled = total;
+  } else {
+    settled = findConvergence(&maxJ, &maxS, total, model_len, paths, col);
+  }
+  backTrack(&maxJ, &maxS, settled, 0, model_len-1, paths, path);
+  Py_END_ALLOW_THREADS
+  releaseSequence(&seq);
 
   /* Create return value, free memory and return. */
-  PyObject *ret = Py_BuildValue("s", path);
-  free(vs);
-  free(paths);
+  PyObject *col_list = PyList_New(model_len * PROB_DIM);
+  for (int j=0; j<model_len; ++j) {
+    for (int s=0; s<PROB_DIM; ++s)
+      PyList_SET_ITEM(col_list, j * PROB_DIM + s, PyFloat_FromDouble(col[s][j]));
+  }
+  PyObject *ptrs_str = PyString_FromStringAndSize((char *)paths[settled],
+						  (Py_ssize_t)(total - settled) * model_len);
+  PyObject *ret = Py_BuildValue("s#NN", path, (Py_ssize_t)settled, col_list, ptrs_str);
   free(path);
+  free(paths);
+  return ret;
+}
+
+static PyObject* vit_findUngappedHits(PyObject* self, PyObject* args) {
+  PyObject *seq_obj;
+  PyObject *model_obj;
+  double threshold;
+  if (!PyArg_ParseTuple(args, "OOd", &seq_obj, &model_obj, &threshold)) {
+    PyErr_SetString(PyExc_TypeError, "error loading the arguments.");
+    return NULL;
+  }
+  model_t *model = loadModel(model_obj);
+  seq_t seq;
+  if (model == NULL || !loadSequence(seq_obj, model->num_symbols, &seq))
+    return NULL;
+  int num_symbols = model->num_symbols;
+  double (*ems)[num_symbols] = (double (*)[num_symbols])model->ems;
+  double (*probs)[PROB_DIM][PROB_DIM] = (double (*)[PROB_DIM][PROB_DIM])model->probs;
+  Py_ssize_t *hits = malloc((seq.len + 1) * sizeof(Py_ssize_t));
+  if (hits == NULL) {
+    releaseSequence(&seq);
+    PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+    return NULL;
+  }
+
+  Py_ssize_t num_hits;
+  Py_BEGIN_ALLOW_THREADS
+  num_hits = ungappedScan(&seq, model->model_len, num_symbols, ems, probs,
+			  threshold, hits);
+  Py_END_ALLOW_THREADS
+  releaseSequence(&seq);
+
+  PyObject *ret = PyList_New(num_hits);
+  for (Py_ssize_t i=0; ret != NULL && i<num_hits; ++i) {
+    PyObject *item = PyInt_FromSsize_t(hits[i]);
+    if (item == NULL) {
+      Py_CLEAR(ret);
+      break;
+    }
+    PyList_SET_ITEM(ret, i, item);
+  }
+  free(hits);
+  return ret;
+}
+
+static PyObject* vit_findMatchSpans(PyObject* self, PyObject* args) {
+  const char *path;
+  Py_ssize_t len;
+  int min_matches;
+  if (!PyArg_ParseTuple(args, "s#i", &path, &len, &min_matches)) {
+    PyErr_SetString(PyExc_TypeError, "error loading the arguments.");
+    return NULL;
+  }
+  if (len > INT32_MAX) {
+    PyErr_SetString(PyExc_OverflowError, "the path is too long.");
+    return NULL;
+  }
+  /* The path string is held by the arguments, so it stays valid without the
+  GIL. It is scanned once to size the result, and again to fill it.*/
+  Py_ssize_t num_spans;
+  Py_BEGIN_ALLOW_THREADS
+  num_spans = matchSpans(path, len, min_matches, NULL);
+  Py_END_ALLOW_THREADS
+  PyObject *ret = PyString_FromStringAndSize(NULL, num_spans * 3 * sizeof(int32_t));
+  if (ret == NULL)
+    return NULL;
+  int32_t *spans = (int32_t *)PyString_AS_STRING(ret);
+  Py_BEGIN_ALLOW_THREADS
+  matchSpans(path, len, min_matches, spans);
+  Py_END_ALLOW_THREADS
   return ret;
 }
 
+static PyObject* vit_expectedCounts(PyObject* self, PyObject* args) {
+  PyObject *seq_obj;
+  PyObject *model_obj;
+  int method;
+  PyObject *trans_obj;
+  PyObject *counts_obj;
+  if (!PyArg_ParseTuple(args, "OOiOO", &seq_obj, &model_obj, &method, &trans_obj,
+			&counts_obj)) {
+    PyErr_SetString(PyExc_TypeError, "error loading the arguments.");
+    return NULL;
+  }
+  model_t *model = loadModel(model_obj);
+  if (model == NULL)
+    return NULL;
+  int model_len = model->model_len;
+  int num_symbols = model->num_symbols;
+  double *trans;
+  double *counts;
+  if (!loadCounts(trans_obj, PROB_DIM * PROB_DIM * model_len, &trans) ||
+      !loadCounts(counts_obj, (Py_ssize_t)model_len * num_symbols, &counts))
+    return NULL;
+  if (model_len < 2) {
+    PyErr_SetString(PyExc_ValueError, "the model must be at least 2 positions long.");
+    return NULL;
+  }
+  seq_t seq;
+  if (!loadSequence(seq_obj, num_symbols, &seq))
+    return NULL;
+  int seq_len = (int)seq.len;
+
+  int success;
+  double score = 0.0;
+  Py_BEGIN_ALLOW_THREADS
+  if (method == 0)
+    success = viterbiCounts(&seq, seq_len, model, &score,
+			    (double (*)[PROB_DIM][PROB_DIM])trans,
+			    (double (*)[num_symbols])counts);
+  else
+    success = forwardBackward(&seq, seq_len, model, &score,
+			      (double (*)[PROB_DIM][PROB_DIM])trans,
+			      (double (*)[num_symbols])counts);
+  Py_END_ALLOW_THREADS
+  releaseSequence(&seq);
+  if (!success) {
+    PyErr_SetString(PyExc_MemoryError, "unable to malloc C arrays.");
+    return NULL;
+  }
+  return PyFloat_FromDouble(score);
+}
+
 /* Necessary extension magic.*/
 static PyMethodDef module_methods[] = {
+  {"compileModel", vit_compileModel, METH_VARARGS, compile_docstring},
   {"findPath", vit_findPath, METH_VARARGS, method_docstring},
+  {"findPaths", vit_findPaths, METH_VARARGS, paths_docstring},
+  {"findPathChunk", vit_findPathChunk, METH_VARARGS, chunk_docstring},
+  {"findUngappedHits", vit_findUngappedHits, METH_VARARGS, ungapped_docstring},
+  {"findMatchSpans", vit_findMatchSpans, METH_VARARGS, spans_docstring},
+  {"expectedCounts", vit_expectedCounts, METH_VARARGS, counts_docstring},
   {NULL, NULL, 0, NULL}
 };
 PyMODINIT_FUNC initViterbi(void) {
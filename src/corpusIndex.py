@@ -0,0 +1,173 @@
+"""Defines the CorpusIndex object, which holds a large sequence that is to be
+searched by many different models. See the patternHmm/__init__.py file for
+more details.
+"""
+import array
+import mmap
+import struct
+import itertools
+from profileHmm_base import _upperTable, _nonAlnumChars, np
+
+# The file starts with the magic string, format version, typecode of the
+# position arrays, their itemsize, the corpus length and the number of symbols.
+_magic = 'PHMMIDX'
+_version = 1
+_header = struct.Struct('<7sBcBqi')
+_offset = struct.Struct('<q')
+
+
+class CorpusIndex(object):
+    """Holds a sequence encoded as 1 byte per symbol, along with the sorted
+    positions of every symbol in it. Models use the positions to find the
+    regions that could hold a match, so that they only run the Viterbi
+    algorithm on those. It can be saved to a file, and loaded back with the
+    corpus and positions memory-mapped rather than read into memory."""
+    def __init__(self, sequence, cleanSequence=True):
+        if not isinstance(sequence, str):
+            sequence = list(sequence)
+            if any(len(symb) != 1 for symb in sequence):
+                raise ValueError('a CorpusIndex can only hold single character symbols')
+            sequence = ''.join(sequence)
+        if cleanSequence:
+            sequence = sequence.translate(_upperTable, _nonAlnumChars)
+        self.symbols = sorted(set(sequence))
+        table = ['\xff'] * 256
+        for i, symb in enumerate(self.symbols): table[ord(symb)] = chr(i)
+        self._corpus = sequence.translate(''.join(table))
+        self._length = len(sequence)
+        self._typecode = 'i' if self._length < 2**31 else 'l'
+        if np is not None:
+            # A stable sort of the symbol codes lists the positions of each
+            # symbol in turn, in order.
+            codes = np.frombuffer(self._corpus, np.uint8)
+            order = np.argsort(codes, kind='mergesort').astype(self._typecode)
+            order.flags.writeable = False
+            bounds = np.cumsum(np.bincount(codes, minlength=len(self.symbols))).tolist()
+            self._positions = [order[start:end] for start, end in
+                               itertools.izip([0] + bounds, bounds)]
+        else:
+            positions = [array.array(self._typecode) for symb in self.symbols]
+            for i, c in enumerate(self._corpus):
+                positions[ord(c)].append(i)
+            self._positions = positions
+        self._setupDecoder()
+
+    @classmethod
+    def load(cls, filename):
+        """Opens an index written by save(). The file is memory-mapped, so
+        only the parts of the corpus and positions that are used are read."""
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, typecode, itemsize, length, numSymbols = \
+                _header.unpack_from(mm, 0)
+            if magic != _magic:
+                raise ValueError('%s is not a CorpusIndex file' % filename)
+            if version != _version:
+                raise ValueError('%s was written by an unsupported version' % filename)
+            if array.array(typecode).itemsize != itemsize:
+                raise ValueError('%s was written on a platform with different integer sizes' % filename)
+        except (ValueError, struct.error):
+            mm.close()
+            raise
+        index = cls.__new__(cls)
+        pos = _header.size
+        index.symbols = list(mm[pos:pos+numSymbols])
+        pos += numSymbols
+        offsets = [_offset.unpack_from(mm, pos + i*_offset.size)[0]
+                   for i in xrange(numSymbols + 1)]
+        pos += len(offsets) * _offset.size
+        index._corpus = _MappedSlice(mm, pos, pos + length)
+        index._length = length
+        index._typecode = typecode
+        if np is not None:
+            index._positions = [np.frombuffer(mm, typecode, (end - start) // itemsize, start)
+                                for start, end in itertools.izip(offsets, offsets[1:])]
+        else:
+            index._positions = [_MappedArray(mm, typecode, itemsize, start, end)
+                                for start, end in itertools.izip(offsets, offsets[1:])]
+        index._setupDecoder()
+        return index
+    def save(self, filename):
+        """Writes the index to a file, from which it can be loaded again."""
+        itemsize = array.array(self._typecode).itemsize
+        with open(filename, 'wb') as f:
+            f.write(_header.pack(_magic, _version, self._typecode, itemsize,
+                                 self._length, len(self.symbols)))
+            f.write(''.join(self.symbols))
+            offset = (_header.size + len(self.symbols) + self._length +
+                      (len(self.symbols) + 1) * _offset.size)
+            for positions in self._positions:
+                f.write(_offset.pack(offset))
+                offset += len(positions) * itemsize
+            f.write(_offset.pack(offset))
+            for start in xrange(0, self._length, 2**24):
+                f.write(self._corpus[start:start+2**24])
+            for positions in self._positions:
+                f.write(positions[:].tostring())
+    def close(self):
+        """Releases the memory-mapped file of a loaded index. The arrays
+        returned by positions() view that file, so they must not be used
+        afterwards."""
+        if isinstance(self._corpus, _MappedSlice):
+            self._corpus.close()
+
+    def __len__(self):
+        return self._length
+    def count(self, symbol):
+        """Returns the number of times symbol occurs in the corpus."""
+        i = self._symbolIndex(symbol)
+        return 0 if i is None else len(self._positions[i])
+    def positions(self, symbol):
+        """Returns the sorted positions of symbol in the corpus. With numpy,
+        this is a read-only array viewing the index, or the file of a loaded
+        index, without copying it; otherwise it is a copy as an array.array."""
+        i = self._symbolIndex(symbol)
+        if np is not None:
+            return np.empty(0, self._typecode) if i is None else self._positions[i]
+        return array.array(self._typecode) if i is None else self._positions[i][:]
+    def sequence(self, start=0, end=None):
+        """Returns the corpus from start to end as a string."""
+        if end is None: end = self._length
+        return self._corpus[start:end].translate(self._decoder)
+
+    # # # # #  Private Methods  # # # # #
+    def _setupDecoder(self):
+        table = [chr(i) for i in xrange(256)]
+        for i, symb in enumerate(self.symbols): table[i] = symb
+        self._decoder = ''.join(table)
+        self._symbolInds = dict((symb, i) for i, symb in enumerate(self.symbols))
+    def _symbolIndex(self, symbol):
+        return self._symbolInds.get(symbol.upper())
+
+
+class _MappedSlice(object):
+    """A read-only slice of a memory-mapped file."""
+    def __init__(self, mm, start, end):
+        self._mm, self._start, self._end = mm, start, end
+    def __len__(self):
+        return self._end - self._start
+    def __getitem__(self, key):
+        start, end, step = key.indices(len(self))
+        return self._mm[self._start+start:self._start+end:step]
+    def close(self):
+        self._mm.close()
+
+class _MappedArray(_MappedSlice):
+    """An array of positions stored in a memory-mapped file. Slicing it reads
+    just that part of the array."""
+    def __init__(self, mm, typecode, itemsize, start, end):
+        super(_MappedArray, self).__init__(mm, start, end)
+        self.typecode, self._itemsize = typecode, itemsize
+    def __len__(self):
+        return (self._end - self._start) // self._itemsize
+    def __getitem__(self, key):
+        start, end, step = key.indices(len(self))
+        data = self._mm[self._start + start*self._itemsize:
+                        self._start + end*self._itemsize]
+        return array.array(self.typecode, data)[::step]
+    def __iter__(self):
+        chunk = 2**16
+        for start in xrange(0, len(self), chunk):
+            for pos in self[start:start+chunk]:
+                yield pos
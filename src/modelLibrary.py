@@ -0,0 +1,86 @@
+"""Defines the ModelLibrary object, which searches one sequence with many
+models at once. See the patternHmm/__init__.py file for more details.
+"""
+import bisect
+import collections
+import os
+from profileHmm_base import _mapThreads, _loadModelFile
+
+
+class ModelLibrary(object):
+    """Holds a set of named Hmm models. scan() cleans and encodes a sequence
+    once, shares it between all of the models, and runs them on a pool of
+    worker threads. Each match is tagged with the name of the model that
+    found it and scored, so that overlapping matches from different models
+    can be compared."""
+    def __init__(self, models):
+        if isinstance(models, dict):
+            models = sorted(models.items())
+        self.models = collections.OrderedDict(models)
+        if not self.models:
+            raise ValueError('a ModelLibrary needs at least one model')
+
+    @classmethod
+    def from_files(cls, filenames):
+        """Loads the model defined in each of the given files, as written by
+        generate_model_file. Each model is named after its file."""
+        models = []
+        for filename in filenames:
+            name = os.path.splitext(os.path.basename(filename))[0]
+            models.append((name, _loadModelFile(filename)))
+        return cls(models)
+
+    def __len__(self):
+        return len(self.models)
+    def scan(self, sequence, minimumMatches=None, cleanSequence=True,
+             bestOnly=False, workers=None):
+        """Runs find_matches with every model on the given sequence. Returns
+        a list of (name, index, states, symbols, score) for each match, sorted
+        by index, where score is the natural log-odds score of the best path
+        through the model that emits the match. If bestOnly is True, a match
+        is kept only if it does not overlap one that scores higher. The models
+        are shared between a pool of worker threads, one per CPU if workers is
+        None, longest first so that the threads finish together."""
+        first = next(self.models.itervalues())
+        if cleanSequence: sequence = first._cleanSequence(sequence)
+        if not sequence: return []
+        symbols = sorted(set(sequence))
+        # Every model of the same engine encodes a sequence the same way.
+        encoded = {}
+        for model in self.models.itervalues():
+            if type(model) not in encoded:
+                encoder = model._compiled(symbols)[0]
+                encoded[type(model)] = model._sequenceToInts(encoder, sequence)
+        def scanModel(item):
+            name, model = item
+            if model.prefilterThreshold is not None:
+                stateMatches, seqMatches = model.find_matches(
+                    sequence, minimumMatches, cleanSequence=False)
+            else:
+                path = model._findPathEncoded(encoded[type(model)], symbols)
+                stateMatches, seqMatches = model._findMatches(
+                    path, sequence, minimumMatches)
+            return [(name, index, states, symbs,
+                     model._scoreMatch(states, symbs, len(symbols)))
+                    for states, (index, symbs) in zip(stateMatches, seqMatches)]
+        items = sorted(self.models.items(), key=lambda item: -item[1].modelSize)
+        matches = [match for modelMatches in
+                   _mapThreads(scanModel, items, workers, chunksize=1)
+                   for match in modelMatches]
+        if bestOnly: matches = self._bestMatches(matches)
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+    # # # # #  Private Methods  # # # # #
+    def _bestMatches(self, matches):
+        """Keeps each match that does not overlap a higher scoring one."""
+        starts, ends, best = [], [], []
+        for match in sorted(matches, key=lambda match: -match[4]):
+            start, end = match[1], match[1] + len(match[3])
+            i = bisect.bisect(starts, start)
+            if (i and ends[i-1] > start) or (i < len(starts) and starts[i] < end):
+                continue
+            starts.insert(i, start)
+            ends.insert(i, end)
+            best.append(match)
+        return best
@@ -1,19 +1,240 @@
 """Parent class inherited by both versions of the Hmm() object implemented
 in this package.
 """
+import array
+import collections
+import functools
+import hashlib
+import imp
 import itertools
+import math
+import mmap
+import multiprocessing
+import os
+import re
+import string
+import struct
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by the Python implementation.
+    np = None
+
+# Tables used to clean byte strings in a single str.translate() call.
+_upperTable = string.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+_nonAlnumChars = ''.join(c for c in map(chr, xrange(256)) if not c.isalnum())
+# As _nonAlnumChars, but keeping the newlines that separate joined sequences.
+_nonAlnumKeptNewlines = _nonAlnumChars.replace('\n', '')
+# Each match is a run of states other than the random state.
+_matchRun = re.compile('[^R]+')
+# The counts kept by each model for prefilter_info().
+_prefilterKeys = ('sequences', 'sequencesPassed', 'sequencesMatched', 'windows',
+                  'symbols', 'symbolsPassed')
+# The seconds spent in each phase of a call, and the work done, which are kept
+# for stats_info() when collectStats is set.
+_statsKeys = ('clean', 'compile', 'encode', 'prefilter', 'load', 'fill',
+              'traceback', 'matches', 'total', 'cells', 'matrixBytes')
+# The counts kept by each model for result_cache_info().
+_resultKeys = ('hits', 'diskHits', 'misses', 'evictions')
+# A model file starts with the magic string, format version, model size and
+# the number of symbols emitted by the match states. Each symbol follows as its
+# length and bytes. After padding to a multiple of 8 bytes come the 9 log
+# transition probabilities of each model position, in the order of
+# _setupColumnProbs, then the probability of each match state emitting each
+# symbol, all as little-endian doubles.
+_modelMagic = 'PHMMMOD'
+_modelVersion = 2
+_modelHeader = struct.Struct('<7sBii')
+_symbolLength = struct.Struct('<H')
+# The name of this package, which model files import Hmm from, and numbers
+# the modules that model files are loaded as.
+_packageName = __name__.split('.')[0]
+_modelFileCount = itertools.count()
+
+
+def _mapThreads(func, items, workers, chunksize=None):
+    """Returns map(func, items), shared between a pool of worker threads,
+    one per CPU if workers is None."""
+    if workers is None: workers = multiprocessing.cpu_count()
+    if workers <= 1: return map(func, items)
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(func, items, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+def _loadModelFile(filename):
+    """Runs a model file written by generate_model_file and returns its model.
+    The file is loaded as a module with a private name of its own, so that a
+    model file named after another module, such as random.py, can't take that
+    module's place in sys.modules."""
+    name = '_%s_model_%i' % (_packageName.lower(), next(_modelFileCount))
+    return imp.load_source(name, filename).model
+
+def _readDoubles(data):
+    """Returns an array of the little-endian doubles in the string data."""
+    values = array.array('d')
+    values.fromstring(data)
+    if sys.byteorder == 'big': values.byteswap()
+    return values
+
+def _recordsStats(method):
+    """Wraps a public search method so that, when collectStats is set, a
+    record of the call is kept that the phases it runs add their timings to.
+    Calls made from within it add to the same record."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.collectStats or self._statsRecord() is not None:
+            return method(self, *args, **kwargs)
+        record = {'call':method.__name__, 'modelSize':self.modelSize}
+        self._statsLocal.record = record
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._statsLocal.record = None
+            record['total'] = time.time() - start
+            self._finishStats(record)
+    return wrapper
 
 
 class Hmm_base(object):
+    # The number of alphabets whose compiled tables are kept by each model.
+    maxCachedAlphabets = 64
+    # If set, find_matches first scores every ungapped alignment of the
+    # sequence to the model (in natural log-odds units), and only runs the full
+    # Viterbi algorithm on the regions around those scoring at least this much.
+    prefilterThreshold = None
+    # If True, each call to find_path or find_matches records the seconds
+    # spent in each phase, the Viterbi matrix cells filled and the memory they
+    # took. stats_info() returns the totals, and statsCallback, if set, is
+    # called with the record of each call.
+    collectStats = False
+    statsCallback = None
+    # If resultCacheSize is above 0, the paths found by find_path are kept by a
+    # hash of the cleaned, encoded sequence and of the model, so a repeated
+    # sequence skips the Viterbi algorithm. At most resultCacheSize paths,
+    # holding at most resultCacheBytes states between them, are kept in
+    # memory, dropping the least recently used first. If resultCacheDir is
+    # set, every path is also stored as a file in that directory, which may be
+    # shared by any number of processes and models; nothing is ever removed
+    # from it. The model's probabilities are only hashed once, so if they are
+    # changed other than by fit(), clear_cache() must be called.
+    resultCacheSize = 0
+    resultCacheBytes = 2**28
+    resultCacheDir = None
+
     def __init__(self, matchEmissions, transitionProbabilities):
         self.modelSize = len(matchEmissions)
         if self.modelSize < 2:
             raise TypeError('The model must be at least 2 positions long')
         self.transProbs = transitionProbabilities
         self.rawMatchEmissions = matchEmissions
+        self._tables = None
         self.columnProbs = self._setupColumnProbs(transitionProbabilities)
+        self._setupState()
+
+    @classmethod
+    def load(cls, filename):
+        """Reads a model written by save(). The file is memory-mapped, and the
+        C extension reads the transition probabilities straight from it. The
+        transProbs and rawMatchEmissions dicts are only built if needed."""
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, modelSize, numSymbols = _modelHeader.unpack_from(mm, 0)
+            if magic != _modelMagic:
+                raise ValueError('%s is not a model file' % filename)
+            if version != _modelVersion:
+                raise ValueError('%s was written by an unsupported version' % filename)
+            pos = _modelHeader.size
+            symbols = []
+            for i in xrange(numSymbols):
+                length, = _symbolLength.unpack_from(mm, pos)
+                pos += _symbolLength.size
+                symbols.append(mm[pos:pos+length])
+                pos += length
+            pos += -pos % 8
+            numTrans, numEms = 9 * modelSize, modelSize * numSymbols
+            if modelSize < 2 or len(mm) != pos + 8 * (numTrans + numEms):
+                raise ValueError('%s is truncated or corrupt' % filename)
+        except (ValueError, struct.error):
+            mm.close()
+            raise
+        model = cls.__new__(cls)
+        model.modelSize = modelSize
+        model._transProbs = model._rawMatchEmissions = None
+        transLogs = buffer(mm, pos, 8 * numTrans)
+        emProbs = _readDoubles(mm[pos + 8*numTrans:])
+        model._tables = symbols, emProbs, transLogs
+        model.columnProbs = model._loadColumnProbs(transLogs)
+        model._setupState()
+        return model
+    def _setupState(self):
+        self._compiledCache = collections.OrderedDict()
+        self._cacheLock = threading.Lock()
+        self._cacheHits = self._cacheMisses = 0
+        self._prefilterLock = threading.Lock()
+        self._prefilterCounts = dict.fromkeys(_prefilterKeys, 0)
+        self._scoreTablesCache = None
+        self._statsLocal = threading.local()
+        self._statsLock = threading.Lock()
+        self._statsTotals = dict.fromkeys(('calls',) + _statsKeys, 0)
+        self._resultCache = collections.OrderedDict()
+        self._resultLock = threading.Lock()
+        self._resultBytes = 0
+        self._resultCounts = dict.fromkeys(_resultKeys, 0)
+        self._fingerprint = None
 
     # # # # #  Public Methods  # # # # #
+    @property
+    def transProbs(self):
+        """The dict of transition probabilities the model was created with."""
+        if self._transProbs is None:
+            self._transProbs = self._loadedTransProbs()
+        return self._transProbs
+    @transProbs.setter
+    def transProbs(self, transProbs):
+        self._transProbs = transProbs
+    @property
+    def rawMatchEmissions(self):
+        """The dict of match emission probabilities the model was created with."""
+        if self._rawMatchEmissions is None:
+            self._rawMatchEmissions = self._loadedMatchEmissions()
+        return self._rawMatchEmissions
+    @rawMatchEmissions.setter
+    def rawMatchEmissions(self, matchEmissions):
+        self._rawMatchEmissions = matchEmissions
+
+    def save(self, filename):
+        """Writes the model to a binary file holding its log transition
+        probabilities and its emission probabilities, which load() reads back
+        far faster than a model file can be imported. The emission scores are
+        worked out from the probabilities themselves, so that a loaded model
+        scores every path exactly as the original does."""
+        intoM, intoI, intoD = self._scoreTables()[:3]
+        transLogs = array.array('d', (log for j in range(self.modelSize)
+                                      for log in intoM[j] + intoI[j] + intoD[j]))
+        symbols, emProbs = self._emissionProbs()
+        if sys.byteorder == 'big':
+            transLogs.byteswap()
+            emProbs.byteswap()
+        with open(filename, 'wb') as f:
+            f.write(_modelHeader.pack(_modelMagic, _modelVersion, self.modelSize,
+                                      len(symbols)))
+            pos = _modelHeader.size
+            for symb in symbols:
+                f.write(_symbolLength.pack(len(symb)) + symb)
+                pos += _symbolLength.size + len(symb)
+            f.write('\0' * (-pos % 8))
+            f.write(transLogs.tostring())
+            f.write(emProbs.tostring())
+
     def print_path(self, sequence, cleanSequence=True, printWidth=80):
         """Given some sequence this predicts and prints the most likely path
         through the current model to generate it, using the Viterbi algorithm."""
@@ -27,22 +248,261 @@ class Hmm_base(object):
             *self.find_matches(sequence, minimumMatches, cleanSequence),
             printWidth=printWidth)
     
+    @_recordsStats
     def find_path(self, sequence, cleanSequence=True):
         """Given some sequence this predicts the most likely path through
         the current model to generate it, returning the path as a string.
         Runs the algorithm 200x faster in C if the Viterbi module is found,
         otherwise the local Python implementation is used."""
-        if cleanSequence: sequence = self._cleanSequence(sequence)
+        if cleanSequence: sequence = self._timed('clean', self._cleanSequence, sequence)
         if not sequence: return []
+        self._setStat('seqLength', len(sequence))
+        if self._cachingResults(): return self._cachedPath(sequence)
         return self._findPath(sequence)
+    @_recordsStats
     def find_matches(self, sequence, minimumMatches=None, cleanSequence=True):
         """Given some sequence, this finds each of the predicted matches.
         Returns 2 lists, the first where each entry is the sequence of states,
-        and the second where each entry is the corresponding (index, sequence)."""
-        if cleanSequence: sequence = self._cleanSequence(sequence)
+        and the second where each entry is the corresponding (index, sequence).
+        find_match_spans finds the same matches without building these lists."""
+        if cleanSequence: sequence = self._timed('clean', self._cleanSequence, sequence)
         if not sequence: return []
+        self._setStat('seqLength', len(sequence))
+        if self.prefilterThreshold is not None:
+            return self._findMatchesFiltered(sequence, minimumMatches)
         path = self.find_path(sequence, cleanSequence=False)
-        return self._findMatches(path, sequence, minimumMatches)
+        return self._timed('matches', self._findMatches, path, sequence, minimumMatches)
+    @_recordsStats
+    def find_match_spans(self, sequence, minimumMatches=None, cleanSequence=True,
+                         scores=False):
+        """Finds the same matches as find_matches, but without building lists
+        of their states and symbols. Returns an array holding the start, end
+        (one past the last symbol) and number of match states of each match
+        in turn, so the symbols of the i'th match are the cleaned
+        sequence[spans[3*i]:spans[3*i+1]]. If scores is True, returns the
+        spans and an array of the natural log-odds score of each match, as
+        ModelLibrary.scan() gives. Scoring a match runs a small DP over it,
+        as the path leaves out its delete states, so this is off by
+        default."""
+        if cleanSequence: sequence = self._timed('clean', self._cleanSequence, sequence)
+        if not sequence:
+            return (array.array('i'), array.array('d')) if scores else array.array('i')
+        if not minimumMatches or minimumMatches < 1:
+            minimumMatches = self.modelSize / 2
+        if self.prefilterThreshold is not None:
+            spans, matches = array.array('i'), []
+            for states, (index, symbs) in itertools.izip(
+                    *self.find_matches(sequence, minimumMatches, cleanSequence=False)):
+                spans.extend((index, index + len(symbs), states.count('M')))
+                matches.append((states, symbs))
+        else:
+            path = self.find_path(sequence, cleanSequence=False)
+            spans = self._timed('matches', self._matchSpans, path, minimumMatches)
+            if scores:
+                matches = [(path[spans[k]:spans[k+1]], sequence[spans[k]:spans[k+1]])
+                           for k in xrange(0, len(spans), 3)]
+        if not scores: return spans
+        numSymbols = len(set(sequence))
+        return spans, array.array('d', (self._scoreMatch(states, symbs, numSymbols)
+                                        for states, symbs in matches))
+    def find_paths_many(self, sequences, cleanSequence=True, workers=None):
+        """Runs find_path on each of the given sequences, returning a list of
+        the paths in the same order. The sequences are shared between a pool
+        of worker threads, one per CPU if workers is None. The C extension
+        releases the GIL while it fills the Viterbi matrix, so the threads
+        run in parallel."""
+        return self._mapMany(lambda seq: self.find_path(seq, cleanSequence),
+                             sequences, workers)
+    def find_matches_many(self, sequences, minimumMatches=None,
+                          cleanSequence=True, workers=None):
+        """Runs find_matches on each of the given sequences using
+        find_paths_many, returning a list of the results in the same order."""
+        if self.prefilterThreshold is not None:
+            return self._mapMany(
+                lambda seq: self.find_matches(seq, minimumMatches, cleanSequence),
+                sequences, workers)
+        if cleanSequence: sequences = self._cleanMany(sequences)
+        paths = self.find_paths_many(sequences, False, workers)
+        return [self._findMatches(path, seq, minimumMatches) if seq else []
+                for path, seq in itertools.izip(paths, sequences)]
+    def fit(self, sequences, iterations=10, viterbiIterations=3, pseudocount=1.0,
+            cleanSequence=True, workers=None, outfile=None):
+        """Re-estimates the match emission and transition probabilities from
+        the given example sequences, which may hold any number of matches
+        among random symbols. The first viterbiIterations rounds use Viterbi
+        training, counting the transitions and emissions along the most likely
+        path through each sequence. The next iterations rounds use Baum-Welch
+        training, counting the expected number of times each is used over
+        every path. The sequences are shared between a pool of worker threads,
+        one per CPU if workers is None, each adding up its counts in its own
+        arrays. pseudocount is added to every count, except those of the
+        transitions the model gives a probability of 0, which are never used.
+        The model is updated in place, and written to outfile if it is given:
+        as a model file like those made by generate_model_file if its name
+        ends in .py, otherwise with save(). Returns the total score of the
+        sequences before each round, in natural log-odds units."""
+        if cleanSequence:
+            sequences = [self._cleanSequence(seq) for seq in sequences]
+        sequences = [seq for seq in sequences if len(seq)]
+        if not sequences:
+            raise ValueError('no sequences were given to fit the model to')
+        symbols = sorted(set(symb for seq in sequences for symb in seq))
+        encoder = self._compiled(symbols)[0]
+        encoded = [self._sequenceToInts(encoder, seq) for seq in sequences]
+        # Each group of sequences is counted by one thread into its own arrays.
+        numGroups = min(4 * (workers or multiprocessing.cpu_count()), len(encoded))
+        groups = [encoded[k::numGroups] for k in range(numGroups)]
+        scores = []
+        for iteration in range(viterbiIterations + iterations):
+            forwardBackward = iteration >= viterbiIterations
+            results = _mapThreads(
+                lambda group: self._countGroup(group, symbols, forwardBackward),
+                groups, workers, 1)
+            score, transCounts, emCounts = results[0]
+            for groupScore, groupTrans, groupEms in results[1:]:
+                score += groupScore
+                for k, count in enumerate(groupTrans): transCounts[k] += count
+                for k, count in enumerate(groupEms): emCounts[k] += count
+            scores.append(score)
+            self._updateParameters(transCounts, emCounts, symbols, pseudocount)
+        if outfile is not None:
+            if outfile.endswith('.py'): self._writeModelFile(outfile)
+            else: self.save(outfile)
+        return scores
+    def find_matches_indexed(self, index, minimumMatches=None):
+        """Finds the matches in the corpus held by a CorpusIndex, returning
+        them as find_matches does. Rather than running on the whole corpus,
+        this uses the index to find every place where enough of the model's
+        match states could emit the symbols found there, and runs the Viterbi
+        algorithm only on the windows around them. The emission scores are
+        set up for the alphabet of the whole corpus."""
+        if not len(index): return []
+        if not minimumMatches or minimumMatches < 1:
+            minimumMatches = self.modelSize / 2
+        windows = self._seedWindows(index, minimumMatches)
+        if 2 * sum(end - start for start, end in windows) > len(index):
+            # Where the seeds are dense, one pass over the corpus is faster.
+            windows = [(0, len(index))]
+        return self._findWindowMatches(index.sequence, windows, len(index),
+                                       index.symbols, minimumMatches)
+    def iter_matches(self, source, alphabet=None, minimumMatches=None,
+                     cleanSequence=True, chunkSize=2**20):
+        """Finds the same matches as find_matches, but reads the sequence from
+        source one chunk at a time, yielding each match as (index, states,
+        symbols) as soon as the path through it can no longer change. The
+        source may be a file object, an mmap, an iterator of chunks, or a
+        whole sequence. The emission scores depend on every symbol in the
+        sequence, so alphabet must be given unless the source can be re-read."""
+        if alphabet is None:
+            alphabet = self._streamAlphabet(source, chunkSize, cleanSequence)
+        elif cleanSequence:
+            alphabet = self._cleanSequence(alphabet)
+        symbols = sorted(set(alphabet))
+        if not symbols: return
+        offset, state, final = 0, None, False
+        seqBuff, pathBuff = [], ''
+        chunks = self._iterChunks(source, chunkSize)
+        while not final:
+            chunk = next(chunks, None)
+            final = chunk is None
+            if final: chunk = []
+            elif cleanSequence: chunk = self._cleanSequence(chunk)
+            seqBuff.extend(chunk)
+            path, state = self._findPathChunk(chunk, symbols, state, final)
+            pathBuff += path
+            # Every match that began before the last random state has ended.
+            end = len(pathBuff) if final else pathBuff.rfind('R') + 1
+            if not end: continue
+            stateMatches, seqMatches = self._findMatches(
+                pathBuff[:end], seqBuff[:end], minimumMatches)
+            for states, (index, symbs) in itertools.izip(stateMatches, seqMatches):
+                yield offset + index, states, symbs
+            pathBuff = pathBuff[end:]
+            del seqBuff[:end]
+            offset += end
+
+    def compile(self, alphabet):
+        """Builds the emission and transition tables used to search sequences
+        made up of the symbols in alphabet, and returns them. The tables for
+        the most recent maxCachedAlphabets alphabets are kept, so that every
+        later search of a sequence with the same set of symbols skips this
+        setup. This is done automatically on each search; calling it directly
+        just does the work in advance."""
+        return self._compiled(sorted(set(self._cleanSequence(alphabet))))
+    def cache_info(self):
+        """Returns a dict of the hits, misses, current size and maximum size
+        of the cache of compiled tables."""
+        return {'hits':self._cacheHits, 'misses':self._cacheMisses,
+                'size':len(self._compiledCache), 'maxSize':self.maxCachedAlphabets}
+    def clear_cache(self):
+        """Empties the cache of compiled tables, and the in-memory cache of
+        results. This must be called if the model's probabilities are changed
+        after it was created."""
+        with self._cacheLock:
+            self._compiledCache.clear()
+            self._scoreTablesCache = None
+            self._fingerprint = None
+        self.clear_result_cache()
+    def result_cache_info(self):
+        """Returns a dict of the number of paths found in the in-memory cache
+        of results ('hits') and in resultCacheDir ('diskHits'), the number
+        that had to be found by the Viterbi algorithm ('misses'), and the
+        number dropped from memory to stay under the limits ('evictions'),
+        since the last clear. Also includes the current size and bytes of the
+        cache, their limits, and the fraction of lookups that were hits."""
+        with self._resultLock:
+            info = dict(self._resultCounts)
+            info.update(size=len(self._resultCache), bytes=self._resultBytes)
+        info.update(maxSize=self.resultCacheSize, maxBytes=self.resultCacheBytes)
+        lookups = info['hits'] + info['diskHits'] + info['misses']
+        info['hitRate'] = (info['hits'] + info['diskHits']) / float(lookups) if lookups else None
+        return info
+    def clear_result_cache(self):
+        """Empties the in-memory cache of results and resets the counts
+        returned by result_cache_info. The files in resultCacheDir are kept;
+        they can only be found again by an identical model."""
+        with self._resultLock:
+            self._resultCache.clear()
+            self._resultBytes = 0
+            self._resultCounts = dict.fromkeys(_resultKeys, 0)
+
+    def prefilter_info(self):
+        """Returns a dict of counts describing how many sequences and symbols
+        have passed each stage of find_matches since the last reset, when
+        prefilterThreshold is set. 'sequencesPassed' and 'symbolsPassed' count
+        those kept by the ungapped prefilter, and 'sequencesMatched' those in
+        which the full Viterbi algorithm then found a match. Also includes
+        the pass rates of each stage, for tuning the threshold."""
+        with self._prefilterLock:
+            info = dict(self._prefilterCounts)
+        def rate(num, denom):
+            return float(num) / denom if denom else None
+        info['sequencePassRate'] = rate(info['sequencesPassed'], info['sequences'])
+        info['symbolPassRate'] = rate(info['symbolsPassed'], info['symbols'])
+        info['matchRate'] = rate(info['sequencesMatched'], info['sequencesPassed'])
+        return info
+    def reset_prefilter_info(self):
+        """Sets the counts returned by prefilter_info back to 0."""
+        with self._prefilterLock:
+            self._prefilterCounts = dict.fromkeys(_prefilterKeys, 0)
+
+    def stats_info(self):
+        """Returns a dict of the totals recorded over every find_path and
+        find_matches call since the last reset, when collectStats is set: the
+        number of calls, the seconds spent cleaning the sequence, compiling
+        the model's tables, encoding the sequence, prefiltering, loading it
+        into the C extension, filling the Viterbi matrix, tracing the path
+        back and finding the matches, and the total. Also includes the number
+        of matrix cells filled, the bytes allocated for them, and the cells
+        filled per second."""
+        with self._statsLock:
+            info = dict(self._statsTotals)
+        info['cellsPerSecond'] = info['cells'] / info['fill'] if info['fill'] else None
+        return info
+    def reset_stats(self):
+        """Sets the totals returned by stats_info back to 0."""
+        with self._statsLock:
+            self._statsTotals = dict.fromkeys(('calls',) + _statsKeys, 0)
 
     # # #  Output Methods
     def _printPath(self, path, sequence, printWidth=80):
@@ -72,9 +532,511 @@ class Hmm_base(object):
         print 'Found %i matches in total.' % i
 
     # # # # #  Private Methods  # # # # #
+    def _compiled(self, symbols):
+        """Returns the tables from _compile() for the given sorted symbols,
+        from the cache if possible. The least recently used alphabet is
+        dropped once the cache is full."""
+        symbols = tuple(symbols)
+        with self._cacheLock:
+            compiled = self._compiledCache.pop(symbols, None)
+            if compiled is None:
+                self._cacheMisses += 1
+                compiled = self._timed('compile', self._compile, symbols)
+                while len(self._compiledCache) >= max(self.maxCachedAlphabets, 1):
+                    self._compiledCache.popitem(last=False)
+            else:
+                self._cacheHits += 1
+            self._compiledCache[symbols] = compiled
+        return compiled
+    def _cachingResults(self):
+        return self.resultCacheSize > 0 or self.resultCacheDir is not None
+    def _cachedPath(self, sequence):
+        """Returns the path through the sequence from the cache of results if
+        possible, otherwise finds it and adds it to the cache. A path read
+        from resultCacheDir is kept in memory too."""
+        symbols = sorted(set(sequence))
+        seq = self._timed('encode', self._sequenceToInts, self._compiled(symbols)[0],
+                          sequence)
+        key = self._resultKey(seq, symbols)
+        with self._resultLock:
+            path = self._resultCache.pop(key, None)
+            if path is not None:
+                self._resultCache[key] = path
+                self._resultCounts['hits'] += 1
+                return path
+        path = self._storedResult(key)
+        if path is not None:
+            count = 'diskHits'
+        else:
+            count = 'misses'
+            path = self._findPathEncoded(seq, symbols)
+            if self.resultCacheDir is not None: self._storeResult(key, path)
+        with self._resultLock:
+            self._resultCounts[count] += 1
+            if self.resultCacheSize > 0 and key not in self._resultCache:
+                self._resultCache[key] = path
+                self._resultBytes += len(path)
+            while self._resultCache and (len(self._resultCache) > self.resultCacheSize or
+                                         self._resultBytes > self.resultCacheBytes):
+                self._resultBytes -= len(self._resultCache.popitem(last=False)[1])
+                self._resultCounts['evictions'] += 1
+        return path
+    def _resultKey(self, seq, symbols):
+        """Returns the hex digest of the model's fingerprint, the score
+        precision, the symbols and the encoded sequence."""
+        digest = hashlib.sha1(self._modelFingerprint())
+        digest.update(repr((getattr(self, 'scorePrecision', None), tuple(symbols))))
+        if isinstance(seq, str):
+            digest.update(seq)
+        elif hasattr(seq, 'tobytes'):
+            digest.update(seq.tobytes())
+        else:
+            digest.update(array.array('i', seq).tostring())
+        return digest.hexdigest()
+    def _modelFingerprint(self):
+        """Returns a digest of the model's log transition probabilities and
+        its emission probabilities, which clear_cache() forgets."""
+        if self._fingerprint is None:
+            intoM, intoI, intoD = self._scoreTables()[:3]
+            digest = hashlib.sha1(array.array('d', (log for j in range(self.modelSize)
+                for log in intoM[j] + intoI[j] + intoD[j])).tostring())
+            symbols, emProbs = self._emissionProbs()
+            digest.update(repr(symbols))
+            digest.update(emProbs.tostring())
+            self._fingerprint = digest.digest()
+        return self._fingerprint
+    def _storedResultPath(self, key):
+        return os.path.join(self.resultCacheDir, key[:2], key[2:])
+    def _storedResult(self, key):
+        """Returns the path stored under key in resultCacheDir, or None."""
+        if self.resultCacheDir is None: return None
+        try:
+            with open(self._storedResultPath(key), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+    def _storeResult(self, key, path):
+        """Writes the path to resultCacheDir. Each file is written under a
+        temporary name and then renamed, so other processes never read a
+        partly written one. The path is simply not stored if it can't be
+        written, as when the disk is full, so that the search still
+        succeeds."""
+        filename = self._storedResultPath(key)
+        dirname = os.path.dirname(filename)
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname): return
+        try:
+            fd, tempName = tempfile.mkstemp(dir=dirname)
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(path)
+            os.rename(tempName, filename)
+        except (IOError, OSError):  # Also, Windows won't rename over another file.
+            try:
+                os.remove(tempName)
+            except OSError:
+                pass
+    def _findMatchesFiltered(self, sequence, minimumMatches):
+        """Runs the full Viterbi algorithm only on the windows of the sequence
+        that pass the ungapped prefilter. The emission scores are still set
+        up for the alphabet of the whole sequence. Each hit is the last
+        residue of an ungapped alignment, which began at most modelSize
+        residues earlier."""
+        symbols = sorted(set(sequence))
+        hits = self._timed('prefilter', self._ungappedHits, sequence, symbols,
+                           self.prefilterThreshold)
+        windows = self._mergeWindows(((i + 1 - self.modelSize, i + 1) for i in hits),
+                                     len(sequence))
+        stateMatches, seqMatches = self._findWindowMatches(
+            lambda start, end: sequence[start:end], windows, len(sequence),
+            symbols, minimumMatches)
+        with self._prefilterLock:
+            counts = self._prefilterCounts
+            counts['sequences'] += 1
+            counts['sequencesPassed'] += bool(windows)
+            counts['sequencesMatched'] += bool(stateMatches)
+            counts['windows'] += len(windows)
+            counts['symbols'] += len(sequence)
+            counts['symbolsPassed'] += sum(end - start for start, end in windows)
+        return stateMatches, seqMatches
+    def _findWindowMatches(self, getWindow, windows, seqLen, symbols, minimumMatches):
+        """Finds the matches in each (start, end) window of a sequence of
+        length seqLen, where getWindow(start, end) returns that part of the
+        sequence. The path through a window begins and ends in the random
+        state, so a window that cuts through a match would cut it short or
+        invent one. Each window is therefore widened by modelSize, then twice
+        that and so on, until its path starts and ends with the random state
+        or it reaches the ends of the sequence or the last window; any later
+        windows it grows into are joined to it. The indices of the matches are
+        relative to the whole sequence."""
+        stateMatches, seqMatches = [], []
+        windows = list(windows)
+        k, lastEnd = 0, 0
+        edge = 'R' * self.modelSize
+        while k < len(windows):
+            (start, end), k = windows[k], k + 1
+            pad = self.modelSize
+            while True:
+                while k < len(windows) and windows[k][0] <= end:
+                    end, k = max(end, windows[k][1]), k + 1
+                window = getWindow(start, end)
+                path = self._findPath(window, symbols)
+                growStart = start > lastEnd and not path.startswith(edge)
+                growEnd = end < seqLen and not path.endswith(edge)
+                if not (growStart or growEnd): break
+                if growStart: start = max(start - pad, lastEnd)
+                if growEnd: end = min(end + pad, seqLen)
+                pad *= 2
+            states, seqs = self._timed('matches', self._findMatches, path, window,
+                                       minimumMatches)
+            stateMatches.extend(states)
+            seqMatches.extend((start + index, symbs) for index, symbs in seqs)
+            lastEnd = end
+        return stateMatches, seqMatches
+    def _seedWindows(self, index, minimumMatches):
+        """Returns the windows of the corpus found by _seedRegions and
+        _mergeWindows. With numpy, the hits on each diagonal are counted with
+        np.bincount instead of being sorted, in batches of about the corpus
+        length, and each band of modelSize diagonals starting on a hit and
+        holding at least minimumMatches of them gives the region from that
+        diagonal to the last hit in the band."""
+        if np is None:
+            return self._mergeWindows(self._seedRegions(index, minimumMatches),
+                                      len(index))
+        L, n = self.modelSize, len(index)
+        # The hits on diagonal d are counted at d + L - 1.
+        counts = np.zeros(n + 2*L, np.intp)
+        offsets, pending = [], 0
+        for j in range(L):
+            emissions = self.rawMatchEmissions['M%i' % (j+1)]
+            for symb in set(symb.upper() for symb, prob in emissions.items() if prob):
+                positions = index.positions(symb)
+                if not len(positions): continue
+                offsets.append(np.asarray(positions, np.intp) + (L - 1 - j))
+                pending += len(positions)
+                if pending >= n:
+                    counts += np.bincount(np.concatenate(offsets), minlength=len(counts))
+                    offsets, pending = [], 0
+        if offsets:
+            counts += np.bincount(np.concatenate(offsets), minlength=len(counts))
+        totals = np.concatenate(([0], np.cumsum(counts)))
+        bands = totals[L:] - totals[:-L]
+        firsts = np.flatnonzero((counts[:len(bands)] > 0) & (bands >= minimumMatches))
+        if not len(firsts): return []
+        lasts = np.searchsorted(totals, totals[firsts + L], 'left') - 1
+        # As _mergeWindows, in sequence positions. The ends never decrease.
+        starts = np.maximum(firsts - (L - 1) - L, 0)
+        ends = np.minimum(lasts + 1 + L, n)
+        breaks = np.flatnonzero(starts[1:] > ends[:-1]) + 1
+        starts = starts[np.concatenate(([0], breaks))]
+        ends = ends[np.concatenate((breaks - 1, [len(ends) - 1]))]
+        return zip(starts.tolist(), ends.tolist())
+    def _seedRegions(self, index, minimumMatches):
+        """Every match state of a match emits a symbol it gives a non-zero
+        probability to, so each places the model on the diagonal (sequence
+        position - model position) it was found on. Inserts and deletes move
+        the later states of a match onto nearby diagonals. This finds every
+        place the model's symbols occur in the corpus, and returns the sorted
+        (start, end) regions spanned by each band of modelSize diagonals
+        holding at least minimumMatches of them."""
+        diagonals = []
+        for j in range(self.modelSize):
+            emissions = self.rawMatchEmissions['M%i' % (j+1)]
+            for symb in set(symb.upper() for symb, prob in emissions.items() if prob):
+                diagonals.extend(i - j for i in index.positions(symb))
+        diagonals.sort()
+        regions = []
+        for k in xrange(len(diagonals) - minimumMatches + 1):
+            if diagonals[k + minimumMatches - 1] - diagonals[k] < self.modelSize:
+                regions.append((diagonals[k],
+                                diagonals[k + minimumMatches - 1] + self.modelSize))
+        return regions
+    def _mergeWindows(self, regions, seqLen):
+        """Pads each (start, end) region of the sequence, which must be sorted
+        by start, by modelSize on both sides to leave room for inserts and
+        deletes. Returns the overlapping regions merged into windows."""
+        windows = []
+        for start, end in regions:
+            start = max(start - self.modelSize, 0)
+            end = min(end + self.modelSize, seqLen)
+            if windows and start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], end)
+            else:
+                windows.append([start, end])
+        return [tuple(window) for window in windows]
+    def _emissionProbs(self):
+        """Returns the sorted symbols that any match state emits, and an array
+        of the probability of each match state emitting each of them."""
+        if self._tables is not None:
+            return self._tables[0], array.array('d', self._tables[1])
+        emissions = [self.rawMatchEmissions['M%i' % (j+1)] for j in range(self.modelSize)]
+        symbols = sorted(set(symb for ems in emissions for symb, prob in ems.items() if prob))
+        return symbols, array.array('d', (ems.get(symb, 0.0)
+                                          for ems in emissions for symb in symbols))
+    def _loadedEmissions(self, symbols, upperCase=False):
+        """For a model read by load(), returns the list of log-odds emission
+        scores of the given symbols at each model position, by position then
+        symbol, worked out from the stored probabilities as _setupEmissions
+        does. The stored symbols are upper-cased first if upperCase is True.
+        Returns None for other models."""
+        if self._tables is None: return None
+        emSymbols, emProbs = self._tables[:2]
+        negInf = -float('inf')
+        index = dict(((symb.upper() if upperCase else symb), k)
+                     for k, symb in enumerate(emSymbols))
+        cols = [index.get(symb) for symb in symbols]
+        randProb = 1.0 / len(symbols)
+        nums = (0.0 if k is None else emProbs[row + k] / randProb
+                for row in xrange(0, len(emProbs), len(emSymbols)) for k in cols)
+        return [math.log(num) if num else negInf for num in nums]
+    def _loadedTransProbs(self):
+        negInf = -float('inf')
+        logs = _readDoubles(self._tables[2][:])
+        transProbs = {}
+        for (a, b), log in itertools.izip(self._transitionPairs(), logs):
+            if log != negInf: transProbs.setdefault(a, {})[b] = math.exp(log)
+        return transProbs
+    def _loadedMatchEmissions(self):
+        symbols, emProbs = self._tables[:2]
+        matchEmissions = {}
+        for j in range(self.modelSize):
+            probs = emProbs[j*len(symbols):(j+1)*len(symbols)]
+            matchEmissions['M%i' % (j+1)] = dict(
+                (symb, prob) for symb, prob in itertools.izip(symbols, probs) if prob)
+        return matchEmissions
+    def _statsRecord(self):
+        """Returns the stats record of the call running in this thread, or
+        None if stats aren't being collected."""
+        return getattr(self._statsLocal, 'record', None)
+    def _timed(self, phase, func, *args):
+        """Returns func(*args), adding the time it took to the phase in the
+        current stats record, if there is one."""
+        record = self._statsRecord()
+        if record is None: return func(*args)
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            record[phase] = record.get(phase, 0) + time.time() - start
+    def _addStats(self, stats):
+        """Adds each of the stats dict's values to the current record."""
+        record = self._statsRecord()
+        if record is None: return
+        for key, value in stats.items():
+            record[key] = record.get(key, 0) + value
+    def _setStat(self, key, value):
+        record = self._statsRecord()
+        if record is not None: record[key] = value
+    def _finishStats(self, record):
+        fill = record.get('fill')
+        record['cellsPerSecond'] = record.get('cells', 0) / fill if fill else None
+        with self._statsLock:
+            self._statsTotals['calls'] += 1
+            for key in _statsKeys:
+                self._statsTotals[key] += record.get(key, 0)
+        if self.statsCallback is not None:
+            self.statsCallback(record)
+    def _mapMany(self, func, sequences, workers):
+        return _mapThreads(func, sequences, workers)
+    def _countGroup(self, sequences, symbols, forwardBackward):
+        """Returns the total score of the encoded sequences, and arrays of the
+        counts of each transition, in the order of _transitionPairs, and of
+        each match state emitting each symbol, by position then symbol."""
+        transCounts = array.array('d', [0.0]) * (9 * self.modelSize)
+        emCounts = array.array('d', [0.0]) * (self.modelSize * len(symbols))
+        score = 0.0
+        for seq in sequences:
+            score += self._addCounts(seq, symbols, forwardBackward, transCounts, emCounts)
+        return score, transCounts, emCounts
+    def _updateParameters(self, transCounts, emCounts, symbols, pseudocount):
+        """Sets the model's probabilities to the counts from _countGroup plus
+        the pseudocount, normalised over the states leaving each state and the
+        symbols emitted by each match state, and rebuilds everything worked
+        out from them. A state that was never counted gets equal probabilities
+        for each of its transitions and each symbol if pseudocount is above 0,
+        and otherwise keeps its old probabilities."""
+        oldTrans, oldEms = self.transProbs, self.rawMatchEmissions
+        transProbs = {}
+        for (a, b), count in itertools.izip(self._transitionPairs(), transCounts):
+            if oldTrans.get(a, {}).get(b):
+                transProbs.setdefault(a, {})[b] = count + pseudocount
+        for a, probs in transProbs.items():
+            total = sum(probs.values())
+            for b in probs:
+                probs[b] = probs[b] / total if total else oldTrans[a][b]
+        matchEmissions = {}
+        for j in range(self.modelSize):
+            name = 'M%i' % (j+1)
+            counts = emCounts[j*len(symbols):(j+1)*len(symbols)]
+            total = sum(counts) + pseudocount * len(symbols)
+            if not total:
+                matchEmissions[name] = dict(oldEms[name])
+                continue
+            matchEmissions[name] = dict((symb, (count + pseudocount) / total)
+                                        for symb, count in itertools.izip(symbols, counts))
+        self.transProbs = transProbs
+        self.rawMatchEmissions = matchEmissions
+        self._tables = None
+        self.columnProbs = self._setupColumnProbs(transProbs)
+        self.clear_cache()
+    def _writeModelFile(self, filename):
+        """Writes the model's probabilities as a model file in the form made by
+        generate_model_file, which defines the same model when imported."""
+        def formatDict(probs, sep):
+            return '{%s}' % ', '.join('%r:%s%r' % (key, sep, probs[key])
+                                      for key in sorted(probs))
+        names = ['R'] + ['%s%i' % (state, j+1) for j in range(self.modelSize)
+                         for state in 'MID']
+        buff = ["from %s import Hmm" % _packageName,
+                "\n# Fitted to example sequences by Hmm.fit().",
+                "matchEmissions = {"]
+        for j in range(self.modelSize):
+            name = 'M%i' % (j+1)
+            buff.append("\t%r: %s," % (name, formatDict(self.rawMatchEmissions[name], ' ')))
+        buff.extend(["\t}", "\n# The transition probabilities leaving each state.",
+                     "transitionProbabilities = {"])
+        for name in names:
+            if name in self.transProbs:
+                buff.append("\t%r:%s," % (name, formatDict(self.transProbs[name], '')))
+        buff.append("\t}\n")
+        buff.append("model = Hmm(matchEmissions, transitionProbabilities)\n")
+        with open(filename, 'wb') as f:
+            f.write('\n'.join(buff))
+    def _scoreMatch(self, states, symbs, numSymbols):
+        """Returns the natural log-odds score of the best path through the
+        model that enters from the random state, passes through the given
+        match and insert states emitting symbs, and returns to the random
+        state. The delete states aren't part of a match, so every way of
+        placing them is tried. Emissions are scored against a random model
+        over numSymbols symbols, so only scores using the same alphabet can
+        be compared. The scores are kept in dicts of model position to score
+        holding only the reachable states, as a match rules out most."""
+        negInf = -float('inf')
+        intoM, intoI, intoD, emissions = self._scoreTables()
+        L, logNum = self.modelSize, math.log(numSymbols)
+        def deletes(M, I):
+            # Each chain of deletes is followed for as long as it raises the
+            # scores, which may wrap around from the last position.
+            D = {}
+            for p in set(M) | set(I):
+                j = p + 1 if p < L - 1 else 0
+                v = max(M.get(p, negInf) + intoD[j][0], I.get(p, negInf) + intoD[j][1])
+                while v > D.get(j, negInf):
+                    D[j] = v
+                    j = j + 1 if j < L - 1 else 0
+                    v += intoD[j][2]
+            return D
+        M, I = {}, {L-1: 0.0}
+        for state, symb in itertools.izip(states, symbs):
+            D = deletes(M, I)
+            if state == 'M':
+                newM = {}
+                for j, ems in emissions.get(symb.upper(), ()):
+                    p = j - 1 if j else L - 1
+                    v = max(M.get(p, negInf) + intoM[j][0], I.get(p, negInf) + intoM[j][1],
+                            D.get(p, negInf) + intoM[j][2])
+                    if v != negInf: newM[j] = v + ems + logNum
+                M, I = newM, {}
+            else:
+                newI = {}
+                for j in set(M) | set(I) | set(D):
+                    if j == L - 1: continue  # The random state.
+                    v = max(M.get(j, negInf) + intoI[j][0], I.get(j, negInf) + intoI[j][1],
+                            D.get(j, negInf) + intoI[j][2])
+                    if v != negInf: newI[j] = v
+                M, I = {}, newI
+        D = deletes(M, I)
+        score = max(M.get(L-1, negInf) + intoI[L-1][0], D.get(L-1, negInf) + intoI[L-1][2])
+        if score == negInf:  # The sequence ended during the match.
+            score = max(M.values() + I.values() + D.values() + [negInf])
+        return score
+    def _scoreTables(self):
+        """Returns the log transition probabilities into each model position's
+        match, insert and delete states from the (M, I, D) states they can
+        come from, as in _setupColumnProbs, and a dict mapping each symbol to
+        the (position, log probability) of the match states that emit it."""
+        if self._scoreTablesCache is not None:
+            return self._scoreTablesCache
+        negInf = -float('inf')
+        def trans(a, b):
+            prob = self.transProbs.get(a, {}).get(b, 0.0)
+            return math.log(prob) if prob else negInf
+        L = self.modelSize
+        logs = [trans(a, b) for a, b in self._transitionPairs()]
+        intoM = [logs[9*j:9*j+3] for j in range(L)]
+        intoI = [logs[9*j+3:9*j+6] for j in range(L)]
+        intoD = [logs[9*j+6:9*j+9] for j in range(L)]
+        emissions = collections.defaultdict(list)
+        for j in range(L):
+            for symb, prob in self.rawMatchEmissions['M%i'%(j+1)].items():
+                if prob: emissions[symb.upper()].append((j, math.log(prob)))
+        self._scoreTablesCache = intoM, intoI, intoD, dict(emissions)
+        return self._scoreTablesCache
+    def _transitionPairs(self):
+        """Returns the (from, to) names of the 9 transitions into each model
+        position in turn, in the order of _setupColumnProbs."""
+        L = self.modelSize
+        Ms = ['M%i'%(j+1) for j in range(L)]
+        Is = ['I%i'%(j+1) for j in range(L-1)] + ['R']
+        Ds = ['D%i'%(j+1) for j in range(L)]
+        pairs = []
+        for j in range(L):
+            pairs.extend(((Ms[j-1], Ms[j]), (Is[j-1], Ms[j]), (Ds[j-1], Ms[j]),
+                          (Ms[j], Is[j]), (Is[j], Is[j]), (Ds[j], Is[j]),
+                          (Ms[j-1], Ds[j]), (Is[j-1], Ds[j]), (Ds[j-1], Ds[j])))
+        return pairs
     # # #  Output and formatting methods
     def _cleanSequence(self, seq):
+        """Byte strings are cleaned in one pass and stay as strings; anything
+        else becomes a list of upper-case alpha-numeric symbols."""
+        if isinstance(seq, str):
+            return seq.translate(_upperTable, _nonAlnumChars)
         return [symb.upper() for symb in itertools.imap(str, seq) if symb.isalnum()]
+    def _cleanMany(self, sequences):
+        """Returns the list of the sequences cleaned by _cleanSequence. If
+        they are all byte strings and none holds a newline, they are joined
+        by newlines and cleaned in a single pass, then split apart again."""
+        sequences = list(sequences)
+        if sequences and all(isinstance(seq, str) for seq in sequences):
+            joined = '\n'.join(sequences)
+            if joined.count('\n') == len(sequences) - 1:
+                return joined.translate(_upperTable, _nonAlnumKeptNewlines).split('\n')
+        return [self._cleanSequence(seq) for seq in sequences]
+    def _setupEncoder(self, symbols):
+        """Returns a dict mapping each symbol to its index. If every symbol is
+        a single character, also returns a 256-entry translation table so that
+        byte strings can be encoded in one pass; characters that aren't in
+        symbols become index 255, which the engines reject."""
+        num = dict((c,i) for i, c in enumerate(symbols))
+        if len(symbols) >= 256 or any(len(symb) != 1 for symb in symbols):
+            return None, num
+        table = ['\xff'] * 256
+        for symb, i in num.items(): table[ord(symb)] = chr(i)
+        return ''.join(table), num
+    def _iterChunks(self, source, chunkSize):
+        if hasattr(source, 'read'):
+            return iter(lambda: source.read(chunkSize), '')
+        if isinstance(source, (basestring, list, tuple)):
+            return (source[i:i+chunkSize] for i in xrange(0, len(source), chunkSize))
+        return iter(source)
+    def _streamAlphabet(self, source, chunkSize, cleanSequence):
+        """Collects every symbol in the source, then rewinds it."""
+        if isinstance(source, (basestring, list, tuple)):
+            chunks = [source]
+        elif hasattr(source, 'seek'):
+            pos = source.tell()
+            chunks = self._iterChunks(source, chunkSize)
+        else:
+            raise TypeError('an alphabet must be given if the source can only be read once')
+        alphabet = set()
+        for chunk in chunks:
+            alphabet.update(self._cleanSequence(chunk) if cleanSequence else chunk)
+        if hasattr(source, 'seek'): source.seek(pos)
+        return alphabet
     def _lineupSeqPath(self, sequence, path):
         """Formats both sequences into strings, with comma-separators if any sequence
         symbol is wider than a single character."""
@@ -94,31 +1056,28 @@ class Hmm_base(object):
             print seq2[i:i+printWidth]
             print
     def _findMatches(self, filteredStates, seq, minimumMatches):
+        """Returns the lists of states and of (index, symbols) of each match in
+        the path, with insert states and the symbols they emit in lower case.
+        Only the matches found by _matchSpans are split into lists."""
         if not minimumMatches or minimumMatches < 1:
             minimumMatches = self.modelSize / 2
-        i, isMatch = 0, False
         seqMatches, stateMatches = [], []
-        seqBuff, stateBuff = [], []
-        for state, c in itertools.izip(filteredStates, seq):
-            if state == 'R':
-                if isMatch:
-                    if stateBuff.count('M') >= minimumMatches:
-                        seqMatches.append((seqBuff[0], seqBuff[1:]))
-                        stateMatches.append(stateBuff[:])
-                    isMatch = False
-            else:
-                if not isMatch:
-                    seqBuff, stateBuff = [i], []
-                    isMatch = True
-                if state == 'I':
-                    seqBuff.append(c.lower())
-                    stateBuff.append(state.lower())
-                else:
-                    seqBuff.append(c)
-                    stateBuff.append(state)
-            i += 1
-        if isMatch:
-            if stateBuff.count('M') >= minimumMatches:
-                seqMatches.append((seqBuff[0], seqBuff[1:]))
-                stateMatches.append(stateBuff[:])
+        spans = self._matchSpans(filteredStates, minimumMatches)
+        for k in xrange(0, len(spans), 3):
+            start, end = spans[k], spans[k+1]
+            states = filteredStates[start:end]
+            stateMatches.append(list(states.replace('I', 'i')))
+            seqMatches.append((start, [c.lower() if state == 'I' else c for state, c in
+                                       itertools.izip(states, seq[start:end])]))
         return stateMatches, seqMatches
+    def _matchSpans(self, path, minimumMatches):
+        """Returns an array holding the start, end and number of match states
+        of each run of non-random states in the path with at least
+        minimumMatches match states, in turn."""
+        spans = array.array('i')
+        for run in _matchRun.finditer(path):
+            start, end = run.span()
+            numMatches = path.count('M', start, end)
+            if numMatches >= minimumMatches:
+                spans.extend((start, end, numMatches))
+        return spans
@@ -0,0 +1,6 @@
+"""Regression tests for patternHmm. The package must be importable as
+patternHmm, with the Viterbi extension compiled; run them from the directory
+holding it with:
+
+    python -m unittest discover -s patternHmm/tests -t .
+"""
@@ -0,0 +1,89 @@
+"""Random models and sequences shared by the tests."""
+import random
+
+def random_model(rand, modelSize, alphabet):
+    """Returns the (matchEmissions, transitionProbabilities) dictionaries of a
+    model of the given size with random probabilities, where each match state
+    emits 1 to 3 of the symbols in alphabet."""
+    ems = {}
+    for i in range(1, modelSize+1):
+        symbs = rand.sample(alphabet, rand.randint(1, 3))
+        ems['M%i' % i] = dict((symb, rand.random()) for symb in symbs)
+    trans = {'R':{'R':rand.random(), 'M1':rand.random(), 'D1':rand.random()}}
+    for i in range(1, modelSize):
+        for s in ('M', 'I'):
+            trans['%s%i' % (s, i)] = {'I%i' % i:rand.random(),
+                'M%i' % (i+1):rand.random(), 'D%i' % (i+1):rand.random()}
+        trans['D%i' % i] = {'M%i' % (i+1):rand.random(), 'D%i' % (i+1):rand.random()}
+    trans['M%i' % modelSize] = {'R':rand.random(), 'M1':rand.random()}
+    trans['D%i' % modelSize] = {'R':1.0}
+    return ems, trans
+
+def default_model(modelSize):
+    """Returns the dictionaries of the model written by generate_model_file,
+    whose equal probabilities give many paths with the same score."""
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    ems = dict(('M%i' % i, {alphabet[(i-1)%26]:1.0}) for i in range(1, modelSize+1))
+    trans = {'R':{'R':0.9, 'M1':0.05, 'D1':0.05}}
+    for i in range(1, modelSize):
+        trans['M%i' % i] = {'I%i' % i:0.3, 'M%i' % (i+1):0.6, 'D%i' % (i+1):0.1}
+        trans['I%i' % i] = {'I%i' % i:0.4, 'M%i' % (i+1):0.5, 'D%i' % (i+1):0.1}
+        trans['D%i' % i] = {'M%i' % (i+1):0.9, 'D%i' % (i+1):0.1}
+    trans['M%i' % modelSize] = {'R':0.9, 'M1':0.1, 'D1':0.0}
+    trans['D%i' % modelSize] = {'R':1.0, 'M1':0.0, 'D1':0.0}
+    return ems, trans
+
+def random_sequence(rand, alphabet, length):
+    return ''.join(rand.choice(alphabet) for i in xrange(length))
+
+def gapped_copies(rand, pattern, noise, copies, skip=0.3):
+    """Returns a sequence of copies of pattern with symbols randomly left out,
+    separated by short runs of the noise symbols."""
+    parts = []
+    for k in range(copies):
+        parts.append(''.join(c for c in pattern if rand.random() > skip))
+        parts.append(random_sequence(rand, noise, rand.randint(0, 4)))
+    return ''.join(parts)
+
+def model_cases(kind, cases, seqsPerCase=3):
+    """Yields the (matchEmissions, transitionProbabilities, sequences) of the
+    given number of cases of a kind of model: 'random' for random models of 2
+    to 40 positions, 'deletes' for random models of 100 positions whose
+    deletes cost little, giving chains crossing many positions, and 'tied'
+    for the default model, whose gapped copies of its pattern have many paths
+    with the same score. Each case is seeded by its number."""
+    for case in range(cases):
+        rand = random.Random(case)
+        if kind == 'random':
+            ems, trans = random_model(rand, rand.randint(2, 40), 'ABCDEF')
+            seqs = [random_sequence(rand, 'ABCDEF', rand.randint(1, 300))
+                    for k in range(seqsPerCase)]
+        elif kind == 'deletes':
+            ems, trans = random_model(rand, 100, 'ABCDEF')
+            for i in range(1, 100):
+                trans['D%i' % i]['D%i' % (i+1)] = 1.0
+            seqs = [random_sequence(rand, 'ABCDEF', 100) for k in range(seqsPerCase)]
+        elif kind == 'tied':
+            ems, trans = default_model(12)
+            seqs = [gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZAB', 20)
+                    for k in range(seqsPerCase)]
+        else:
+            raise ValueError('unknown kind of model %r' % kind)
+        yield ems, trans, seqs
+
+class SamePathsMixin(object):
+    """Runs self.assertSamePaths(ems, trans, seqs) on each kind of model of
+    model_cases, with as many cases of each as the class asks for."""
+    randomCases, deleteCases, tiedCases, seqsPerCase = 20, 5, 20, 3
+
+    def test_random_models(self):
+        for ems, trans, seqs in model_cases('random', self.randomCases, self.seqsPerCase):
+            self.assertSamePaths(ems, trans, seqs)
+
+    def test_long_delete_chains(self):
+        for ems, trans, seqs in model_cases('deletes', self.deleteCases):
+            self.assertSamePaths(ems, trans, seqs)
+
+    def test_tied_paths(self):
+        for ems, trans, seqs in model_cases('tied', self.tiedCases):
+            self.assertSamePaths(ems, trans, seqs)
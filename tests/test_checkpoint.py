@@ -0,0 +1,30 @@
+"""The checkpointed traceback recomputes the back-pointers block by block from
+the kept columns, and should find exactly the path of the full traceback,
+including where several paths have the same score."""
+import unittest
+from helpers import SamePathsMixin
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm, Viterbi
+except ImportError:
+    CHmm = None
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CheckpointTest(SamePathsMixin, unittest.TestCase):
+    def assertSamePaths(self, ems, trans, seqs):
+        model = CHmm(ems, trans)
+        expected = [model.find_path(seq) for seq in seqs]
+        # Block lengths at and around the edges of the sequence, as well as
+        # the sqrt(n) chosen by find_path.
+        for seq, path in zip(seqs, expected):
+            encoder, compiled = model._compiled(sorted(set(seq)))
+            encoded = model._sequenceToInts(encoder, seq)
+            for blockLen in (1, 2, 3, 7, len(seq) - 1, len(seq)):
+                if blockLen > 0:
+                    self.assertEqual(Viterbi.findPath(encoded, compiled, blockLen), path)
+        model.maxPathsBytes = model.modelSize
+        self.assertEqual([model.find_path(seq) for seq in seqs], expected)
+        self.assertEqual(model.find_paths_many(seqs, workers=1), expected)
+
+if __name__ == '__main__':
+    unittest.main()
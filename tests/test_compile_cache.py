@@ -0,0 +1,91 @@
+"""The tables compiled for each alphabet should be kept for the most recently
+used maxCachedAlphabets alphabets, counted in cache_info(), and dropped by
+clear_cache(), without changing any path found."""
+import unittest
+from helpers import default_model
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+SEQS = {'abc':'ABCABCCBA', 'abd':'ABDABDDBA', 'abe':'ABEABEEBA', 'abf':'ABFABFFBA'}
+
+class CompileCacheMixin(object):
+    def setUp(self):
+        self.model = self.cls(*default_model(6))
+        self.paths = dict((key, self.cls(*default_model(6)).find_path(seq))
+                          for key, seq in SEQS.items())
+
+    def search(self, *keys):
+        for key in keys:
+            self.assertEqual(self.model.find_path(SEQS[key]), self.paths[key])
+
+    def assertInfo(self, **info):
+        self.assertEqual(dict((key, self.model.cache_info()[key]) for key in info), info)
+
+    def assertHits(self, *keys):
+        """Searches the sequences, which must all find their tables in the
+        cache. An engine may look them up more than once per search."""
+        info = self.model.cache_info()
+        self.search(*keys)
+        self.assertGreaterEqual(self.model.cache_info()['hits'], info['hits'] + len(keys))
+        self.assertInfo(misses=info['misses'], size=info['size'])
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.model.cache_info(),
+                         {'hits':0, 'misses':0, 'size':0, 'maxSize':64})
+        self.search('abc', 'abd')
+        self.assertInfo(misses=2, size=2, maxSize=64)
+        self.assertHits('abc', 'abd', 'abc')
+        # compile() fills the same cache, whatever the order of the symbols.
+        compiled = self.model.compile('cba')
+        self.assertIs(compiled, self.model._compiled('ABC'))
+        self.assertInfo(misses=2, size=2)
+        self.model.compile('EBA')
+        self.assertInfo(misses=3, size=3)
+        self.assertHits('abe')
+
+    def test_eviction(self):
+        self.model.maxCachedAlphabets = 3
+        self.search('abc', 'abd', 'abe', 'abc', 'abf')
+        # 'abd' was the least recently used, so 'abf' took its place.
+        self.assertInfo(misses=4, size=3, maxSize=3)
+        self.assertHits('abc', 'abe', 'abf')
+        self.search('abd')
+        self.assertInfo(misses=5, size=3)
+        # Which pushed out 'abc', used longest ago.
+        self.assertHits('abe', 'abf', 'abd')
+        self.search('abc')
+        self.assertInfo(misses=6, size=3)
+
+    def test_minimum_size(self):
+        # The alphabet in use is always kept.
+        self.model.maxCachedAlphabets = 0
+        self.search('abc')
+        self.assertHits('abc')
+        self.search('abd', 'abc')
+        self.assertInfo(misses=3, size=1, maxSize=0)
+
+    def test_clear(self):
+        self.search('abc', 'abd')
+        self.model.clear_cache()
+        self.assertInfo(misses=2, size=0)
+        self.search('abc', 'abd')
+        self.assertInfo(misses=4, size=2)
+        self.assertHits('abc')
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CCompileCacheTest(CompileCacheMixin, unittest.TestCase):
+    cls = CHmm
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PyCompileCacheTest(CompileCacheMixin, unittest.TestCase):
+    cls = PyHmm
+
+if __name__ == '__main__':
+    unittest.main()
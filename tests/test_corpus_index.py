@@ -0,0 +1,78 @@
+"""A CorpusIndex should hold the same positions whether or not numpy is used,
+and the windows seeded from it should cover every match."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from helpers import random_model, random_sequence
+
+import patternHmm
+from patternHmm import CorpusIndex
+from patternHmm.src import corpusIndex, profileHmm_base
+
+ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+class WithoutNumpy(object):
+    """Hides numpy from the CorpusIndex and seeding code while in effect."""
+    def __enter__(self):
+        self.np = profileHmm_base.np
+        profileHmm_base.np = corpusIndex.np = None
+    def __exit__(self, *args):
+        profileHmm_base.np = corpusIndex.np = self.np
+
+def sparse_model(rand, modelSize):
+    """A model whose match states each emit a single symbol, so that few
+    places in a random corpus hold many of them."""
+    ems, trans = random_model(rand, modelSize, ALPHABET)
+    ems = dict((name, {rand.choice(ALPHABET):1.0}) for name in ems)
+    return patternHmm.Hmm(ems, trans)
+
+class CorpusIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        rand = random.Random(3)
+        self.corpus = random_sequence(rand, ALPHABET, 50000)
+        self.model = sparse_model(rand, 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_positions(self):
+        index = CorpusIndex(self.corpus)
+        for symb in ALPHABET + '#':
+            expected = [i for i, c in enumerate(self.corpus) if c == symb]
+            self.assertEqual(list(index.positions(symb)), expected)
+            self.assertEqual(index.count(symb), len(expected))
+        with WithoutNumpy():
+            plain = CorpusIndex(self.corpus)
+            for symb in ALPHABET:
+                self.assertEqual(list(plain.positions(symb)),
+                                 list(index.positions(symb)))
+
+    def test_save_and_load(self):
+        filename = os.path.join(self.dirname, 'corpus.idx')
+        index = CorpusIndex(self.corpus)
+        index.save(filename)
+        loaded = CorpusIndex.load(filename)
+        try:
+            self.assertEqual(loaded.sequence(), self.corpus)
+            for symb in ALPHABET:
+                self.assertEqual(list(loaded.positions(symb)),
+                                 list(index.positions(symb)))
+            self.assertEqual(self.model.find_matches_indexed(loaded, 14),
+                             self.model.find_matches_indexed(index, 14))
+        finally:
+            loaded.close()
+
+    def test_seed_windows(self):
+        index = CorpusIndex(self.corpus)
+        for minimumMatches in (12, 14, 16, 18):
+            windows = self.model._seedWindows(index, minimumMatches)
+            with WithoutNumpy():
+                plain = self.model._seedWindows(CorpusIndex(self.corpus),
+                                                minimumMatches)
+            self.assertEqual(windows, plain)
+
+if __name__ == '__main__':
+    unittest.main()
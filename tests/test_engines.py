@@ -0,0 +1,26 @@
+"""The C and NumPy versions of the Viterbi algorithm should find exactly the
+same paths, including where several paths have the same score."""
+import unittest
+from helpers import SamePathsMixin
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+@unittest.skipIf(CHmm is None or PyHmm is None, 'needs the C extension and numpy')
+class EngineAgreementTest(SamePathsMixin, unittest.TestCase):
+    randomCases, deleteCases, tiedCases, seqsPerCase = 40, 10, 30, 4
+
+    def assertSamePaths(self, ems, trans, seqs):
+        cModel, pyModel = CHmm(ems, trans), PyHmm(ems, trans)
+        expected = [cModel.find_path(seq) for seq in seqs]
+        self.assertEqual([pyModel.find_path(seq) for seq in seqs], expected)
+        self.assertEqual(pyModel.find_paths_many(seqs, workers=1), expected)
+
+if __name__ == '__main__':
+    unittest.main()
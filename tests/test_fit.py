@@ -0,0 +1,114 @@
+"""The expected counts of Baum-Welch training are the derivatives of the log of
+the total probability of the sequences by the log of each probability, which
+can be checked by finite differences."""
+import copy
+import math
+import random
+import unittest
+from helpers import random_model, random_sequence
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+STEP = 1e-5
+
+def expected_counts(cls, ems, trans, seqs):
+    """Returns the log probability of the sequences and the expected counts of
+    each transition and emission."""
+    model = cls(ems, trans)
+    symbols = sorted(set(''.join(seqs)))
+    encoder = model._compiled(symbols)[0]
+    encoded = [model._sequenceToInts(encoder, seq) for seq in seqs]
+    score, transCounts, emCounts = model._countGroup(encoded, symbols, True)
+    return model, symbols, score, list(transCounts), list(emCounts)
+
+class GradientMixin(object):
+    def assertCountsAreGradients(self, ems, trans, seqs):
+        model, symbols, score, transCounts, emCounts = expected_counts(
+            self.cls, ems, trans, seqs)
+        def derivative(probs, key):
+            scores = []
+            for step in (STEP, -STEP):
+                changed = copy.deepcopy(probs)
+                changed[key[0]][key[1]] *= math.exp(step)
+                if probs is trans:
+                    scores.append(expected_counts(self.cls, ems, changed, seqs)[2])
+                else:
+                    scores.append(expected_counts(self.cls, changed, trans, seqs)[2])
+            return (scores[0] - scores[1]) / (2 * STEP)
+        for (a, b), count in zip(model._transitionPairs(), transCounts):
+            if trans.get(a, {}).get(b):
+                self.assertAlmostEqual(count, derivative(trans, (a, b)), 5)
+            else:
+                self.assertEqual(count, 0.0)
+        for j in range(model.modelSize):
+            name = 'M%i' % (j+1)
+            for k, symb in enumerate(symbols):
+                count = emCounts[j*len(symbols) + k]
+                if symb in ems[name]:
+                    self.assertAlmostEqual(count, derivative(ems, (name, symb)), 5)
+                else:
+                    self.assertEqual(count, 0.0)
+
+    def test_gradients(self):
+        for case in range(3):
+            rand = random.Random(case)
+            ems, trans = random_model(rand, 4, 'ABCD')
+            seqs = [random_sequence(rand, 'ABCD', rand.randint(5, 30))
+                    for k in range(2)]
+            self.assertCountsAreGradients(ems, trans, seqs)
+
+    def test_fit(self):
+        rand = random.Random(1)
+        ems, trans = random_model(rand, 5, 'ABCD')
+        seqs = [random_sequence(rand, 'ABCD', 40) for k in range(4)]
+        scores = self.cls(ems, trans).fit(seqs, iterations=3, viterbiIterations=1,
+                                          workers=1)
+        self.assertEqual(len(scores), 4)
+
+    def test_viterbi_training(self):
+        # Each round of Viterbi training makes the best path it counted at
+        # least as likely, so without pseudocounts the score never falls.
+        for case in range(3):
+            rand = random.Random(case)
+            ems, trans = random_model(rand, 6, 'ABCD')
+            for probs in list(ems.values()) + list(trans.values()):
+                total = sum(probs.values())
+                for key in probs: probs[key] /= total
+            seqs = [random_sequence(rand, 'ABCD', 60) for k in range(4)]
+            scores = self.cls(ems, trans).fit(seqs, iterations=0, viterbiIterations=6,
+                                              pseudocount=0.0, workers=1)
+            for before, after in zip(scores, scores[1:]):
+                self.assertGreaterEqual(after, before - 1e-9)
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CGradientTest(GradientMixin, unittest.TestCase):
+    cls = CHmm
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PyGradientTest(GradientMixin, unittest.TestCase):
+    cls = PyHmm
+
+@unittest.skipIf(CHmm is None or PyHmm is None, 'needs the C extension and numpy')
+class EngineCountsTest(unittest.TestCase):
+    def test_same_counts(self):
+        for case in range(5):
+            rand = random.Random(case)
+            ems, trans = random_model(rand, rand.randint(2, 20), 'ABCDEF')
+            seqs = [random_sequence(rand, 'ABCDEF', rand.randint(1, 80))
+                    for k in range(3)]
+            cCounts = expected_counts(CHmm, ems, trans, seqs)[2:]
+            pyCounts = expected_counts(PyHmm, ems, trans, seqs)[2:]
+            self.assertAlmostEqual(cCounts[0], pyCounts[0], 9)
+            for cs, pys in zip(cCounts[1:], pyCounts[1:]):
+                for c, py in zip(cs, pys):
+                    self.assertAlmostEqual(c, py, 9)
+
+if __name__ == '__main__':
+    unittest.main()
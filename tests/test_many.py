@@ -0,0 +1,94 @@
+"""find_paths_many and find_matches_many group, batch and share out their
+sequences, and should return exactly what find_path and find_matches give
+for each sequence on its own, in the same order."""
+import random
+import unittest
+from helpers import model_cases, default_model, random_sequence, gapped_copies
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm, Viterbi
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+def mixed_sequences(seed, count=12):
+    """Returns gapped copies of the default pattern among noise drawn from
+    several alphabets, so that they fall into different groups, along with
+    some empty sequences."""
+    rand = random.Random(seed)
+    noises = ('XYZ', 'XYZAB', 'MNOPQRST', 'ab', 'A')
+    seqs = [gapped_copies(rand, 'ABCDEFGHIJKL', rand.choice(noises),
+                          rand.randint(1, 6)) for k in range(count)]
+    seqs[3] = seqs[7] = ''
+    seqs[5] = seqs[2].lower()
+    return seqs
+
+class ManyMixin(object):
+    def assertSameResults(self, model, seqs, minimumMatches=None):
+        paths = [model.find_path(seq) for seq in seqs]
+        matches = [model.find_matches(seq, minimumMatches) for seq in seqs]
+        for workers in (1, 3):
+            self.assertEqual(model.find_paths_many(seqs, workers=workers), paths)
+            self.assertEqual(model.find_matches_many(seqs, minimumMatches,
+                                                     workers=workers), matches)
+
+    def test_mixed_alphabets(self):
+        model = self.cls(*default_model(12))
+        for seed in range(5):
+            self.assertSameResults(model, mixed_sequences(seed))
+            self.assertSameResults(model, mixed_sequences(seed), 9)
+
+    def test_small_batches(self):
+        model = self.cls(*default_model(12))
+        model.batchSize = 2
+        for seed in range(3):
+            self.assertSameResults(model, mixed_sequences(seed, 20))
+
+    def test_random_models(self):
+        for ems, trans, seqs in model_cases('random', 5, 6):
+            self.assertSameResults(self.cls(ems, trans), seqs)
+
+    def test_prefilter(self):
+        model = self.cls(*default_model(12))
+        model.prefilterThreshold = 2
+        for seed in range(3):
+            self.assertSameResults(model, mixed_sequences(seed))
+
+    def test_generator(self):
+        model = self.cls(*default_model(12))
+        seqs = mixed_sequences(0)
+        self.assertEqual(model.find_paths_many(iter(seqs), workers=2),
+                         [model.find_path(seq) for seq in seqs])
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CManyTest(ManyMixin, unittest.TestCase):
+    cls = CHmm
+
+    def test_find_paths(self):
+        # Viterbi.findPaths should find the path findPath finds for each of
+        # the encoded sequences, checkpointed or not and at every precision.
+        rand = random.Random(0)
+        model = CHmm(*default_model(12))
+        symbols = 'ABCDEFGHIJKLXYZ'
+        encoder, compiled = model._compiled(symbols)
+        seqs = [model._sequenceToInts(encoder, gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZ', 5))
+                for k in range(10)]
+        seqs.append(model._sequenceToInts(encoder, random_sequence(rand, symbols, 1)))
+        for precision in (0, 1, 2):
+            expected = [Viterbi.findPath(seq, compiled, 0, precision) for seq in seqs]
+            for maxBytes in (2**30, model.modelSize):
+                self.assertEqual(Viterbi.findPaths(seqs, compiled, maxBytes, precision),
+                                 expected)
+        self.assertEqual(Viterbi.findPaths([], compiled, 2**30, 0), [])
+        self.assertRaises(TypeError, Viterbi.findPaths, 5, compiled, 2**30, 0)
+        self.assertRaises(ValueError, Viterbi.findPaths, [[0, 15]], compiled, 2**30, 0)
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PyManyTest(ManyMixin, unittest.TestCase):
+    cls = PyHmm
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""find_match_spans should find exactly the matches of find_matches, with or
+without the prefilter, and score them as ModelLibrary.scan() does."""
+import random
+import unittest
+from helpers import default_model, gapped_copies
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+def spans_of(matches):
+    """The spans of the (states, (index, symbols)) lists of find_matches."""
+    return [(index, index + len(symbs), states.count('M'))
+            for states, (index, symbs) in zip(*matches)]
+
+def triples(spans):
+    return [tuple(spans[k:k+3]) for k in range(0, len(spans), 3)]
+
+class MatchSpansMixin(object):
+    def sequences(self):
+        for case in range(10):
+            rand = random.Random(case)
+            yield ''.join(gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZAB', 1, 0.4) +
+                          gapped_copies(rand, 'XYZAB', 'XYZAB', 3)
+                          for k in range(8)).lower()
+
+    def assertSameSpans(self, model, minimumMatches):
+        for seq in self.sequences():
+            matches = model.find_matches(seq, minimumMatches)
+            spans = model.find_match_spans(seq, minimumMatches)
+            self.assertEqual(triples(spans), spans_of(matches))
+            scored, scores = model.find_match_spans(seq, minimumMatches, scores=True)
+            self.assertEqual(scored, spans)
+            numSymbols = len(set(model._cleanSequence(seq)))
+            self.assertEqual(list(scores),
+                             [model._scoreMatch(states, symbs, numSymbols)
+                              for states, (index, symbs) in zip(*matches)])
+
+    def test_spans(self):
+        model = self.cls(*default_model(12))
+        for minimumMatches in (None, 3, 9):
+            self.assertSameSpans(model, minimumMatches)
+
+    def test_prefilter(self):
+        model = self.cls(*default_model(12))
+        model.prefilterThreshold = 2
+        for minimumMatches in (None, 3, 9):
+            self.assertSameSpans(model, minimumMatches)
+
+    def test_empty(self):
+        model = self.cls(*default_model(12))
+        self.assertEqual(list(model.find_match_spans('')), [])
+        self.assertEqual(map(list, model.find_match_spans('', scores=True)), [[], []])
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CMatchSpansTest(MatchSpansMixin, unittest.TestCase):
+    cls = CHmm
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PyMatchSpansTest(MatchSpansMixin, unittest.TestCase):
+    cls = PyHmm
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""A ModelLibrary should find and score the same matches as each of its models
+does on its own, keep only the best of overlapping matches when asked, and
+load model files without them taking the place of the modules they happen to
+be named after."""
+import math
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import unittest
+from helpers import default_model, gapped_copies
+
+import patternHmm
+from patternHmm import ModelLibrary
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+def sequences():
+    for case in range(5):
+        rand = random.Random(case)
+        yield ''.join(gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZ', 1, 0.2) +
+                      gapped_copies(rand, 'ABCDE', 'XYZ', 2, 0.1)
+                      for k in range(10))
+
+def overlap(a, b):
+    return a[1] < b[1] + len(b[3]) and b[1] < a[1] + len(a[3])
+
+class ScanMixin(object):
+    def library(self):
+        models = [('long', self.cls(*default_model(12))),
+                  ('short', self.cls(*default_model(5))),
+                  ('filtered', self.cls(*default_model(8)))]
+        models[2][1].prefilterThreshold = 2
+        return ModelLibrary(models)
+
+    def test_scan(self):
+        library = self.library()
+        for seq in sequences():
+            symbols = len(set(seq))
+            expected = []
+            for name, model in library.models.items():
+                for states, (index, symbs) in zip(*model.find_matches(seq)):
+                    expected.append((name, index, states, symbs,
+                                     model._scoreMatch(states, symbs, symbols)))
+            expected.sort(key=lambda match: (match[1], match[0]))
+            self.assertEqual(library.scan(seq, workers=1), expected)
+            self.assertEqual(library.scan(seq, workers=3), expected)
+
+    def test_best_only(self):
+        library = self.library()
+        for seq in sequences():
+            matches = library.scan(seq, workers=1)
+            best = library.scan(seq, bestOnly=True, workers=1)
+            self.assertTrue(all(match in matches for match in best))
+            self.assertLess(len(best), len(matches))
+            self.assertEqual(best, sorted(best, key=lambda match: (match[1], match[0])))
+            for k, match in enumerate(best):
+                for other in best[k+1:]:
+                    self.assertFalse(overlap(match, other))
+            # Every match left out overlaps a kept one that scores at least
+            # as much.
+            for match in matches:
+                if match not in best:
+                    self.assertTrue(any(overlap(match, kept) and kept[4] >= match[4]
+                                        for kept in best))
+            self.assertTrue(any(match[0] == 'long' for match in best))
+
+    def test_score_exact_match(self):
+        # The only path through the model emitting the whole pattern enters
+        # at the first match state and leaves from the last.
+        model = self.cls(*default_model(12))
+        for numSymbols in (12, 17, 26):
+            expected = (math.log(0.05) + 11 * math.log(0.6) + math.log(0.9) +
+                        12 * math.log(numSymbols))
+            self.assertAlmostEqual(model._scoreMatch('M' * 12, 'ABCDEFGHIJKL',
+                                                     numSymbols), expected, 9)
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CScanTest(ScanMixin, unittest.TestCase):
+    cls = CHmm
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PyScanTest(ScanMixin, unittest.TestCase):
+    cls = PyHmm
+
+class FromFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_module_names(self):
+        filenames = [os.path.join(self.dirname, name + '.py')
+                     for name in ('random', 'string')]
+        for modelSize, filename in zip((5, 8), filenames):
+            patternHmm.generate_model_file(modelSize, filename)
+        library = ModelLibrary.from_files(filenames)
+        for module in (random, string):
+            self.assertIs(sys.modules[module.__name__], module)
+            self.assertFalse(hasattr(module, 'model'))
+        self.assertEqual([(name, model.modelSize) for name, model in library.models.items()],
+                         [('random', 5), ('string', 8)])
+
+if __name__ == '__main__':
+    unittest.main()
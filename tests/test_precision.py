@@ -0,0 +1,67 @@
+"""The single and int16 precisions should find the same scores as doubles, to
+within their rounding, and mostly the same paths; they may only differ where
+two paths nearly tie."""
+import random
+import unittest
+from helpers import random_model, default_model, random_sequence, gapped_copies
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm, Viterbi
+except ImportError:
+    CHmm = None
+
+# Each score added up in int16 is rounded to within 1/256, and a residue on the
+# best path adds an emission and a few transitions, so the best score of a
+# column may drift by up to a few 1/256ths per residue.
+INT16_TOLERANCE = 1 / 64.0
+SINGLE_TOLERANCE = 1e-4
+# The share of random sequences whose path may differ from the double's.
+MAX_DIFFERENT = 0.25
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class PrecisionTest(unittest.TestCase):
+    def finalScores(self, model, seq, symbols, precision):
+        """Returns the best score of the last column of the matrix, and the
+        path found, in the given precision."""
+        encoder, compiled = model._compiled(symbols)
+        encoded = model._sequenceToInts(encoder, seq)
+        column = Viterbi.findPathChunk(encoded, compiled, None, '', False,
+                                       CHmm._precisions[precision])[1]
+        return max(column), Viterbi.findPath(encoded, compiled, 0,
+                                             CHmm._precisions[precision])
+
+    def assertCloseToDouble(self, precision, tolerance):
+        different = 0
+        cases = 100
+        for case in range(cases):
+            rand = random.Random(case)
+            model = CHmm(*random_model(rand, rand.randint(2, 60), 'ABCDEF'))
+            seq = random_sequence(rand, 'ABCDEF', rand.randint(1, 400))
+            score, path = self.finalScores(model, seq, 'ABCDEF', 'double')
+            reduced, reducedPath = self.finalScores(model, seq, 'ABCDEF', precision)
+            self.assertAlmostEqual(reduced, score, delta=tolerance * len(seq))
+            different += (reducedPath != path)
+        self.assertLessEqual(different, MAX_DIFFERENT * cases)
+
+    def test_int16(self):
+        self.assertCloseToDouble('int16', INT16_TOLERANCE)
+
+    def test_single(self):
+        self.assertCloseToDouble('single', SINGLE_TOLERANCE)
+
+    def test_checkpointed(self):
+        # The checkpointed traceback refills the matrix in the same precision,
+        # so it finds the same paths as the full one.
+        ems, trans = default_model(12)
+        for precision in ('single', 'int16'):
+            for case in range(10):
+                rand = random.Random(case)
+                seq = gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZAB', 40)
+                model = CHmm(ems, trans)
+                model.scorePrecision = precision
+                path = model.find_path(seq)
+                model.maxPathsBytes = 12 * 20
+                self.assertEqual(model.find_path(seq), path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""The cache of results should return the paths the Viterbi algorithm finds,
+keep within its limits, count its hits and misses, share paths through
+resultCacheDir, and forget them when the model changes."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from helpers import default_model, gapped_copies
+
+import patternHmm
+from patternHmm.src import profileHmm_base
+
+def sequences(count, copies=5):
+    rand = random.Random(0)
+    return [gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZAB', copies)
+            for k in range(count)]
+
+def stored_files(dirname):
+    return [name for dirpath, dirnames, filenames in os.walk(dirname)
+            for name in filenames]
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.seqs = sequences(6)
+        self.expected = [patternHmm.Hmm(*default_model(12)).find_path(seq)
+                         for seq in self.seqs]
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def cachingModel(self, **attribs):
+        model = patternHmm.Hmm(*default_model(12))
+        model.resultCacheSize = 100
+        for name, value in attribs.items():
+            setattr(model, name, value)
+        return model
+
+    def assertCounts(self, model, **counts):
+        info = model.result_cache_info()
+        self.assertEqual(dict((key, info[key]) for key in counts), counts)
+
+    def test_hits_and_misses(self):
+        model = self.cachingModel()
+        self.assertEqual([model.find_path(seq) for seq in self.seqs], self.expected)
+        self.assertCounts(model, hits=0, misses=6, diskHits=0, evictions=0, size=6)
+        self.assertEqual([model.find_path(seq) for seq in self.seqs], self.expected)
+        self.assertCounts(model, hits=6, misses=6, diskHits=0, evictions=0)
+        self.assertEqual(model.result_cache_info()['hitRate'], 0.5)
+        self.assertEqual(model.result_cache_info()['bytes'],
+                         sum(len(path) for path in self.expected))
+        model.clear_result_cache()
+        self.assertCounts(model, hits=0, misses=0, size=0, bytes=0)
+
+    def test_count_eviction(self):
+        model = self.cachingModel(resultCacheSize=4)
+        for seq in self.seqs:
+            model.find_path(seq)
+        self.assertCounts(model, misses=6, evictions=2, size=4)
+        # The least recently used were dropped: the first two sequences.
+        model.find_path(self.seqs[5])
+        model.find_path(self.seqs[0])
+        self.assertCounts(model, hits=1, misses=7, evictions=3, size=4)
+        model.find_path(self.seqs[0])
+        self.assertCounts(model, hits=2, misses=7)
+
+    def test_byte_eviction(self):
+        limit = sum(len(path) for path in self.expected[:3])
+        model = self.cachingModel(resultCacheBytes=limit)
+        for seq in self.seqs:
+            model.find_path(seq)
+        info = model.result_cache_info()
+        self.assertLessEqual(info['bytes'], limit)
+        self.assertEqual(info['evictions'], 6 - info['size'])
+        self.assertEqual(info['bytes'], sum(len(path) for path in
+                                            self.expected[6 - info['size']:]))
+
+    def test_disk_hits(self):
+        model = self.cachingModel(resultCacheDir=self.dirname)
+        for seq in self.seqs:
+            model.find_path(seq)
+        self.assertEqual(len(stored_files(self.dirname)), 6)
+        # Another instance of the same model finds the stored paths.
+        other = self.cachingModel(resultCacheDir=self.dirname, resultCacheSize=0)
+        self.assertEqual([other.find_path(seq) for seq in self.seqs], self.expected)
+        self.assertCounts(other, hits=0, diskHits=6, misses=0)
+        # find_matches goes through the cache too.
+        self.assertEqual(other.find_matches(self.seqs[0]),
+                         patternHmm.Hmm(*default_model(12)).find_matches(self.seqs[0]))
+        self.assertCounts(other, diskHits=7, misses=0)
+
+    def test_failed_store(self):
+        # A path that can't be written is not stored, and leaves no file.
+        def fullDisk(fd, mode):
+            os.close(fd)
+            raise IOError(28, 'No space left on device')
+        fdopen = profileHmm_base.os.fdopen
+        profileHmm_base.os.fdopen = fullDisk
+        try:
+            model = self.cachingModel(resultCacheDir=self.dirname)
+            self.assertEqual(model.find_path(self.seqs[0]), self.expected[0])
+        finally:
+            profileHmm_base.os.fdopen = fdopen
+        self.assertEqual(stored_files(self.dirname), [])
+        self.assertCounts(model, misses=1, size=1)
+
+    def test_fit_invalidates(self):
+        model = self.cachingModel(resultCacheDir=self.dirname)
+        for seq in self.seqs:
+            model.find_path(seq)
+        model.fit(sequences(4, 1), iterations=0, viterbiIterations=1, workers=1)
+        fitted = patternHmm.Hmm(model.rawMatchEmissions, model.transProbs)
+        self.assertEqual([model.find_path(seq) for seq in self.seqs],
+                         [fitted.find_path(seq) for seq in self.seqs])
+        self.assertCounts(model, hits=0, diskHits=0, misses=6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""A model read back by load() should score every path exactly as the model
+that was saved, so that it finds the same paths even where several tie."""
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import unittest
+from helpers import random_model, default_model, random_sequence, gapped_copies
+
+import patternHmm
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+def as_list(scores):
+    """The emission scores as a list, from a list or a numpy array."""
+    return scores.tolist() if hasattr(scores, 'tolist') else list(scores)
+
+class SaveLoadMixin(object):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def assertSameModel(self, ems, trans, seqs):
+        model = self.cls(ems, trans)
+        filename = os.path.join(self.dirname, 'model.phmm')
+        model.save(filename)
+        loaded = self.cls.load(filename)
+        self.assertEqual(loaded.rawMatchEmissions, model.rawMatchEmissions)
+        symbols = sorted(set(''.join(seqs)))
+        self.assertEqual(as_list(loaded._setupEmissions(symbols)),
+                         as_list(model._setupEmissions(symbols)))
+        self.assertEqual([loaded.find_path(seq) for seq in seqs],
+                         [model.find_path(seq) for seq in seqs])
+
+    def test_random_models(self):
+        for case in range(10):
+            rand = random.Random(case)
+            ems, trans = random_model(rand, rand.randint(2, 30), 'ABCDEF')
+            seqs = [random_sequence(rand, 'ABCDEF', rand.randint(1, 200))
+                    for k in range(3)]
+            self.assertSameModel(ems, trans, seqs)
+
+    def test_tied_paths(self):
+        ems, trans = default_model(12)
+        for case in range(10):
+            rand = random.Random(case)
+            seqs = [gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZAB', 20)
+                    for k in range(3)]
+            self.assertSameModel(ems, trans, seqs)
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CSaveLoadTest(SaveLoadMixin, unittest.TestCase):
+    cls = CHmm
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PySaveLoadTest(SaveLoadMixin, unittest.TestCase):
+    cls = PyHmm
+
+class ConvertModelFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_convert(self):
+        # The model file is named after a module, which it mustn't replace.
+        filename = os.path.join(self.dirname, 'string.py')
+        patternHmm.generate_model_file(12, filename)
+        patternHmm.convert_model_file(filename)
+        self.assertIs(sys.modules['string'], string)
+        self.assertFalse(hasattr(string, 'model'))
+        loaded = patternHmm.Hmm.load(os.path.join(self.dirname, 'string.phmm'))
+        model = patternHmm.Hmm(*default_model(12))
+        rand = random.Random(0)
+        for k in range(5):
+            seq = gapped_copies(rand, 'ABCDEFGHIJKL', 'XYZAB', 20)
+            self.assertEqual(loaded.find_path(seq), model.find_path(seq))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Viterbi.findPath should read a sequence of symbol indices from a list or
+from any buffer of integers, and refuse anything else."""
+import array
+import unittest
+from helpers import default_model
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm, Viterbi
+except ImportError:
+    CHmm = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SYMBOLS = [0, 1, 2, 3, 4, 4, 0, 1, 2, 3, 1, 4, 0, 0, 2]
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class SequenceInputTest(unittest.TestCase):
+    def setUp(self):
+        model = CHmm(*default_model(5))
+        self.compiled = model._compiled('ABCDE')[1]
+        self.path = Viterbi.findPath(SYMBOLS, self.compiled)
+
+    def assertSamePath(self, seq):
+        self.assertEqual(Viterbi.findPath(seq, self.compiled), self.path)
+
+    def test_buffers(self):
+        self.assertSamePath(''.join(map(chr, SYMBOLS)))
+        self.assertSamePath(bytearray(SYMBOLS))
+        self.assertSamePath(memoryview(bytearray(SYMBOLS)))
+        for typecode in 'bBhHiIlL':
+            self.assertSamePath(array.array(typecode, SYMBOLS))
+
+    @unittest.skipIf(np is None, 'needs numpy')
+    def test_numpy(self):
+        for dtype in (np.int8, np.uint8, np.int16, np.int32, np.int64):
+            self.assertSamePath(np.array(SYMBOLS, dtype))
+
+    def test_rejected(self):
+        for seq in (array.array('d', SYMBOLS), array.array('f', SYMBOLS),
+                    [float(symbol) for symbol in SYMBOLS], None):
+            self.assertRaises(TypeError, Viterbi.findPath, seq, self.compiled)
+        for seq in (SYMBOLS + [5], [-1], [2**70], array.array('i', SYMBOLS + [5]),
+                    array.array('b', [-1]), bytearray([5]), 'ABC'):
+            self.assertRaises(ValueError, Viterbi.findPath, seq, self.compiled)
+
+    @unittest.skipIf(np is None, 'needs numpy')
+    def test_numpy_rejected(self):
+        self.assertRaises(TypeError, Viterbi.findPath, np.array(SYMBOLS, float),
+                          self.compiled)
+        self.assertRaises(TypeError, Viterbi.findPath,
+                          np.array([SYMBOLS, SYMBOLS], np.int32), self.compiled)
+        self.assertRaises(ValueError, Viterbi.findPath, np.array(SYMBOLS) + 5,
+                          self.compiled)
+        # A strided view is not contiguous, so no buffer of it can be read.
+        self.assertRaises(ValueError, Viterbi.findPath,
+                          np.array(SYMBOLS * 2, np.int64)[::2], self.compiled)
+
+if __name__ == '__main__':
+    unittest.main()
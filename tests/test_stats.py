@@ -0,0 +1,91 @@
+"""With collectStats set, each public search call should make one record of
+the time spent in each phase and the work done, pass it to statsCallback,
+and add it to the totals of stats_info()."""
+import unittest
+from helpers import default_model
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+SEQ = 'xyzabcdefghijklxyzabdefgijkxyz'
+TIMED_KEYS = ('clean', 'encode', 'fill', 'traceback', 'total')
+
+class StatsMixin(object):
+    def setUp(self):
+        self.model = self.cls(*default_model(12))
+        self.model.collectStats = True
+        self.records = []
+        self.model.statsCallback = self.records.append
+
+    def assertRecord(self, record, call, *keys):
+        self.assertEqual(record['call'], call)
+        self.assertEqual(record['modelSize'], 12)
+        self.assertEqual(record['seqLength'], len(SEQ))
+        for key in TIMED_KEYS + keys:
+            self.assertGreaterEqual(record[key], 0.0)
+        self.assertEqual(record['cells'], len(SEQ) * 12)
+        self.assertGreater(record['matrixBytes'], 0)
+
+    def test_records(self):
+        self.model.find_path(SEQ)
+        self.assertEqual(len(self.records), 1)
+        self.assertRecord(self.records[0], 'find_path', 'compile')
+        # find_matches runs find_path within the same record.
+        self.model.find_matches(SEQ)
+        self.assertEqual(len(self.records), 2)
+        self.assertRecord(self.records[1], 'find_matches', 'matches')
+        self.assertNotIn('compile', self.records[1])
+        self.model.find_match_spans(SEQ)
+        self.assertEqual(len(self.records), 3)
+        self.assertRecord(self.records[2], 'find_match_spans', 'matches')
+
+    def test_prefilter(self):
+        self.model.prefilterThreshold = 2
+        self.model.find_matches(SEQ)
+        self.assertEqual(len(self.records), 1)
+        self.assertGreaterEqual(self.records[0]['prefilter'], 0.0)
+        self.assertLessEqual(self.records[0]['cells'], len(SEQ) * 12)
+
+    def test_totals(self):
+        for k in range(3):
+            self.model.find_path(SEQ)
+            self.model.find_matches(SEQ)
+        info = self.model.stats_info()
+        self.assertEqual(info['calls'], 6)
+        self.assertEqual(len(self.records), 6)
+        for key in ('cells', 'matrixBytes'):
+            self.assertEqual(info[key], sum(record[key] for record in self.records))
+        for key in TIMED_KEYS + ('matches',):
+            self.assertAlmostEqual(info[key], sum(record.get(key, 0)
+                                                  for record in self.records), 9)
+        self.model.reset_stats()
+        info = self.model.stats_info()
+        self.assertEqual(info['calls'], 0)
+        self.assertIsNone(info['cellsPerSecond'])
+
+    def test_off(self):
+        self.model.collectStats = False
+        self.model.find_matches(SEQ)
+        self.assertEqual(self.records, [])
+        self.assertEqual(self.model.stats_info()['calls'], 0)
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CStatsTest(StatsMixin, unittest.TestCase):
+    cls = CHmm
+
+    def test_load(self):
+        self.model.find_path(SEQ)
+        self.assertGreaterEqual(self.records[0]['load'], 0.0)
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PyStatsTest(StatsMixin, unittest.TestCase):
+    cls = PyHmm
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""iter_matches reads its sequence a chunk at a time, and should yield exactly
+the matches find_matches finds in the whole sequence, however it is split."""
+import StringIO
+import random
+import unittest
+from helpers import model_cases
+
+try:
+    from patternHmm.profileHmm import Hmm as CHmm
+except ImportError:
+    CHmm = None
+try:
+    from patternHmm.pyProfileHmm import Hmm as PyHmm
+except ImportError:
+    PyHmm = None
+
+class StreamMixin(object):
+    chunkSizes = (1, 2, 7, 50)
+
+    def assertSameMatches(self, ems, trans, seqs, minimumMatches=None):
+        model = self.cls(ems, trans)
+        for seq in seqs:
+            seq = seq.lower()
+            expected = [(index, states, symbs) for states, (index, symbs) in
+                        zip(*model.find_matches(seq, minimumMatches))]
+            for chunkSize in self.chunkSizes:
+                sources = [seq, list(seq), StringIO.StringIO(seq)]
+                for source in sources:
+                    self.assertEqual(list(model.iter_matches(
+                        source, None, minimumMatches, chunkSize=chunkSize)), expected)
+                # An iterator of chunks can't be re-read for its alphabet.
+                chunks = (seq[i:i+chunkSize] for i in xrange(0, len(seq), chunkSize))
+                self.assertEqual(list(model.iter_matches(
+                    chunks, seq, minimumMatches, chunkSize=chunkSize)), expected)
+
+    def test_random_models(self):
+        for ems, trans, seqs in model_cases('random', 5, 2):
+            self.assertSameMatches(ems, trans, seqs)
+            self.assertSameMatches(ems, trans, seqs, 1)
+
+    def test_tied_paths(self):
+        for ems, trans, seqs in model_cases('tied', 5, 2):
+            self.assertSameMatches(ems, trans, seqs)
+            self.assertSameMatches(ems, trans, seqs, 9)
+
+    def test_alphabet_needed(self):
+        model = self.cls(*next(model_cases('tied', 1))[:2])
+        self.assertRaises(TypeError, list, model.iter_matches(iter(['ABC', 'DEF'])))
+
+@unittest.skipIf(CHmm is None, 'needs the C extension')
+class CStreamTest(StreamMixin, unittest.TestCase):
+    cls = CHmm
+
+@unittest.skipIf(PyHmm is None, 'needs numpy')
+class PyStreamTest(StreamMixin, unittest.TestCase):
+    # The NumPy version is slow enough to try just one chunk size.
+    cls, chunkSizes = PyHmm, (7,)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Searching only the windows picked by the ungapped prefilter or a
+CorpusIndex should find the same matches as searching the whole sequence,
+where every match is strong enough to be seeded."""
+import random
+import unittest
+from helpers import random_model, random_sequence, gapped_copies
+
+import patternHmm
+from patternHmm import CorpusIndex
+
+BACKGROUND = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def planted_case(seed, modelSize=10, copies=30):
+    """Returns a model with random probabilities that rarely leaves the random
+    state or inserts symbols, and a random sequence holding gapped copies of
+    its pattern."""
+    rand = random.Random(seed)
+    ems, trans = random_model(rand, modelSize, BACKGROUND)
+    pattern = ''.join(rand.choice(BACKGROUND) for j in range(modelSize))
+    for j, symb in enumerate(pattern):
+        ems['M%i' % (j+1)] = {symb:0.5 + rand.random()}
+    trans['R'] = {'R':0.95 + 0.04 * rand.random(), 'M1':0.02, 'D1':0.002}
+    for j in range(1, modelSize):
+        trans['M%i' % j]['I%i' % j] *= 0.1
+        trans['I%i' % j]['I%i' % j] *= 0.1
+    parts = []
+    for k in range(copies):
+        parts.append(random_sequence(rand, BACKGROUND, rand.randint(0, 80)))
+        parts.append(gapped_copies(rand, pattern, BACKGROUND, 1, 0.15))
+    return patternHmm.Hmm(ems, trans), ''.join(parts)
+
+class WindowMatchesTest(unittest.TestCase):
+    def test_prefilter(self):
+        for seed in range(20):
+            model, seq = planted_case(seed)
+            full = model.find_matches(seq, 4)
+            self.assertTrue(full[0])
+            for threshold in (1, 2):
+                model.prefilterThreshold = threshold
+                self.assertEqual(model.find_matches(seq, 4), full)
+            # A higher threshold may miss weak matches, but finds no others.
+            fullMatches = zip(*full)
+            for threshold in (4, 8):
+                model.prefilterThreshold = threshold
+                for match in zip(*model.find_matches(seq, 4)):
+                    self.assertIn(match, fullMatches)
+
+    def test_indexed(self):
+        for seed in range(20):
+            model, seq = planted_case(seed)
+            index = CorpusIndex(seq)
+            for minimumMatches in (4, 6):
+                self.assertEqual(model.find_matches_indexed(index, minimumMatches),
+                                 model.find_matches(seq, minimumMatches))
+
+if __name__ == '__main__':
+    unittest.main()